@@ -3,4 +3,5 @@
 BASEDIR=$(dirname $0)
 cd $BASEDIR/src
 
-while :; do python app.py; sleep 5; done
+# gunicorn restarts workers that exit, and starts the scrape job workers
+exec gunicorn -c gunicorn.conf.py wsgi:application
@@ -3,12 +3,22 @@ import dash
 import dash_bootstrap_components as dbc
 import numpy as np
 import plotly.graph_objs as go
+from flask import Response, g, jsonify, request
 from dash import Input, Output, State, dcc, html, dash_table
 from config import *
-from utils import get_table_type
+from utils import get_table_type, query_table_frame
 from shareholding_display import ShareholdingDisplay
+from webdriver_pool import get_webdriver_pool
+from db import get_connection_pool
+from result_cache import get_result_cache
+from market_scan import get_market_scan, pull_top_market_scan_results
+from participant_holdings import pull_participant_holdings, pull_participant_holding_changes
+from scrape_jobs import ScrapeJobQueue, start_scrape_job_workers
+from trend_figure import build_trend_figure
+from instrumentation import timed, get_stage_histograms, get_request_profiler
 
-app = dash.Dash(external_stylesheets=[dbc.themes.BOOTSTRAP])
+# Callbacks of the market scan and participant tabs refer to elements rendered with the tab
+app = dash.Dash(external_stylesheets=[dbc.themes.BOOTSTRAP], suppress_callback_exceptions=True)
 
 controls = dbc.Card(
     [
@@ -55,6 +65,22 @@ controls = dbc.Card(
                 ),
             ]
         ),
+        html.Div(
+            [
+                dbc.Label('Transaction Finder Only: Matching Mode',
+                          style=dict(marginRight=10)),
+                dcc.Dropdown(
+                    id='match-mode',
+                    options=[
+                        {'label': 'Exact (equal and opposite quantities)', 'value': 'exact'},
+                        {'label': 'Tolerance (near-equal quantities)', 'value': 'tolerance'},
+                        {'label': 'Split (near-equal quantities and one-to-two splits)', 'value': 'split'},
+                    ],
+                    value=TRANSACTION_MATCH_MODE,
+                    clearable=False,
+                ),
+            ]
+        ),
     ],
     body=True,
 )
@@ -63,6 +89,10 @@ app.title = 'HKEX CCASS Shareholding Dashboard'
 app.layout = dbc.Container(
     [
         dcc.Store(id='store'),
+        # Inputs of the last request while its missing dates are scraped in the background
+        dcc.Store(id='scrape-request'),
+        dcc.Interval(id='scrape-progress-interval',
+                     interval=SCRAPE_PROGRESS_INTERVAL_MILLISECONDS, disabled=True),
         html.H1('HKEX CCASS Shareholding Dashboard'),
         html.Hr(),
         controls,
@@ -73,10 +103,13 @@ app.layout = dbc.Container(
             id='generate-button',
             className='mb-3',
         ),
+        html.Div(id='scrape-progress', className='mb-3'),
         dbc.Tabs(
             [
                 dbc.Tab(label='Trend Plot', tab_id='trend-tab'),
                 dbc.Tab(label='Transaction Finder', tab_id='finder-tab'),
+                dbc.Tab(label='Market Scan', tab_id='market-tab'),
+                dbc.Tab(label='Participant Holdings', tab_id='participant-tab'),
             ],
             id='tabs',
             active_tab='trend-tab',
@@ -86,85 +119,246 @@ app.layout = dbc.Container(
 )
 
 
+def render_scrape_progress(progress: dict) -> list:
+    # Progress bar of the background scrape jobs of a request
+    n_finished = progress['total'] - progress['remaining']
+    return [
+        html.Small(f'Scraping missing dates in the background, the tabs are updated as they are stored. '
+                   f'{n_finished}/{progress["total"]} dates scraped.'),
+        dbc.Progress(value=100 * n_finished / progress['total'] if progress['total'] else 0, striped=True, animated=True)
+    ]
+
+
+def get_tab_data_key(store: dict, tab: str) -> tuple:
+    # Result cache key of the tab data of the request in the dcc.Store
+    return ('view', store['stock_code'], store['start_date'], store['end_date'], store['threshold_percentage'],
+            store['match_mode'], store['generated_at'], tab)
+
+
+def load_tab_data(store: dict, tab: str) -> dict:
+    """ Returns the tab data of the request in the dcc.Store, kept on the server.
+
+    Served from the result cache, or regenerated from the stored data after it was evicted.
+
+    Args:
+        store (dict): dcc.Store containing the request generated by the generate_data() callback.
+        tab (str): 'trend' or 'finder'.
+
+    Returns:
+        dict: Output of ShareholdingDisplay.generate_trend_tab_data() or generate_finder_tab_data().
+
+    """
+    tab_data = get_result_cache().get(get_tab_data_key(store, tab)) if USE_RESULT_CACHE else None
+    if tab_data is None:
+        sd = ShareholdingDisplay(
+            start_date=pd.Timestamp(store['start_date']),
+            end_date=pd.Timestamp(store['end_date']),
+            stock_code=store['stock_code'],
+            threshold_percentage=store['threshold_percentage'],
+            match_mode=store['match_mode'],
+            scrape_missing=False
+        )
+        tab_data = sd.generate_trend_tab_data() if tab == 'trend' else sd.generate_finder_tab_data()
+    return tab_data
+
+
+def render_data_table(table_id: str, df: pd.DataFrame) -> dash_table.DataTable:
+    # Rows are paged, filtered and sorted on the server by the update_data_table() callbacks
+    return dash_table.DataTable(
+        id=table_id,
+        columns=[
+            {'name': i, 'id': i, 'type': get_table_type(df[i])} for i in df.columns
+        ],
+        page_current=0,
+        page_size=DASH_TABLE_PAGE_SIZE,
+        page_action='custom',
+        filter_action='custom',
+        filter_query='',
+        sort_action='custom',
+        sort_mode='multi',
+        sort_by=[]
+    )
+
+
 @app.callback(
     Output('store', 'data'),
+    Output('scrape-request', 'data'),
+    Output('scrape-progress-interval', 'disabled'),
+    Output('scrape-progress', 'children'),
     Input('generate-button', 'n_clicks'),
+    Input('scrape-progress-interval', 'n_intervals'),
     State('stock-code', 'value'),
     State('date-range', 'start_date'),
     State('date-range', 'end_date'),
-    State('threshold-percentage', 'value')
+    State('threshold-percentage', 'value'),
+    State('match-mode', 'value'),
+    State('scrape-request', 'data')
 )
-def generate_data(n_clicks: int, stock_code: int, start_date: str, end_date: str, threshold_percentage: float) -> list:
+@timed('dash.generate_data')
+def generate_data(n_clicks: int, n_intervals: int, stock_code: int, start_date: str, end_date: str, threshold_percentage: float, match_mode: str, scrape_request: dict) -> tuple:
     """ Generates the data for the given application inputs and stores it in a dcc.Store element.
 
+    Missing dates are queued for the background scrape workers rather than scraped within the request, and the
+    stored data is displayed meanwhile. The interval then polls the scrape jobs, and regenerates the data when
+    they have finished.
+
     Args:
         n_clicks (int): Button clicks, used to trigger callback.
+        n_intervals (int): Scrape progress polls, used to trigger callback.
         stock_code (int): HKEX stock code.
         start_date (pd.Timestamp): Start of the date range.
         end_date (pd.Timestamp): End of the date range.
         threshold_percentage (float): Threshold for detecting possible transactions.
+        match_mode (str): Buyer/seller matching mode of the transaction finder.
+        scrape_request (dict): Inputs of the request whose missing dates are being scraped.
 
     Returns:
-        dict: Serialisable dictionary of data to be stored in the dcc.Store.
+        tuple: Request to be stored in the dcc.Store, the scrape request, whether the progress interval is
+            disabled, and the progress bar.
 
     """
+    if dash.callback_context.triggered[0]['prop_id'] == 'scrape-progress-interval.n_intervals':
+        if scrape_request is None:
+            raise dash.exceptions.PreventUpdate
+        stock_code, start_date, end_date, threshold_percentage, match_mode = [scrape_request[key] for key in [
+            'stock_code', 'start_date', 'end_date', 'threshold_percentage', 'match_mode']]
+        progress = ScrapeJobQueue.get_progress(pd.Timestamp(start_date), pd.Timestamp(end_date), stock_code)
+        # The tabs are regenerated as dates are stored, so partial results show while the rest is scraped
+        if progress['remaining'] and progress['total'] - progress['remaining'] == scrape_request.get('n_finished', 0):
+            return dash.no_update, dash.no_update, False, render_scrape_progress(progress)
+        # Cached results of this process may predate data committed by the worker processes
+        get_result_cache().invalidate_stock_codes({stock_code})
+
     sd = ShareholdingDisplay(
         start_date=pd.Timestamp(start_date),
         end_date=pd.Timestamp(end_date),
         stock_code=stock_code,
-        threshold_percentage=threshold_percentage
+        threshold_percentage=threshold_percentage,
+        match_mode=match_mode,
+        scrape_missing=False
     )
-    trend_tab_data = sd.generate_trend_tab_data()
-    finder_tab_data = sd.generate_finder_tab_data()
+    progress = ScrapeJobQueue.get_progress(sd.start_date, sd.end_date, stock_code)
+    scraping = bool(progress['remaining']) and not sd.complete
+    # Only the request is sent to the browser, the tab data stays on the server (see load_tab_data())
+    store = {
+        'stock_code': stock_code,
+        'start_date': start_date,
+        'end_date': end_date,
+        'threshold_percentage': threshold_percentage,
+        'match_mode': match_mode,
+        # No data is stored yet on the first request of a stock
+        'has_data': sd.has_data,
+        # Missing dates are still being scraped, so no data yet doesn't mean the stock code is wrong
+        'scraping': scraping,
+        'generated_at': time.time()
+    }
+    if sd.has_data:
+        tab_data = {'trend': sd.generate_trend_tab_data(), 'finder': sd.generate_finder_tab_data()}
+        # Tab data of complete date ranges is cached by ShareholdingDisplay, keep the partial one of this request
+        if USE_RESULT_CACHE and not sd.complete:
+            for tab, data in tab_data.items():
+                get_result_cache().put(get_tab_data_key(store, tab), data)
 
-    return {
-        'trend_tab_data': trend_tab_data,
-        'finder_tab_data': finder_tab_data
+    if not scraping:
+        n_missing = progress.get('failed', 0) + progress.get('unavailable', 0)
+        return store, None, True, html.Small(f'{n_missing} dates could not be scraped.') if n_missing and not sd.complete else None
+
+    scrape_request = {
+        'stock_code': stock_code,
+        'start_date': start_date,
+        'end_date': end_date,
+        'threshold_percentage': threshold_percentage,
+        'match_mode': match_mode,
+        'n_finished': progress['total'] - progress['remaining']
     }
+    return store, scrape_request, False, render_scrape_progress(progress)
 
 
 @app.callback(
     Output('tab-content', 'children'),
     [Input('tabs', 'active_tab'), Input('store', 'data')],
 )
+@timed('dash.render_tab_content')
 def render_tab_content(active_tab: str, store: dict) -> list:
     """ Generates the displayed content for the active tab.
 
     Args:
         active_tab (str): ID of the active tab.
-        store (dict): dcc.Store containing the data generated by the generate_data() callback.
+        store (dict): dcc.Store containing the request generated by the generate_data() callback.
 
     Returns:
         list: List of elements to be displayed in the 'tab-content' div.
 
     """
-    if store is not None:
+    if active_tab == 'market-tab':
+        # Market Scan Tab, independent of the stock code and the dcc.Store
+        return [
+            html.P('Runs the transaction finder across every stock stored for the date range, with the threshold and '
+                   'matching mode above, and lists the largest potential transactions by quantity. '
+                   'Dates that have not been scraped are not scanned.'),
+            html.Div(
+                [
+                    dbc.Label('Number of Transactions', style=dict(marginRight=10)),
+                    dcc.Input(
+                        id='market-scan-top-n',
+                        type='number',
+                        min=1,
+                        step=1,
+                        value=MARKET_SCAN_TOP_N,
+                    ),
+                ]
+            ),
+            dbc.Button(
+                'Scan Market',
+                color='primary',
+                id='market-scan-button',
+                className='my-3',
+            ),
+            dcc.Loading(html.Div(id='market-scan-results')),
+        ]
+    elif active_tab == 'participant-tab':
+        # Participant Holdings Tab, independent of the stock code and the dcc.Store
+        return [
+            html.P("Lists a participant's holdings across every stock stored for the date range, on the last stored "
+                   'date of each stock, and the stocks with the largest net changes over the date range. '
+                   'Dates that have not been scraped are not included.'),
+            html.Div(
+                [
+                    dbc.Label('Participant ID', style=dict(marginRight=10)),
+                    dcc.Input(
+                        id='participant-id',
+                        type='text',
+                        placeholder='e.g. C00019',
+                        debounce=True,
+                    ),
+                ]
+            ),
+            dbc.Button(
+                'Show Holdings',
+                color='primary',
+                id='participant-holdings-button',
+                className='my-3',
+            ),
+            dcc.Loading(html.Div(id='participant-holdings-results')),
+        ]
+    elif store is not None and store['has_data']:
         if active_tab == 'trend-tab':
             # Trend Plot Tab
-            trend_fig = go.Figure(store['trend_tab_data']['trend_fig'])
-            trend_data = pd.DataFrame.from_dict(
-                store['trend_tab_data']['trend_data_dict'])
+            trend_tab_data = load_tab_data(store, 'trend')
 
             trend_tab_content = [
                 html.Div(
-                    dcc.Graph(figure=trend_fig, id='trend-fig')
+                    dcc.Graph(figure=trend_tab_data['trend_fig'], id='trend-fig')
                 ),
                 html.Div(
-                    dash_table.DataTable(
-                        columns=[
-                            {'name': i, 'id': i, 'type': get_table_type(trend_data[i])} for i in trend_data.columns
-                        ],
-                        data=trend_data.to_dict('records'),
-                        filter_action='native'
-                    )
+                    render_data_table('trend-table', trend_tab_data['trend_data'])
                 )
             ]
             return trend_tab_content
 
         elif active_tab == 'finder-tab':
             # Transaction Finder Tab
-            potential_transactions = pd.DataFrame.from_dict(
-                store['finder_tab_data']['potential_transactions_dict'])
+            potential_transactions = load_tab_data(store, 'finder')['potential_transactions']
 
             if potential_transactions.empty:
                 return 'No transactions detected.'
@@ -172,19 +366,233 @@ def render_tab_content(active_tab: str, store: dict) -> list:
                 finder_tab_content = [
                     html.P('The table below identifies potential transactions between parties with corresponding changes in shareholding.'),
                     html.Div(
-                        dash_table.DataTable(
-                            columns=[
-                                {'name': i, 'id': i, 'type': get_table_type(potential_transactions[i])} for i in potential_transactions.columns
-                            ],
-                            data=potential_transactions.to_dict('records'),
-                            filter_action='native'
-                        )
+                        render_data_table('finder-table', potential_transactions)
                     )
                 ]
             return finder_tab_content
+    elif store is not None and store.get('scraping'):
+        return 'Scraping the requested dates. Results will appear as dates are stored.'
     else:
         return 'Data not available. Please check stock code.'
 
 
+def update_data_table(tab: str, frame_name: str):
+    # Registers the callback serving the rows of a tab's DataTable from its frame on the server
+    @app.callback(
+        Output(f'{tab}-table', 'data'),
+        Output(f'{tab}-table', 'page_count'),
+        Input(f'{tab}-table', 'page_current'),
+        Input(f'{tab}-table', 'page_size'),
+        Input(f'{tab}-table', 'sort_by'),
+        Input(f'{tab}-table', 'filter_query'),
+        State('store', 'data')
+    )
+    @timed(f'dash.update_{tab}_table')
+    def update(page_current: int, page_size: int, sort_by: list, filter_query: str, store: dict) -> tuple:
+        if store is None or not store['has_data']:
+            raise dash.exceptions.PreventUpdate
+        return query_table_frame(load_tab_data(store, tab)[frame_name], page_current or 0, page_size, sort_by, filter_query)
+
+
+update_data_table('trend', 'trend_data')
+update_data_table('finder', 'potential_transactions')
+
+
+@app.callback(
+    Output('trend-fig', 'figure'),
+    Input('trend-fig', 'relayoutData'),
+    State('store', 'data'),
+    prevent_initial_call=True
+)
+@timed('dash.zoom_trend_figure')
+def zoom_trend_figure(relayout_data: dict, store: dict) -> go.Figure:
+    """ Rebuilds the downsampled trend plot for the zoomed date range, so that zooming in shows more detail.
+
+    Args:
+        relayout_data (dict): Plotly relayout event of the trend plot.
+        store (dict): dcc.Store containing the request generated by the generate_data() callback.
+
+    Returns:
+        go.Figure: Trend plot downsampled within the zoom window.
+
+    """
+    if not TREND_USE_WEBGL or not relayout_data or store is None or not store['has_data']:
+        raise dash.exceptions.PreventUpdate
+    if 'xaxis.range[0]' in relayout_data:
+        x_range = (pd.Timestamp(relayout_data['xaxis.range[0]']), pd.Timestamp(relayout_data['xaxis.range[1]']))
+    elif 'xaxis.range' in relayout_data:
+        x_range = tuple(pd.Timestamp(value) for value in relayout_data['xaxis.range'])
+    elif relayout_data.get('xaxis.autorange'):
+        x_range = None
+    else:
+        # Legend clicks, y-axis only zooms, ...
+        raise dash.exceptions.PreventUpdate
+
+    trend_tab_data = load_tab_data(store, 'trend')
+    return build_trend_figure(trend_tab_data['trend_data'], trend_tab_data['trend_fig'].layout.title.text, x_range)
+
+
+@app.callback(
+    Output('market-scan-results', 'children'),
+    Input('market-scan-button', 'n_clicks'),
+    State('date-range', 'start_date'),
+    State('date-range', 'end_date'),
+    State('threshold-percentage', 'value'),
+    State('match-mode', 'value'),
+    State('market-scan-top-n', 'value'),
+    prevent_initial_call=True
+)
+@timed('dash.render_market_scan')
+def render_market_scan(n_clicks: int, start_date: str, end_date: str, threshold_percentage: float, match_mode: str, top_n: int) -> list:
+    """ Runs (or reuses a recent) market scan and displays its largest potential transactions.
+
+    Args:
+        n_clicks (int): Button clicks, used to trigger callback.
+        start_date (pd.Timestamp): Start of the date range.
+        end_date (pd.Timestamp): End of the date range.
+        threshold_percentage (float): Threshold for detecting possible transactions.
+        match_mode (str): Buyer/seller matching mode of the transaction finder.
+        top_n (int): Number of transactions displayed.
+
+    Returns:
+        list: List of elements to be displayed in the 'market-scan-results' div.
+
+    """
+    scan_id = get_market_scan(pd.Timestamp(start_date), pd.Timestamp(end_date), threshold_percentage, match_mode)
+    top_results = pull_top_market_scan_results(scan_id, top_n or MARKET_SCAN_TOP_N)
+
+    if top_results.empty:
+        return 'No transactions detected.'
+    return [
+        dash_table.DataTable(
+            columns=[
+                {'name': i, 'id': i, 'type': get_table_type(top_results[i])} for i in top_results.columns
+            ],
+            data=top_results.to_dict('records'),
+            filter_action='native',
+            sort_action='native'
+        )
+    ]
+
+
+@app.callback(
+    Output('participant-holdings-results', 'children'),
+    Input('participant-holdings-button', 'n_clicks'),
+    Input('participant-id', 'value'),
+    State('date-range', 'start_date'),
+    State('date-range', 'end_date'),
+    prevent_initial_call=True
+)
+@timed('dash.render_participant_holdings')
+def render_participant_holdings(n_clicks: int, participant_id: str, start_date: str, end_date: str) -> list:
+    """ Displays a participant's holdings across stocks and their largest changes over the date range.
+
+    Args:
+        n_clicks (int): Button clicks, used to trigger callback.
+        participant_id (str): CCASS participant ID.
+        start_date (pd.Timestamp): Start of the date range.
+        end_date (pd.Timestamp): End of the date range.
+
+    Returns:
+        list: List of elements to be displayed in the 'participant-holdings-results' div.
+
+    """
+    participant_id = (participant_id or '').strip().upper()
+    if not participant_id:
+        return 'Please enter a participant ID.'
+    holdings = pull_participant_holdings(participant_id, pd.Timestamp(start_date), pd.Timestamp(end_date))
+    holding_changes = pull_participant_holding_changes(participant_id, pd.Timestamp(start_date), pd.Timestamp(end_date))
+
+    if holdings.empty and holding_changes.empty:
+        return f'No holdings of {participant_id} stored for the date range.'
+    return [
+        html.H5(f'Largest Changes of {participant_id}'),
+        render_participant_table(holding_changes) if not holding_changes.empty else html.P('No changes.'),
+        html.H5(f'Holdings of {participant_id}', className='mt-4'),
+        render_participant_table(holdings) if not holdings.empty else html.P('No holdings.'),
+    ]
+
+
+def render_participant_table(df: pd.DataFrame) -> dash_table.DataTable:
+    # Participant tables are at most one row per stock, so they are paged, filtered and sorted in the browser
+    return dash_table.DataTable(
+        columns=[
+            {'name': i, 'id': i, 'type': get_table_type(df[i])} for i in df.columns
+        ],
+        data=df.to_dict('records'),
+        filter_action='native',
+        sort_action='native',
+        page_size=DASH_TABLE_PAGE_SIZE
+    )
+
+
+@app.server.route('/participant-holdings/<participant_id>')
+def participant_holdings_api(participant_id: str):
+    # Holdings across stocks and largest changes of a participant, for ?start_date=&end_date= (default last 30 days)
+    end_date = pd.Timestamp(request.args.get('end_date', (pd.Timestamp.now() - pd.Timedelta(days=1)).date()))
+    start_date = pd.Timestamp(request.args.get('start_date', end_date - pd.Timedelta(days=30)))
+    top_n = request.args.get('top_n', PARTICIPANT_HOLDINGS_TOP_N, type=int)
+    participant_id = participant_id.upper()
+    holdings = pull_participant_holdings(participant_id, start_date, end_date)
+    holding_changes = pull_participant_holding_changes(participant_id, start_date, end_date, top_n)
+    # NaN (e.g. the pct_total_issued_change of a stock without rankings) is not valid JSON
+    return jsonify({
+        'participant_id': participant_id,
+        'start_date': start_date.strftime(DATE_BASE_FORMAT),
+        'end_date': end_date.strftime(DATE_BASE_FORMAT),
+        'holdings': holdings.astype(object).where(holdings.notna(), None).to_dict('records'),
+        'largest_changes': holding_changes.astype(object).where(holding_changes.notna(), None).to_dict('records')
+    })
+
+
+@app.server.route('/webdriver-pool')
+def webdriver_pool_metrics():
+    # WebDriver pool metrics for sizing WEBDRIVER_POOL_MAX_SIZE against the Selenium Grid node
+    return jsonify(get_webdriver_pool().get_metrics())
+
+
+@app.server.route('/db-pool')
+def db_pool_metrics():
+    # SQLite connection pool metrics of this worker, for sizing SQLITE_POOL_MAX_IDLE_CONNECTIONS
+    return jsonify(get_connection_pool().get_metrics())
+
+
+@app.server.route('/result-cache')
+def result_cache_metrics():
+    # Result cache hit/miss counters for sizing RESULT_CACHE_MAX_SIZE_MB
+    return jsonify(get_result_cache().get_metrics())
+
+
+@app.server.route('/metrics')
+def stage_metrics():
+    # Per-stage timing histograms in the Prometheus text format
+    return Response(get_stage_histograms().render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+
+@app.server.route('/profile')
+def arm_request_profiler():
+    # Profiles the next ?requests=N Dash callback requests (default 1) with cProfile
+    n_armed = get_request_profiler().arm(request.args.get('requests', 1, type=int))
+    return jsonify({'armed_requests': n_armed, 'profile_dir': get_request_profiler().profile_dir})
+
+
+@app.server.before_request
+def start_request_profile():
+    if request.path.endswith('/_dash-update-component'):
+        g.profile = get_request_profiler().start()
+
+
+@app.server.after_request
+def stop_request_profile(response):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        # Named after the callback outputs, e.g. trend-fig.figure
+        output = (request.get_json(silent=True) or {}).get('output', request.path)
+        get_request_profiler().stop(profile, output)
+    return response
+
+
 if __name__ == '__main__':
+    if SCRAPE_JOB_WORKER_PROCESSES:
+        start_scrape_job_workers()
     app.run_server(host=DASH_HOST, debug=DASH_DEBUG_MODE, port=DASH_PORT)
@@ -0,0 +1,279 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import config
+from synthetic_data import SyntheticCCASSDataset
+from mock_ccass_site import run_mock_ccass_site
+from config import *
+
+
+logger = logging.getLogger(__name__)
+
+# Synthetic stocks of each case, one ingested directly and one scraped from the mock site
+INGEST_STOCK_CODE = 1
+SCRAPE_STOCK_CODE = 2
+BENCHMARK_START_DATE = pd.Timestamp('2022-01-03')
+
+# Stages compared between reports
+BENCHMARK_STAGES = ['db_ingest', 'pull_shareholding_data', 'display_init', 'trend_tab_data', 'finder_tab_data',
+                    'scrape_end_to_end']
+
+
+def summarise_timings(seconds: list, **fields) -> dict:
+    # Timings of the repeats of a stage, compared between reports by their median
+    return {
+        'repeats': len(seconds),
+        'min_seconds': float(np.min(seconds)),
+        'median_seconds': float(np.median(seconds)),
+        'max_seconds': float(np.max(seconds)),
+        **fields
+    }
+
+
+def run_benchmark_case(n_participants: int, n_days: int, repeats: int = 5, scrape_days: int = 10, threshold_percentage: float = 2, latency_seconds: float = 0.0, seed: int = 0) -> dict:
+    """ Times the hot paths of the app on one size of synthetic data.
+
+    Must run in a process of its own from a scratch directory (see run_benchmark_suite()), since it writes to the
+    database and caches under ../output and points the scraper at a local mock site.
+
+    Args:
+        n_participants (int): Participants per stock.
+        n_days (int): Calendar days of the date range.
+        repeats (int, optional): Timed repeats of the read stages. Defaults to 5.
+        scrape_days (int, optional): Calendar days scraped end to end, at most n_days. Defaults to 10.
+        threshold_percentage (float, optional): Transaction finder threshold. Defaults to 2.
+        latency_seconds (float, optional): Response delay of the mock site. Defaults to 0.0.
+        seed (int, optional): Random seed of the synthetic data. Defaults to 0.
+
+    Returns:
+        dict: Timings of each stage in BENCHMARK_STAGES.
+
+    """
+    dataset = SyntheticCCASSDataset([INGEST_STOCK_CODE, SCRAPE_STOCK_CODE], n_participants, n_days,
+                                    BENCHMARK_START_DATE, seed)
+    server = run_mock_ccass_site(port=0, dataset=dataset, latency_seconds=latency_seconds)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # Modules bind config values when imported, so they are only imported once the scraper points at the mock site
+    config.CCASS_SHAREHOLDING_SEARCH_URL = f'http://127.0.0.1:{server.server_address[1]}/'
+    config.SCRAPER_BACKEND = 'http'
+    config.SCRAPER_FALLBACK_TO_SELENIUM = False
+    from utils import date_to_key
+    from shareholding_data import ShareholdingData
+    from shareholding_display import ShareholdingDisplay
+    from shareholding_writer import get_shareholding_writer
+    from result_cache import get_result_cache
+
+    start_date, end_date = dataset.start_date, dataset.end_date
+    timings = {}
+
+    # 1. Ingest, one submission per trading date as scraped, and the other dates mapped to their trading date
+    writer = get_shareholding_writer()
+    n_rows = 0
+    started_at = time.perf_counter()
+    for trading_date in dataset.trading_dates:
+        stock_name, df = dataset.get_shareholding(trading_date, INGEST_STOCK_CODE)
+        date_base = trading_date.strftime(DATE_BASE_FORMAT)
+        df = df.copy()
+        df.insert(0, 'date_requested', date_base)
+        df.insert(1, 'date', date_base)
+        df.insert(2, 'stock_code', INGEST_STOCK_CODE)
+        df.insert(3, 'stock_name', stock_name)
+        writer.submit_shareholding(df)
+        n_rows += len(df)
+    ShareholdingData.submit_date_mappings([
+        (date, dataset.get_trading_date(date)) for date in pd.date_range(start_date, end_date)
+        if date not in dataset.trading_dates
+    ], INGEST_STOCK_CODE)
+    writer.flush()
+    seconds = time.perf_counter() - started_at
+    timings['db_ingest'] = summarise_timings([seconds], rows=n_rows, rows_per_second=n_rows / seconds)
+
+    # 2. Reads of the stored data, the first one cold (e.g. building the columnar cache)
+    result_cache = get_result_cache()
+
+    def time_repeats(function) -> tuple:
+        seconds = []
+        for _ in range(repeats + 1):
+            result_cache.clear()
+            started_at = time.perf_counter()
+            result = function()
+            seconds.append(time.perf_counter() - started_at)
+        return result, seconds
+
+    data, seconds = time_repeats(lambda: ShareholdingData.pull_shareholding_data(
+        start_date, end_date, INGEST_STOCK_CODE, scrape_missing=False))
+    timings['pull_shareholding_data'] = summarise_timings(seconds[1:], cold_seconds=seconds[0], rows=len(data))
+
+    sd, seconds = time_repeats(lambda: ShareholdingDisplay(
+        start_date, end_date, INGEST_STOCK_CODE, threshold_percentage, scrape_missing=False))
+    timings['display_init'] = summarise_timings(seconds[1:], cold_seconds=seconds[0])
+    # The tab generators are timed without the result cache in front of them
+    _, seconds = time_repeats(sd._generate_trend_tab_data)
+    timings['trend_tab_data'] = summarise_timings(seconds[1:], cold_seconds=seconds[0])
+    finder_tab_data, seconds = time_repeats(sd._generate_finder_tab_data)
+    timings['finder_tab_data'] = summarise_timings(
+        seconds[1:], cold_seconds=seconds[0], transactions=len(finder_tab_data['potential_transactions']))
+
+    # 3. Scraping from the mock site, parsing and storing, as for a request of the app
+    scrape_end_date = start_date + pd.Timedelta(days=min(scrape_days, n_days) - 1)
+    started_at = time.perf_counter()
+    data = ShareholdingData.pull_shareholding_data(start_date, scrape_end_date, SCRAPE_STOCK_CODE)
+    seconds = time.perf_counter() - started_at
+    n_pages = int(data['date'].nunique()) if len(data) else 0
+    timings['scrape_end_to_end'] = summarise_timings(
+        [seconds], pages=n_pages, rows=len(data), seconds_per_page=seconds / n_pages if n_pages else None)
+
+    server.shutdown()
+    return {'participants': n_participants, 'days': n_days, 'trading_days': len(dataset.trading_dates),
+            'timings': timings}
+
+
+def get_git_commit() -> str:
+    # Commit of the benchmarked tree, None outside a git checkout
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark_suite(participants_list: list, days_list: list, report_path: str, repeats: int = 5, scrape_days: int = 10, threshold_percentage: float = 2, latency_seconds: float = 0.0, seed: int = 0) -> dict:
+    """ Runs run_benchmark_case() for every size, each in a new process and scratch directory, and writes a report.
+
+    Args:
+        participants_list (list): Participants per stock of the cases.
+        days_list (list): Calendar days of the cases.
+        report_path (str): Path of the JSON report.
+        repeats (int, optional): See run_benchmark_case(). Defaults to 5.
+        scrape_days (int, optional): See run_benchmark_case(). Defaults to 10.
+        threshold_percentage (float, optional): See run_benchmark_case(). Defaults to 2.
+        latency_seconds (float, optional): See run_benchmark_case(). Defaults to 0.0.
+        seed (int, optional): See run_benchmark_case(). Defaults to 0.
+
+    Returns:
+        dict: Report, with the environment, parameters and the results of every case.
+
+    """
+    parameters = {'repeats': repeats, 'scrape_days': scrape_days, 'threshold_percentage': threshold_percentage,
+                  'latency_seconds': latency_seconds, 'seed': seed}
+    report = {
+        'created_at': pd.Timestamp.now().isoformat(),
+        'git_commit': get_git_commit(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'parameters': parameters,
+        'cases': [],
+    }
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    for n_participants in participants_list:
+        for n_days in days_list:
+            logger.info(f'Benchmarking {n_participants} participants over {n_days} days...')
+            with tempfile.TemporaryDirectory() as scratch_dir:
+                # Paths of config.py are relative to the working directory, ../output from a sibling of output
+                work_dir = os.path.join(scratch_dir, 'src')
+                os.makedirs(work_dir)
+                os.makedirs(os.path.join(scratch_dir, 'output'))
+                case_path = os.path.join(scratch_dir, 'case.json')
+                subprocess.run([
+                    sys.executable, os.path.join(src_dir, 'benchmark_suite.py'), 'case', case_path,
+                    '--participants', str(n_participants), '--days', str(n_days), '--repeats', str(repeats),
+                    '--scrape-days', str(scrape_days), '--threshold-percentage', str(threshold_percentage),
+                    '--latency-ms', str(latency_seconds * 1000), '--seed', str(seed)
+                ], cwd=work_dir, env={**os.environ, 'PYTHONPATH': src_dir}, check=True)
+                with open(case_path) as f:
+                    case = json.load(f)
+            report['cases'].append(case)
+            logger.info(format_case(case))
+
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f'Benchmark report written to {report_path}.')
+    return report
+
+
+def format_case(case: dict) -> str:
+    # One line per stage of a case, for the logs
+    lines = [f'{case["participants"]} participants, {case["days"]} days:']
+    for stage, timing in case['timings'].items():
+        lines.append(f'  {stage}: {timing["median_seconds"]:.4f}s (min {timing["min_seconds"]:.4f}s)')
+    return '\n'.join(lines)
+
+
+def compare_benchmark_reports(baseline_path: str, report_path: str, regression_ratio: float = 1.2) -> pd.DataFrame:
+    """ Compares the median timings of the cases and stages found in two reports.
+
+    Args:
+        baseline_path (str): Report of the reference version.
+        report_path (str): Report of the version under test.
+        regression_ratio (float, optional): Ratio of the medians above which a stage is flagged as a regression.
+            Defaults to 1.2.
+
+    Returns:
+        pd.DataFrame: One row per case and stage, with both medians, their ratio and the regression flag.
+
+    """
+    def read_medians(path: str) -> pd.Series:
+        with open(path) as f:
+            report = json.load(f)
+        return pd.Series({
+            (case['participants'], case['days'], stage): timing['median_seconds']
+            for case in report['cases'] for stage, timing in case['timings'].items()
+        }, dtype=float)
+
+    comparison = pd.concat([read_medians(baseline_path), read_medians(report_path)],
+                           axis=1, keys=['baseline_seconds', 'seconds'], join='inner')
+    comparison.index.names = ['participants', 'days', 'stage']
+    comparison['ratio'] = comparison['seconds'] / comparison['baseline_seconds']
+    comparison['regression'] = comparison['ratio'].gt(regression_ratio)
+    return comparison.reset_index()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmarks of the app on synthetic CCASS data, scraped from a local mock search site.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='Run the suite and write a JSON report.')
+    run_parser.add_argument('report_path')
+    run_parser.add_argument('--participants', type=int, nargs='+', default=[10, 500, 5000])
+    run_parser.add_argument('--days', type=int, nargs='+', default=[1, 30, 365])
+
+    case_parser = subparsers.add_parser('case', help='Run a single case in the working directory (used by run).')
+    case_parser.add_argument('case_path')
+    case_parser.add_argument('--participants', type=int, required=True)
+    case_parser.add_argument('--days', type=int, required=True)
+
+    for subparser in (run_parser, case_parser):
+        subparser.add_argument('--repeats', type=int, default=5)
+        subparser.add_argument('--scrape-days', type=int, default=10)
+        subparser.add_argument('--threshold-percentage', type=float, default=2)
+        subparser.add_argument('--latency-ms', type=float, default=0, help='Response delay of the mock site.')
+        subparser.add_argument('--seed', type=int, default=0)
+
+    compare_parser = subparsers.add_parser('compare', help='Compare a report against a baseline report.')
+    compare_parser.add_argument('baseline_path')
+    compare_parser.add_argument('report_path')
+    compare_parser.add_argument('--regression-ratio', type=float, default=1.2)
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run_benchmark_suite(args.participants, args.days, args.report_path, args.repeats, args.scrape_days,
+                            args.threshold_percentage, args.latency_ms / 1000, args.seed)
+    elif args.command == 'case':
+        case = run_benchmark_case(args.participants, args.days, args.repeats, args.scrape_days,
+                                  args.threshold_percentage, args.latency_ms / 1000, args.seed)
+        with open(args.case_path, 'w') as f:
+            json.dump(case, f, indent=2)
+    elif args.command == 'compare':
+        comparison = compare_benchmark_reports(args.baseline_path, args.report_path, args.regression_ratio)
+        logger.info(f'\n{comparison.to_string(index=False)}')
+        if comparison['regression'].any():
+            logger.warning(f'{comparison["regression"].sum()} stages slower than {args.regression_ratio}x the baseline.')
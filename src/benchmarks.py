@@ -0,0 +1,389 @@
+import argparse
+import glob
+import os
+import sqlite3
+import tempfile
+import time
+import pandas as pd
+import numpy as np
+from bs4 import BeautifulSoup
+from scrapers import parse_search_result_page
+from synthetic_data import generate_synthetic_shareholding_data
+from transaction_matcher import MATCH_MODES, match_transactions
+from utils import compact_shareholding_data, participant_labels, date_to_key, dates_to_keys, query_exists, query_column
+from queries import CREATE_SCRAPE_DATES_TABLE_QUERY, CHECK_DATE_STOCK_DATA_IN_DB_QUERY, CHECK_DATE_RANGE_STOCK_DATA_IN_DB_QUERY
+from config import *
+
+
+logger = logging.getLogger(__name__)
+
+
+def legacy_match_transactions(finder_data: pd.DataFrame) -> pd.DataFrame:
+    # Previous implementation of the transaction finder's matching loop, kept verbatim as the benchmark reference.
+    # Its seller_pct_change is the buyer's, fixed in match_transactions()
+    potential_transactions_concat_list = []
+    for _, date_df in finder_data.loc[finder_data['transaction_detected']].groupby('date'):
+        # Loop through net buyers
+        for _, buyer_row in date_df.loc[date_df['shareholding_diff'].gt(0)].iterrows():
+            # Loop through net sellers with the opposite shareholding_diff
+            for _, seller_row in date_df.loc[date_df['shareholding_diff'].eq(-1 * buyer_row['shareholding_diff'])].iterrows():
+                output = {
+                    'date': buyer_row['date'],
+                    'stock_code': buyer_row['stock_code'],
+                    'buyer_id': buyer_row['participant_id'],
+                    'buyer_name': buyer_row['participant_name'],
+                    'seller_id' : seller_row['participant_id'],
+                    'seller_name': seller_row['participant_name'],
+                    'quantity': buyer_row['shareholding_diff'],
+                    'buyer_pct_change': np.round(100 * buyer_row['shareholding_pct_change'], 5),
+                    'seller_pct_change': np.round(100 * buyer_row['shareholding_pct_change'], 5),
+                    'buyer_shareholding': buyer_row['shareholding'],
+                    'seller_shareholding': seller_row['shareholding']
+                }
+                potential_transactions_concat_list.append(output)
+
+    return pd.DataFrame(potential_transactions_concat_list)
+
+
+def benchmark_finder(n_participants: int = 5000, n_days: int = 250, threshold_percentage: float = 2) -> dict:
+    """ Times the legacy and vectorised transaction matchers on synthetic data and checks that they agree.
+
+    Every column is compared with the legacy output except seller_pct_change, which the legacy loop took from the
+    buyer. It is checked against the seller's own change instead.
+
+    Args:
+        n_participants (int, optional): Number of participants. Defaults to 5000.
+        n_days (int, optional): Number of days. Defaults to 250.
+        threshold_percentage (float, optional): Transaction finder threshold. Defaults to 2.
+
+    Returns:
+        dict: Timings in seconds and number of matched transactions.
+
+    """
+    finder_data = generate_synthetic_shareholding_data(n_participants, n_days)
+    shareholding_by_participant = finder_data.groupby('participant_id')['shareholding']
+    finder_data['shareholding_diff'] = shareholding_by_participant.diff()
+    finder_data['shareholding_pct_change'] = shareholding_by_participant.pct_change()
+    finder_data['transaction_detected'] = finder_data['shareholding_pct_change'].abs().ge(threshold_percentage / 100)
+
+    started_at = time.perf_counter()
+    legacy_output = legacy_match_transactions(finder_data)
+    legacy_seconds = time.perf_counter() - started_at
+
+    started_at = time.perf_counter()
+    vectorised_output = match_transactions(finder_data, mode='exact')
+    vectorised_seconds = time.perf_counter() - started_at
+
+    pd.testing.assert_frame_equal(legacy_output.drop(columns='seller_pct_change'),
+                                  vectorised_output.drop(columns='seller_pct_change'), check_dtype=False)
+    seller_pct_changes = vectorised_output[['date', 'stock_code', 'seller_id']].merge(
+        finder_data[['date', 'stock_code', 'participant_id', 'shareholding_pct_change']],
+        left_on=['date', 'stock_code', 'seller_id'], right_on=['date', 'stock_code', 'participant_id'], how='left')
+    np.testing.assert_array_equal(vectorised_output['seller_pct_change'].to_numpy(),
+                                  np.round(100 * seller_pct_changes['shareholding_pct_change'].to_numpy(), 5))
+
+    return {
+        'rows': len(finder_data),
+        'matches': len(vectorised_output),
+        'legacy_match_seconds': legacy_seconds,
+        'vectorised_match_seconds': vectorised_seconds,
+        'speedup': legacy_seconds / vectorised_seconds,
+    }
+
+
+def benchmark_match_modes(n_participants: int = 600, n_days: int = 60, threshold_percentage: float = 0, tolerance: float = TRANSACTION_MATCH_TOLERANCE) -> dict:
+    """ Times the transaction matcher's modes on a heavily traded synthetic stock.
+
+    Half of the participants buy from the other half each day, so that at a threshold of 0 every one of them is a
+    candidate buyer or seller, the worst case of the 'tolerance' and 'split' modes.
+
+    Args:
+        n_participants (int, optional): Number of participants. Defaults to 600.
+        n_days (int, optional): Number of days. Defaults to 60.
+        threshold_percentage (float, optional): Transaction finder threshold. Defaults to 0.
+        tolerance (float, optional): Relative quantity tolerance. Defaults to TRANSACTION_MATCH_TOLERANCE.
+
+    Returns:
+        dict: Timings in seconds and number of matched transactions of each mode.
+
+    """
+    finder_data = generate_synthetic_shareholding_data(n_participants, n_days, transfers_per_day=n_participants // 2)
+    shareholding_by_participant = finder_data.groupby('participant_id')['shareholding']
+    finder_data['shareholding_diff'] = shareholding_by_participant.diff()
+    finder_data['shareholding_pct_change'] = shareholding_by_participant.pct_change()
+    finder_data['transaction_detected'] = finder_data['shareholding_pct_change'].abs().ge(threshold_percentage / 100)
+
+    output = {
+        'rows': len(finder_data),
+        'detected_per_day': finder_data['transaction_detected'].sum() / n_days,
+    }
+    for mode in MATCH_MODES:
+        started_at = time.perf_counter()
+        potential_transactions = match_transactions(finder_data, mode=mode, tolerance=tolerance)
+        output[f'{mode}_seconds'] = time.perf_counter() - started_at
+        output[f'{mode}_matches'] = len(potential_transactions)
+    return output
+
+
+def legacy_parse_search_result_page(page_source: str) -> tuple:
+    """ Previous BeautifulSoup and pd.read_html parser of a CCASS search result page, kept as a reference.
+
+    Args:
+        page_source (str): HTML of the search page after a search has been submitted.
+
+    Returns:
+        tuple: Same as scrapers.parse_search_result_page().
+
+    """
+    soup = BeautifulSoup(page_source, 'html.parser')
+    date_hkex_displayed = soup.find('input', id='txtShareholdingDate').get('value')
+    stock_name = soup.find('input', id='txtStockName').get('value')
+    pnl_result_normal_tag = soup.find('div', id='pnlResultNormal')
+    for element in pnl_result_normal_tag.find_all('div', class_='mobile-list-heading'):
+        element.decompose()
+    df = pd.read_html(str(pnl_result_normal_tag))[0]
+    df = df.rename(columns={
+        'Participant ID': 'participant_id',
+        'Name of CCASS Participant(* for Consenting Investor Participants )': 'participant_name',
+        'Shareholding': 'shareholding',
+        '% of the total number of Issued Shares/ Warrants/ Units': 'pct_total_issued'
+    })
+    df = df[['participant_id', 'participant_name', 'shareholding', 'pct_total_issued']]
+    df['pct_total_issued'] = pd.to_numeric(df['pct_total_issued'].str.rstrip('%'))
+    return date_hkex_displayed, stock_name, df
+
+
+def benchmark_parser(fixtures_dir: str, repeats: int = 5) -> dict:
+    """ Times the legacy and lxml search result parsers over saved result pages and checks that they agree.
+
+    Args:
+        fixtures_dir (str): Directory of saved result pages, e.g. the fixtures of mock_ccass_site.py.
+        repeats (int, optional): Number of times each page is parsed. Defaults to 5.
+
+    Returns:
+        dict: Timings in seconds per page and number of rows parsed.
+
+    """
+    page_sources = []
+    for path in sorted(glob.glob(os.path.join(fixtures_dir, '*.html'))):
+        with open(path, encoding='utf-8') as f:
+            page_source = f.read()
+        # Search forms and alert pages have no results table
+        if 'id="pnlResultNormal"' in page_source:
+            page_sources.append((os.path.basename(path), page_source))
+    if not page_sources:
+        raise ValueError(f'No result pages found in {fixtures_dir}.')
+
+    n_rows = 0
+    for name, page_source in page_sources:
+        legacy_output = legacy_parse_search_result_page(page_source)
+        output = parse_search_result_page(page_source)
+        assert output[:2] == legacy_output[:2], f'{name}: date or stock name differ'
+        # pd.read_html gives an empty table an object index
+        pd.testing.assert_frame_equal(output[2], legacy_output[2], check_dtype=False, check_index_type=False, obj=name)
+        n_rows += len(output[2])
+
+    started_at = time.perf_counter()
+    for _ in range(repeats):
+        for _, page_source in page_sources:
+            legacy_parse_search_result_page(page_source)
+    legacy_seconds = (time.perf_counter() - started_at) / (repeats * len(page_sources))
+
+    started_at = time.perf_counter()
+    for _ in range(repeats):
+        for _, page_source in page_sources:
+            parse_search_result_page(page_source)
+    lxml_seconds = (time.perf_counter() - started_at) / (repeats * len(page_sources))
+
+    return {
+        'pages': len(page_sources),
+        'rows': n_rows,
+        'legacy_seconds_per_page': legacy_seconds,
+        'lxml_seconds_per_page': lxml_seconds,
+        'speedup': legacy_seconds / lxml_seconds,
+    }
+
+
+def benchmark_memory(n_participants: int = 5000, n_days: int = 365) -> dict:
+    """ Compares the memory of shareholding data in the previous layout with the compact layout on synthetic data.
+
+    The previous layout has object columns of strings for dates, stock and participants, float64 percentages and
+    a participant label per row. See utils.compact_shareholding_data() for the compact layout.
+
+    Args:
+        n_participants (int, optional): Number of participants. Defaults to 5000.
+        n_days (int, optional): Number of days. Defaults to 365.
+
+    Returns:
+        dict: Bytes per column and in total of both layouts.
+
+    """
+    legacy_data = generate_synthetic_shareholding_data(n_participants, n_days)
+    started_at = time.perf_counter()
+    compact_data = compact_shareholding_data(legacy_data.drop(columns='participant'))
+    compact_seconds = time.perf_counter() - started_at
+    started_at = time.perf_counter()
+    labels = participant_labels(compact_data)
+    labels_seconds = time.perf_counter() - started_at
+    assert labels.astype(str).equals(legacy_data['participant'])
+
+    legacy_bytes = legacy_data.memory_usage(index=False, deep=True)
+    compact_bytes = compact_data.memory_usage(index=False, deep=True)
+    return {
+        'rows': len(legacy_data),
+        'legacy_bytes': legacy_bytes.to_dict(),
+        'compact_bytes': compact_bytes.to_dict(),
+        'legacy_total_bytes': int(legacy_bytes.sum()),
+        'compact_total_bytes': int(compact_bytes.sum()),
+        'labels_bytes': int(labels.memory_usage(index=False, deep=True)),
+        'reduction': legacy_bytes.sum() / compact_bytes.sum(),
+        'compact_seconds': compact_seconds,
+        'labels_seconds': labels_seconds,
+    }
+
+
+# Previous existence checks, kept as the benchmark reference: a new connection per call, SQL built with
+# str.format, and pd.read_sql. The range check read every stored date of the stock
+LEGACY_CHECK_DATE_STOCK_DATA_IN_DB_QUERY = """
+SELECT 1 FROM scrape_dates
+WHERE (stock_code = {stock_code}) AND (date_requested_key = {date_requested_key})
+LIMIT 1;
+"""
+
+LEGACY_CHECK_DATE_RANGE_STOCK_DATA_IN_DB_QUERY = """
+SELECT date(date_requested_key * 86400, 'unixepoch') AS date_requested FROM scrape_dates
+WHERE stock_code = {stock_code};
+"""
+
+
+def legacy_read_sql(db_path: str, sql: str) -> pd.DataFrame:
+    # Previous connect_db(): a new connection with the pragmas per call, closed afterwards
+    con = sqlite3.connect(db_path, timeout=SQLITE_BUSY_TIMEOUT_SECONDS)
+    try:
+        for pragma in SQLITE_CONNECTION_PRAGMAS:
+            con.execute(pragma)
+        with con:
+            return pd.read_sql(sql=sql, con=con)
+    finally:
+        con.close()
+
+
+def benchmark_db_checks(n_stocks: int = 100, n_days: int = 730, calls: int = 5000, range_days: int = 30) -> dict:
+    """ Times the previous and pooled existence checks of (stock_code, date) scrapes on a scratch database.
+
+    The single-date check runs before every scrape of prepopulate_db.py and the scrape job workers, the range check
+    before every request of the app.
+
+    Args:
+        n_stocks (int, optional): Stocks of the scratch database. Defaults to 100.
+        n_days (int, optional): Stored dates per stock. Defaults to 730.
+        calls (int, optional): Timed calls of each check. Defaults to 5000.
+        range_days (int, optional): Days of the date ranges checked. Defaults to 30.
+
+    Returns:
+        dict: Microseconds per call of both versions of both checks.
+
+    """
+    rng = np.random.default_rng(0)
+    dates = pd.date_range('2020-01-01', periods=n_days)
+    # Half of the checked dates are stored, as when resuming a backfill
+    checks = [(int(rng.integers(1, n_stocks + 1)), dates[0] + pd.Timedelta(days=int(day)))
+              for day in rng.integers(0, 2 * n_days, calls)]
+
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        db_path = os.path.join(scratch_dir, 'shareholding.db')
+        con = sqlite3.connect(db_path)
+        with con:
+            con.execute('PRAGMA journal_mode=WAL;')
+            con.execute(CREATE_SCRAPE_DATES_TABLE_QUERY)
+            date_keys = dates_to_keys(dates)
+            con.executemany('INSERT INTO scrape_dates VALUES (?, ?, ?);', [
+                (stock_code, int(date_key), int(date_key))
+                for stock_code in range(1, n_stocks + 1) for date_key in date_keys
+            ])
+        con.close()
+
+        def time_calls(check) -> tuple:
+            started_at = time.perf_counter()
+            results = [check(stock_code, date) for stock_code, date in checks]
+            return results, 1e6 * (time.perf_counter() - started_at) / calls
+
+        legacy_results, legacy_microseconds = time_calls(lambda stock_code, date: not legacy_read_sql(
+            db_path, LEGACY_CHECK_DATE_STOCK_DATA_IN_DB_QUERY.format(
+                stock_code=stock_code, date_requested_key=date_to_key(date))).empty)
+        pooled_results, pooled_microseconds = time_calls(lambda stock_code, date: query_exists(
+            CHECK_DATE_STOCK_DATA_IN_DB_QUERY,
+            {'stock_code': stock_code, 'date_requested_key': date_to_key(date)}, db_path))
+        assert legacy_results == pooled_results
+
+        def legacy_range_check(stock_code: int, start_date: pd.Timestamp) -> list:
+            stored = legacy_read_sql(db_path, LEGACY_CHECK_DATE_RANGE_STOCK_DATA_IN_DB_QUERY.format(stock_code=stock_code))
+            date_range = pd.date_range(start=start_date, periods=range_days)
+            return pd.Series(date_range).isin(stored['date_requested']).tolist()
+
+        def pooled_range_check(stock_code: int, start_date: pd.Timestamp) -> list:
+            date_range = pd.date_range(start=start_date, periods=range_days)
+            stored_date_keys = query_column(CHECK_DATE_RANGE_STOCK_DATA_IN_DB_QUERY, {
+                'stock_code': stock_code,
+                'start_date_key': date_to_key(date_range[0]),
+                'end_date_key': date_to_key(date_range[-1])
+            }, db_path)
+            return pd.Series(np.isin(dates_to_keys(date_range), stored_date_keys)).tolist()
+
+        legacy_range_results, legacy_range_microseconds = time_calls(legacy_range_check)
+        pooled_range_results, pooled_range_microseconds = time_calls(pooled_range_check)
+        assert legacy_range_results == pooled_range_results
+
+    return {
+        'stored_dates': n_stocks * n_days,
+        'calls': calls,
+        'legacy_exists_microseconds': legacy_microseconds,
+        'pooled_exists_microseconds': pooled_microseconds,
+        'exists_speedup': legacy_microseconds / pooled_microseconds,
+        'legacy_range_microseconds': legacy_range_microseconds,
+        'pooled_range_microseconds': pooled_range_microseconds,
+        'range_speedup': legacy_range_microseconds / pooled_range_microseconds,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks of the application hot paths.')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    finder_parser = subparsers.add_parser('finder', help='Legacy vs vectorised transaction matching.')
+    finder_parser.add_argument('--participants', type=int, default=5000)
+    finder_parser.add_argument('--days', type=int, default=250)
+    finder_parser.add_argument('--threshold-percentage', type=float, default=2)
+
+    match_modes_parser = subparsers.add_parser(
+        'match-modes', help='Transaction matching modes on a heavily traded stock at a low threshold.')
+    match_modes_parser.add_argument('--participants', type=int, default=600)
+    match_modes_parser.add_argument('--days', type=int, default=60)
+    match_modes_parser.add_argument('--threshold-percentage', type=float, default=0)
+
+    parser_parser = subparsers.add_parser(
+        'parser', help='Legacy vs lxml parsing of saved search result pages, checking that they agree.')
+    parser_parser.add_argument('fixtures_dir', help='Directory of saved result pages.')
+    parser_parser.add_argument('--repeats', type=int, default=5)
+
+    memory_parser = subparsers.add_parser('memory', help='Memory of shareholding data in the previous vs compact layout.')
+    memory_parser.add_argument('--participants', type=int, default=5000)
+    memory_parser.add_argument('--days', type=int, default=365)
+
+    db_checks_parser = subparsers.add_parser(
+        'db-checks', help='Previous vs pooled existence checks of scraped (stock_code, date) pairs.')
+    db_checks_parser.add_argument('--stocks', type=int, default=100)
+    db_checks_parser.add_argument('--days', type=int, default=730)
+    db_checks_parser.add_argument('--calls', type=int, default=5000)
+
+    args = parser.parse_args()
+    if args.benchmark == 'finder':
+        logger.info(benchmark_finder(args.participants, args.days, args.threshold_percentage))
+    elif args.benchmark == 'match-modes':
+        logger.info(benchmark_match_modes(args.participants, args.days, args.threshold_percentage))
+    elif args.benchmark == 'parser':
+        logger.info(benchmark_parser(args.fixtures_dir, args.repeats))
+    elif args.benchmark == 'memory':
+        logger.info(benchmark_memory(args.participants, args.days))
+    elif args.benchmark == 'db-checks':
+        logger.info(benchmark_db_checks(args.stocks, args.days, args.calls))
@@ -0,0 +1,162 @@
+import os
+import threading
+import pyarrow as pa
+import pyarrow.compute as pc
+from utils import *
+from queries import *
+from config import *
+
+
+logger = logging.getLogger(__name__)
+
+CATEGORICAL_COLUMNS = ['stock_name', 'participant_id', 'participant_name']
+
+COLUMNAR_SCHEMA = pa.schema([
+    ('date_requested', pa.string()),
+    ('date', pa.string()),
+    ('stock_code', pa.int64()),
+    ('stock_name', pa.dictionary(pa.int32(), pa.string())),
+    ('participant_id', pa.dictionary(pa.int32(), pa.string())),
+    ('participant_name', pa.dictionary(pa.int32(), pa.string())),
+    ('shareholding', pa.int64()),
+    ('pct_total_issued', pa.float64()),
+])
+
+
+class ColumnarCache:
+    """ Columnar tier in front of SQLite for pull_shareholding_data range reads.
+
+    Data is partitioned per (stock_code, month of date_requested) into uncompressed Arrow IPC files, which are
+    read through memory maps with categorical stock and participant columns. A missing partition is built from
+    SQLite on first read. Months without data are read from SQLite each time rather than stored as empty files.
+    Partitions that already exist are rewritten as the ShareholdingWriter of this process commits new data for
+    them, and partitions made stale by other processes are rebuilt when next read. Staleness is detected by the
+    write generation of the stock and month kept by the writer (stock_month_generations), so rewritten dates are
+    detected as well as new ones.
+
+    """
+
+    def __init__(self, cache_dir: str = COLUMNAR_CACHE_DIR) -> None:
+        self.cache_dir = cache_dir
+        # Serialises partition builds; reads of existing partitions don't take it
+        self.lock = threading.Lock()
+
+    def _get_partition_path(self, stock_code: int, month: pd.Period) -> str:
+        return os.path.join(self.cache_dir, str(stock_code), f'{month.strftime("%Y-%m")}.arrow')
+
+    def _get_generation(self, con, stock_code: int, month: pd.Period) -> int:
+        generation = con.execute(PULL_STOCK_MONTH_GENERATION_QUERY, (int(stock_code), int(month.strftime('%Y%m')))).fetchone()
+        return 0 if generation is None else generation[0]
+
+    def _build_partition(self, stock_code: int, month: pd.Period) -> pa.Table:
+        # Read the month from SQLite and write it atomically, so concurrent readers keep their memory map. The
+        # generation is read first, so that a write in between makes the partition look stale and be rebuilt,
+        # rather than hold old data under the new generation
+        with connect_db() as con:
+            generation = self._get_generation(con, stock_code, month)
+            response_df = pd.read_sql(
+                sql=PULL_SHAREHOLDING_DATA_QUERY,
+                con=con,
+                params={
+                    'start_date_key': date_to_key(month.start_time),
+                    'end_date_key': date_to_key(month.end_time),
+                    'stock_code': int(stock_code)
+                }
+            )
+        for column in CATEGORICAL_COLUMNS:
+            response_df[column] = response_df[column].astype('category')
+        table = pa.Table.from_pandas(
+            response_df, schema=COLUMNAR_SCHEMA, preserve_index=False)
+        # The generation it was built from tells readers whether the partition is stale
+        table = table.replace_schema_metadata(
+            {b'generation': str(generation).encode()})
+
+        path = self._get_partition_path(stock_code, month)
+        if not table.num_rows:
+            # Unavailable stock codes and months not scraped yet are not cached (removing files of earlier versions)
+            if os.path.exists(path):
+                os.remove(path)
+            return table
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with pa.OSFile(temp_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(temp_path, path)
+        return table
+
+    def _read_partition(self, con, stock_code: int, month: pd.Period) -> pa.Table:
+        # Memory-mapped partition, rebuilt from SQLite when missing or when data was written since it was built
+        path = self._get_partition_path(stock_code, month)
+        try:
+            table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+            if (table.schema.metadata or {}).get(b'generation') == str(self._get_generation(con, stock_code, month)).encode():
+                return table
+        except (FileNotFoundError, pa.ArrowInvalid):
+            pass
+        with self.lock:
+            return self._build_partition(stock_code, month)
+
+    def read(self, start_date: pd.Timestamp, end_date: pd.Timestamp, stock_code: int) -> pd.DataFrame:
+        """ Reads shareholding data in the shape returned by pull_shareholding_data.
+
+        Args:
+            start_date (pd.Timestamp): Start of the date range.
+            end_date (pd.Timestamp): End of the date range.
+            stock_code (int): HKEX stock code.
+
+        Returns:
+            pd.DataFrame: Table of shareholding data, with categorical stock and participant columns.
+
+        """
+        months = pd.period_range(start=start_date, end=end_date, freq='M')
+        with connect_db() as con:
+            table = pa.concat_tables(
+                [self._read_partition(con, stock_code, month) for month in months])
+        table = table.filter(pc.and_(
+            pc.greater_equal(table['date_requested'], start_date.strftime(DATE_BASE_FORMAT)),
+            pc.less_equal(table['date_requested'], end_date.strftime(DATE_BASE_FORMAT))
+        ))
+        df = table.to_pandas()
+        # Dictionaries of different partitions are unified in order of appearance, so restore lexical order
+        for column in CATEGORICAL_COLUMNS:
+            df[column] = df[column].cat.reorder_categories(
+                sorted(df[column].cat.categories))
+        return df
+
+    def refresh(self, committed_stock_dates: set) -> None:
+        """ Rewrites the existing partitions touched by a commit. Used as a ShareholdingWriter commit listener.
+
+        Args:
+            committed_stock_dates (set): Committed (stock_code, date_requested_key) pairs.
+
+        """
+        partitions = {
+            (stock_code, pd.Period(key_to_date(date_requested_key), freq='M'))
+            for stock_code, date_requested_key in committed_stock_dates
+        }
+        with self.lock:
+            for stock_code, month in partitions:
+                if os.path.exists(self._get_partition_path(stock_code, month)):
+                    self._build_partition(stock_code, month)
+
+
+# Process-wide cache, registered with the process-wide writer when first used
+_columnar_cache = None
+_columnar_cache_lock = threading.Lock()
+
+
+def get_columnar_cache() -> ColumnarCache:
+    """ Returns the process-wide ColumnarCache, creating it on first use.
+
+    Returns:
+        ColumnarCache: Shared columnar cache.
+
+    """
+    global _columnar_cache
+    from shareholding_writer import get_shareholding_writer
+    with _columnar_cache_lock:
+        if _columnar_cache is None:
+            _columnar_cache = ColumnarCache()
+            get_shareholding_writer().add_commit_listener(_columnar_cache.refresh)
+        return _columnar_cache
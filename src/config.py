@@ -15,11 +15,34 @@ logging.basicConfig(
     ]
 )
 
+# Instrumentation
+# Per-stage timing histograms (served at /metrics by the Dash app) and a JSON line per timed stage
+USE_INSTRUMENTATION = True
+INSTRUMENTATION_JSON_LOG_PATH = f'{OUTPUT_DIR_PATH}/timings.jsonl'
+INSTRUMENTATION_BUCKETS_SECONDS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+# cProfile captures of requests armed with /profile, and the number of functions logged from each
+INSTRUMENTATION_PROFILE_DIR = f'{OUTPUT_DIR_PATH}/profiles'
+INSTRUMENTATION_PROFILE_TOP_N = 25
+
+# Scraper config
+# 'http' posts the search form directly, 'selenium' drives a browser session
+SCRAPER_BACKEND = 'http'
+SCRAPER_FALLBACK_TO_SELENIUM = True
+HTTP_SCRAPER_TIMEOUT_SECONDS = 30
+HTTP_SCRAPER_POOL_SIZE = 20
+HTTP_SCRAPER_USER_AGENT = 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/105.0.0.0 Safari/537.36'
+
 # Selenium config
 USE_REMOTE_WEBDRIVER = False
 REMOTE_WEBDRIVER_COMMAND_EXECUTOR_URL = 'http://selenium:4444/wd/hub'
 HEADLESS = True
 IMPLICIT_WAIT_SECONDS = 30
+# Pool of warm WebDriver sessions shared within a process
+# Keep max size within the Selenium Grid node's max sessions, and the idle timeout below its session timeout
+WEBDRIVER_POOL_MAX_SIZE = 5
+WEBDRIVER_POOL_MAX_USES = 200
+WEBDRIVER_POOL_IDLE_TIMEOUT_SECONDS = 60
+WEBDRIVER_POOL_CHECKOUT_TIMEOUT_SECONDS = 120
 
 # Constants
 CCASS_SHAREHOLDING_SEARCH_URL = 'https://www3.hkexnews.hk/sdw/search/searchsdw.aspx'
@@ -28,15 +51,125 @@ DATE_BASE_FORMAT = '%Y-%m-%d'
 
 # SQLite3
 SHAREHOLDING_DATA_DB_PATH = f'{OUTPUT_DIR_PATH}/shareholding.db'
+SQLITE_BUSY_TIMEOUT_SECONDS = 30
+SQLITE_CONNECTION_PRAGMAS = [
+    'PRAGMA synchronous=NORMAL;',
+    'PRAGMA cache_size=-65536;',
+    'PRAGMA temp_store=MEMORY;',
+    'PRAGMA mmap_size=268435456;',
+]
+# Connections are kept open per thread and reused (see db.py), with their compiled statements
+USE_SQLITE_CONNECTION_POOL = True
+SQLITE_POOL_MAX_IDLE_CONNECTIONS = 4
+SQLITE_CACHED_STATEMENTS = 256
+# Single writer thread batching scraped rows into large transactions
+DB_WRITER_BATCH_ROWS = 50000
+DB_WRITER_FLUSH_INTERVAL_SECONDS = 1
+DB_WRITER_QUEUE_MAX_SIZE = 1000
+# Retries of a batch whose commit failed with 'database is locked' (another process held the lock for longer than
+# the busy timeout), after a delay doubled on each retry. Other errors fail the batch's submissions at once
+DB_WRITER_COMMIT_RETRIES = 3
+DB_WRITER_COMMIT_RETRY_BACKOFF_SECONDS = 1
+
+# Columnar cache of shareholding data, partitioned per stock and month into memory-mapped Arrow files
+USE_COLUMNAR_CACHE = True
+COLUMNAR_CACHE_DIR = f'{OUTPUT_DIR_PATH}/columnar'
+
+# Trading calendar used to skip scraping dates that the site snaps back to an earlier trading date
+# Optional CSV of holidays with a 'date' column (YYYY-MM-DD), used until the dates are learned from scrapes
+TRADING_CALENDAR_HOLIDAYS_PATH = None
+TRADING_CALENDAR_SKIP_SUNDAYS = True
+TRADING_CALENDAR_REFRESH_SECONDS = 300
+
+# In-process LRU cache of ShareholdingDisplay frames and tab payloads, invalidated as new data is committed
+USE_RESULT_CACHE = True
+RESULT_CACHE_MAX_SIZE_MB = 512
+RESULT_CACHE_TTL_SECONDS = 3600
+# Second tier of the cache in a SQLite file, shared by the processes of the WSGI server and the scrape job workers
+USE_SHARED_RESULT_CACHE = True
+SHARED_RESULT_CACHE_DB_PATH = f'{OUTPUT_DIR_PATH}/result_cache.db'
+SHARED_RESULT_CACHE_MAX_SIZE_MB = 2048
+
+# Cross-process file locks taken around scrapes, so that processes don't scrape the same (stock_code, date) twice
+# Each (stock_code, date) maps to one of SCRAPE_LOCK_STRIPES lock files
+SCRAPE_LOCK_DIR = f'{OUTPUT_DIR_PATH}/locks'
+SCRAPE_LOCK_STRIPES = 1024
+
+# ShareholdingDisplay
+# Days fetched (scraped and stored) and searched for transactions at a time, so that memory use and the delay
+# before the first dates are stored don't grow with the date range
+SHAREHOLDING_CHUNK_DAYS = 31
+
+# Transaction finder
+# 'exact', 'tolerance' (near-equal quantities) or 'split' (also one-to-two splits), see transaction_matcher.py
+TRANSACTION_MATCH_MODE = 'exact'
+TRANSACTION_MATCH_TOLERANCE = 0.01
+# Largest changes per side and day considered as the parts of a split, which bounds the 'split' mode's output on
+# heavily traded days or low thresholds
+TRANSACTION_MATCH_SPLIT_MAX_PARTS = 50
+
+# Trend plot
+# Holders ranked per stored date at ingest, participants plotted, and ranking by 'shareholding' as of the end
+# date or by 'change' in shareholding over the date range
+HOLDING_RANKINGS_DEPTH = 100
+TREND_TOP_N = 10
+TREND_RANK_BY = 'shareholding'
+# Draw the trend plot with WebGL traces downsampled (LTTB) to a number of points shared by the plotted participants,
+# refined on zoom. With TREND_TOP_N participants, date ranges of more than about 100 trading days are downsampled
+TREND_USE_WEBGL = True
+TREND_MAX_POINTS = 1000
+
+# Registry of unavailable stock codes shared by all processes
+# Codes are probed again after the re-check TTL, and the in-memory set is reloaded every refresh interval
+UNAVAILABLE_STOCK_CODE_RECHECK_DAYS = 30
+UNAVAILABLE_STOCK_CODES_REFRESH_SECONDS = 60
+# Column of the stock codes in the HKEX list of securities (ListOfSecurities.xlsx) used to seed the registry
+LISTED_SECURITIES_STOCK_CODE_COLUMN = 'Stock Code'
+
+# Background scrape jobs of the Dash app
+# Worker processes started with the app, searches per second per worker, retries, and seconds after which a
+# running job whose worker stopped responding is claimed again
+SCRAPE_JOB_WORKER_PROCESSES = 2
+SCRAPE_JOB_RATE_LIMIT_PER_SECOND = 2
+SCRAPE_JOB_MAX_RETRIES = 3
+SCRAPE_JOB_RETRY_BACKOFF_SECONDS = 5
+SCRAPE_JOB_STALE_SECONDS = 300
+SCRAPE_JOB_POLL_INTERVAL_SECONDS = 1
+SCRAPE_PROGRESS_INTERVAL_MILLISECONDS = 2000
+
+# Market scan
+# Worker processes (None for one per CPU), stock codes per task, and age of a previous scan the Dash tab reuses
+MARKET_SCAN_MAX_WORKERS = None
+MARKET_SCAN_CHUNK_SIZE = 50
+MARKET_SCAN_TOP_N = 100
+MARKET_SCAN_REUSE_SECONDS = 3600
+
+# Participant holdings
+# Stocks listed by the largest changes of a participant's holdings
+PARTICIPANT_HOLDINGS_TOP_N = 20
+
+# export.py
+# Rows read from SQLite and written to the output file at a time
+EXPORT_CHUNK_ROWS = 100000
 
 # Dash
 DASH_HOST = '0.0.0.0'
 DASH_DEBUG_MODE = False
 DASH_PORT = 8887
+# Rows per page of the DataTables, which are paged, filtered and sorted on the server
+DASH_TABLE_PAGE_SIZE = 50
+# WSGI server (gunicorn -c gunicorn.conf.py wsgi:application), with None workers for one per CPU
+# Scrape job workers are started once by the gunicorn master, not by each worker
+WSGI_WORKERS = None
+WSGI_THREADS = 4
+WSGI_TIMEOUT_SECONDS = 120
 
 # prepopulate_db options
 PREPOPULATE_START_DATE = pd.Timestamp(year=2022, month=8, day=30)
 PREPOPULATE_END_DATE = pd.Timestamp(year=2022, month=9, day=6)
 PREPOPULATE_STOCK_CODE_RANGE = np.arange(1, 95500)
-USE_MULTITHREADING = False
-MULTITHREADING_MAX_WORKERS = 20
+PREPOPULATE_CONCURRENCY = 20
+PREPOPULATE_RATE_LIMIT_PER_SECOND = 10
+PREPOPULATE_MAX_RETRIES = 3
+PREPOPULATE_RETRY_BACKOFF_SECONDS = 2
+PREPOPULATE_PROGRESS_INTERVAL_SECONDS = 30
@@ -0,0 +1,117 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from config import *
+
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionPool:
+    """ Per-thread pools of open SQLite connections of a process.
+
+    sqlite3 connections can only be used by the thread that opened them, so each thread keeps its own idle
+    connections per database. Connecting, the connection pragmas and the compilation of statements (kept in the
+    statement cache of each connection, keyed by their SQL) are then paid once per thread rather than per query.
+    A thread checking out a connection while it already holds one gets another, so that nested transactions stay
+    apart as with separate connections.
+
+    """
+
+    def __init__(self, max_idle_connections: int = SQLITE_POOL_MAX_IDLE_CONNECTIONS, cached_statements: int = SQLITE_CACHED_STATEMENTS) -> None:
+        """ Initialises an empty pool.
+
+        Args:
+            max_idle_connections (int, optional): Idle connections kept per thread and database. Defaults to
+                SQLITE_POOL_MAX_IDLE_CONNECTIONS.
+            cached_statements (int, optional): Compiled statements kept per connection. Defaults to
+                SQLITE_CACHED_STATEMENTS.
+
+        """
+        self.max_idle_connections = max_idle_connections
+        self.cached_statements = cached_statements
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.metrics = {'checkouts': 0, 'connections_opened': 0, 'connections_closed': 0}
+
+    def _count(self, metric: str) -> None:
+        with self.lock:
+            self.metrics[metric] += 1
+
+    def _connect(self, db_path: str) -> sqlite3.Connection:
+        con = sqlite3.connect(db_path, timeout=SQLITE_BUSY_TIMEOUT_SECONDS, cached_statements=self.cached_statements)
+        for pragma in SQLITE_CONNECTION_PRAGMAS:
+            con.execute(pragma)
+        self._count('connections_opened')
+        return con
+
+    @contextmanager
+    def connection(self, db_path: str = SHAREHOLDING_DATA_DB_PATH) -> sqlite3.Connection:
+        """ Checks out a connection of the calling thread, which commits on success and rolls back on error.
+
+        Args:
+            db_path (str, optional): Path of the database. Defaults to SHAREHOLDING_DATA_DB_PATH.
+
+        Yields:
+            sqlite3.Connection: Open connection, returned to the pool on exit.
+
+        """
+        if not hasattr(self.local, 'idle_connections'):
+            self.local.idle_connections = {}
+        idle_connections = self.local.idle_connections.setdefault(db_path, [])
+        con = idle_connections.pop() if idle_connections else self._connect(db_path)
+        self._count('checkouts')
+        try:
+            with con:
+                yield con
+        finally:
+            # A transaction left open by the caller (e.g. an explicit BEGIN) must not leak into the next checkout
+            try:
+                if con.in_transaction:
+                    con.rollback()
+                reusable = True
+            except sqlite3.Error:
+                reusable = False
+            if reusable and len(idle_connections) < self.max_idle_connections:
+                idle_connections.append(con)
+            else:
+                con.close()
+                self._count('connections_closed')
+
+    def get_metrics(self) -> dict:
+        with self.lock:
+            return dict(self.metrics)
+
+
+_connection_pool = None
+# Pools inherited from the parent of a forked process, never used nor closed by the child
+_inherited_connection_pools = []
+_connection_pool_lock = threading.Lock()
+
+
+def _reset_connection_pool_after_fork() -> None:
+    # SQLite connections must not be used across a fork, so a forked child (e.g. the workers of market_scan.py)
+    # starts a pool of its own. The lock may have been held by another thread of the parent
+    global _connection_pool, _connection_pool_lock
+    if _connection_pool is not None:
+        _inherited_connection_pools.append(_connection_pool)
+    _connection_pool = None
+    _connection_pool_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_connection_pool_after_fork)
+
+
+def get_connection_pool() -> ConnectionPool:
+    """ Returns the process-wide connection pool, created on first use.
+
+    Returns:
+        ConnectionPool: Connection pool of the process.
+
+    """
+    global _connection_pool
+    with _connection_pool_lock:
+        if _connection_pool is None:
+            _connection_pool = ConnectionPool()
+        return _connection_pool
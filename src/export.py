@@ -0,0 +1,211 @@
+import argparse
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+from utils import *
+from queries import *
+from config import *
+
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ['csv', 'parquet', 'jsonl']
+
+# Schema of the exported rows, fixed so that every chunk of a Parquet file has the same types
+EXPORT_SCHEMA = pa.schema([
+    ('date', pa.string()),
+    ('stock_code', pa.int64()),
+    ('stock_name', pa.string()),
+    ('participant_id', pa.string()),
+    ('participant_name', pa.string()),
+    ('shareholding', pa.int64()),
+    ('pct_total_issued', pa.float64()),
+])
+
+# Aggregations: grouping columns, the summed columns, and the name of the row count
+EXPORT_AGGREGATIONS = {
+    # Total shareholding of each participant across the exported stocks, per date
+    'participant': (['date', 'participant_id', 'participant_name'], ['shareholding'], 'n_stocks'),
+    # Total shareholding held through CCASS participants of each stock, per date
+    'stock': (['date', 'stock_code', 'stock_name'], ['shareholding', 'pct_total_issued'], 'n_participants'),
+}
+
+
+class ExportWriter:
+    """ Appends DataFrame chunks to a CSV, Parquet or JSON Lines file. """
+
+    def __init__(self, path: str, output_format: str = None) -> None:
+        """ Opens the output file.
+
+        Args:
+            path (str): Output path, overwritten if it exists.
+            output_format (str, optional): One of EXPORT_FORMATS. Defaults to None (inferred from the extension).
+
+        Raises:
+            ValueError: When the format is unknown or cannot be inferred.
+
+        """
+        self.path = path
+        self.output_format = output_format or os.path.splitext(path)[1].lstrip('.').lower()
+        if self.output_format not in EXPORT_FORMATS:
+            raise ValueError(f'Unknown export format: {self.output_format}. Use one of {EXPORT_FORMATS}.')
+        self.parquet_writer = None
+        self.file = None if self.output_format == 'parquet' else open(path, 'w', newline='', encoding='utf-8')
+        self.n_rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def write(self, df: pd.DataFrame) -> None:
+        if self.output_format == 'csv':
+            df.to_csv(self.file, index=False, header=self.n_rows == 0)
+        elif self.output_format == 'jsonl':
+            if len(df):
+                self.file.write(df.to_json(orient='records', lines=True, force_ascii=False).rstrip('\n') + '\n')
+        else:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self.parquet_writer is None:
+                # Aggregated exports have their own columns, the schema of the first chunk is kept for the others
+                schema = EXPORT_SCHEMA if table.schema.names == EXPORT_SCHEMA.names else table.schema
+                self.parquet_writer = pq.ParquetWriter(self.path, schema)
+            self.parquet_writer.write_table(table.cast(self.parquet_writer.schema))
+        self.n_rows += len(df)
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+            self.parquet_writer = None
+        elif self.output_format == 'parquet':
+            # Nothing was exported, still leave a valid empty file
+            pq.write_table(EXPORT_SCHEMA.empty_table(), self.path)
+
+
+def read_export_requests(path: str) -> list:
+    """ Reads the (stock_code, start_date, end_date) requests of an export from a CSV file.
+
+    Args:
+        path (str): CSV with a stock_code column, and optional start_date and end_date columns (YYYY-MM-DD)
+            for per-stock date ranges.
+
+    Returns:
+        list: (stock_code, start_date, end_date) tuples, with None dates where the file has none.
+
+    """
+    requests_df = pd.read_csv(path, dtype=str).reindex(columns=['stock_code', 'start_date', 'end_date'])
+    return [
+        (int(stock_code), pd.Timestamp(start_date) if pd.notna(start_date) else None,
+         pd.Timestamp(end_date) if pd.notna(end_date) else None)
+        for stock_code, start_date, end_date in requests_df.itertuples(index=False, name=None)
+    ]
+
+
+def iter_shareholding_chunks(requests: list, chunk_rows: int = EXPORT_CHUNK_ROWS):
+    """ Streams the stored shareholding data of many stocks and date ranges, chunk_rows at a time.
+
+    Only data already in the database is exported, run prepopulate_db.py first to scrape it.
+
+    Args:
+        requests (list): (stock_code, start_date, end_date) tuples.
+        chunk_rows (int, optional): Maximum rows per chunk. Defaults to EXPORT_CHUNK_ROWS.
+
+    Yields:
+        pd.DataFrame: Chunk with the columns of EXPORT_SCHEMA.
+
+    """
+    with connect_db() as con:
+        for stock_code, start_date, end_date in requests:
+            params = {
+                'stock_code': int(stock_code),
+                'start_date_key': date_to_key(start_date),
+                'end_date_key': date_to_key(end_date)
+            }
+            for chunk in pd.read_sql(sql=PULL_EXPORT_SHAREHOLDING_DATA_QUERY, con=con, params=params, chunksize=chunk_rows):
+                yield chunk
+
+
+def aggregate_chunks(chunks, aggregation: str) -> pd.DataFrame:
+    """ Aggregates a stream of chunks, keeping only the running totals in memory.
+
+    Args:
+        chunks (iterable): DataFrame chunks, e.g. from iter_shareholding_chunks().
+        aggregation (str): Key of EXPORT_AGGREGATIONS.
+
+    Returns:
+        pd.DataFrame: One row per group, with the summed columns and the row count.
+
+    """
+    group_columns, sum_columns, count_column = EXPORT_AGGREGATIONS[aggregation]
+    totals = None
+    for chunk in chunks:
+        chunk_totals = chunk.assign(**{count_column: 1}).groupby(
+            group_columns, dropna=False)[sum_columns + [count_column]].sum(numeric_only=True)
+        totals = chunk_totals if totals is None else totals.add(chunk_totals, fill_value=0)
+    if totals is None:
+        return pd.DataFrame(columns=group_columns + sum_columns + [count_column])
+    totals = totals[sum_columns + [count_column]]
+    totals[count_column] = totals[count_column].astype(np.int64)
+    if 'shareholding' in sum_columns:
+        totals['shareholding'] = totals['shareholding'].astype(np.int64)
+    return totals.reset_index()
+
+
+def export_shareholding_data(requests: list, path: str, output_format: str = None, aggregation: str = None, chunk_rows: int = EXPORT_CHUNK_ROWS) -> int:
+    """ Exports the stored shareholding data of many stocks and date ranges to a file, with constant memory use.
+
+    Args:
+        requests (list): (stock_code, start_date, end_date) tuples.
+        path (str): Output path.
+        output_format (str, optional): One of EXPORT_FORMATS. Defaults to None (inferred from the extension).
+        aggregation (str, optional): Key of EXPORT_AGGREGATIONS. Defaults to None (every row is exported).
+        chunk_rows (int, optional): Rows read and written at a time. Defaults to EXPORT_CHUNK_ROWS.
+
+    Returns:
+        int: Number of rows written.
+
+    """
+    chunks = iter_shareholding_chunks(requests, chunk_rows)
+    with ExportWriter(path, output_format) as writer:
+        if aggregation is None:
+            for chunk in chunks:
+                writer.write(chunk)
+                logger.info(f'{writer.n_rows} rows exported to {path}...')
+        else:
+            totals = aggregate_chunks(chunks, aggregation)
+            for i in range(0, max(len(totals), 1), chunk_rows):
+                writer.write(totals.iloc[i:i + chunk_rows])
+    logger.info(f'Exported {writer.n_rows} rows to {path}.')
+    return writer.n_rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Export stored shareholding data of many stocks to CSV, Parquet or JSON Lines without the Dash app.')
+    parser.add_argument('output', help='Output path. The format is inferred from the extension (.csv, .parquet, .jsonl).')
+    parser.add_argument('--format', choices=EXPORT_FORMATS, help='Output format, if not inferred from the extension.')
+    parser.add_argument('--stock-codes', type=int, nargs='+', help='Stock codes to export.')
+    parser.add_argument('--requests-file',
+                        help='CSV with a stock_code column, and optional start_date and end_date columns.')
+    parser.add_argument('--start-date', type=pd.Timestamp, default=PREPOPULATE_START_DATE,
+                        help='Start of the date range of stock codes without their own (YYYY-MM-DD).')
+    parser.add_argument('--end-date', type=pd.Timestamp, default=PREPOPULATE_END_DATE,
+                        help='End of the date range of stock codes without their own (YYYY-MM-DD).')
+    parser.add_argument('--aggregate', choices=list(EXPORT_AGGREGATIONS),
+                        help='Export totals per participant (across stocks) or per stock, per date.')
+    parser.add_argument('--chunk-rows', type=int, default=EXPORT_CHUNK_ROWS)
+    args = parser.parse_args()
+
+    requests = [(stock_code, None, None) for stock_code in args.stock_codes or []]
+    if args.requests_file:
+        requests += read_export_requests(args.requests_file)
+    if not requests:
+        parser.error('Pass --stock-codes or --requests-file.')
+    requests = [(stock_code, start_date if start_date is not None else args.start_date,
+                 end_date if end_date is not None else args.end_date) for stock_code, start_date, end_date in requests]
+
+    export_shareholding_data(requests, args.output, args.format, args.aggregate, args.chunk_rows)
@@ -0,0 +1,30 @@
+import multiprocessing
+import subprocess
+import sys
+from config import *
+
+# gunicorn settings of the Dash app, run from the src directory with gunicorn -c gunicorn.conf.py wsgi:application
+bind = f'{DASH_HOST}:{DASH_PORT}'
+workers = WSGI_WORKERS or multiprocessing.cpu_count()
+threads = WSGI_THREADS
+worker_class = 'gthread'
+timeout = WSGI_TIMEOUT_SECONDS
+# Each worker imports the app itself, so that no writer thread or connection is inherited across fork()
+preload_app = False
+
+_scrape_job_workers = None
+
+
+def on_starting(server):
+    # The scrape job workers run once beside the gunicorn workers, in their own process
+    global _scrape_job_workers
+    if SCRAPE_JOB_WORKER_PROCESSES:
+        _scrape_job_workers = subprocess.Popen(
+            [sys.executable, 'scrape_jobs.py', '--processes', str(SCRAPE_JOB_WORKER_PROCESSES)])
+        server.log.info(f'Started {SCRAPE_JOB_WORKER_PROCESSES} scrape job workers (pid {_scrape_job_workers.pid}).')
+
+
+def on_exit(server):
+    if _scrape_job_workers is not None:
+        _scrape_job_workers.terminate()
+        _scrape_job_workers.wait()
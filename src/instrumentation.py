@@ -0,0 +1,219 @@
+import bisect
+import contextlib
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+from config import *
+
+
+logger = logging.getLogger(__name__)
+
+# One JSON object per timed stage, written as is to INSTRUMENTATION_JSON_LOG_PATH
+timings_logger = logging.getLogger('timings')
+timings_logger.propagate = False
+if USE_INSTRUMENTATION and INSTRUMENTATION_JSON_LOG_PATH:
+    _timings_handler = logging.FileHandler(INSTRUMENTATION_JSON_LOG_PATH)
+    _timings_handler.setFormatter(logging.Formatter('%(message)s'))
+    timings_logger.addHandler(_timings_handler)
+    timings_logger.setLevel(logging.INFO)
+
+
+class StageHistograms:
+    """ Thread-safe histograms of the durations of named stages, e.g. 'scrape.search' or 'dash.generate_data'.
+
+    Buckets are cumulative upper bounds in seconds, as in the Prometheus exposition format.
+
+    """
+
+    def __init__(self, buckets_seconds: list = INSTRUMENTATION_BUCKETS_SECONDS) -> None:
+        self.buckets_seconds = sorted(buckets_seconds)
+        # stage -> [count per bucket (the last one for larger durations), count, sum of seconds]
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float) -> None:
+        bucket_index = bisect.bisect_left(self.buckets_seconds, seconds)
+        with self.lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = [[0] * (len(self.buckets_seconds) + 1), 0, 0.0]
+            histogram[0][bucket_index] += 1
+            histogram[1] += 1
+            histogram[2] += seconds
+
+    def get_metrics(self) -> dict:
+        """ Returns the count, total and mean seconds, and cumulative bucket counts of each stage.
+
+        Returns:
+            dict: Stage -> metrics.
+
+        """
+        with self.lock:
+            stages = {stage: (list(bucket_counts), count, total_seconds)
+                      for stage, (bucket_counts, count, total_seconds) in self.stages.items()}
+        metrics = {}
+        for stage, (bucket_counts, count, total_seconds) in sorted(stages.items()):
+            cumulative_counts = np.cumsum(bucket_counts).tolist()
+            metrics[stage] = {
+                'count': count,
+                'seconds_total': total_seconds,
+                'seconds_mean': total_seconds / count if count else 0.0,
+                'buckets': dict(zip([str(le) for le in self.buckets_seconds] + ['+Inf'], cumulative_counts)),
+            }
+        return metrics
+
+    def render_prometheus(self, name: str = 'shareholding_stage_duration_seconds') -> str:
+        # Prometheus text exposition format of the histograms, labelled by stage
+        lines = [f'# HELP {name} Duration of instrumented stages.', f'# TYPE {name} histogram']
+        for stage, metrics in self.get_metrics().items():
+            for le, cumulative_count in metrics['buckets'].items():
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{le}"}} {cumulative_count}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {metrics["seconds_total"]}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {metrics["count"]}')
+        return '\n'.join(lines) + '\n'
+
+
+# Process-wide histograms
+_stage_histograms = None
+_stage_histograms_lock = threading.Lock()
+
+
+def get_stage_histograms() -> StageHistograms:
+    """ Returns the process-wide StageHistograms, creating them on first use.
+
+    Returns:
+        StageHistograms: Shared histograms.
+
+    """
+    global _stage_histograms
+    with _stage_histograms_lock:
+        if _stage_histograms is None:
+            _stage_histograms = StageHistograms()
+        return _stage_histograms
+
+
+class StageTimer(contextlib.ContextDecorator):
+    """ Times a stage, as a context manager or a function decorator, see timed(). """
+
+    def __init__(self, stage: str, **fields) -> None:
+        self.stage = stage
+        self.fields = fields
+        self.started_at = None
+
+    def _recreate_cm(self):
+        # Each call of a decorated function gets its own timer, so that concurrent calls don't share started_at
+        return StageTimer(self.stage, **self.fields)
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if not USE_INSTRUMENTATION:
+            return
+        seconds = time.perf_counter() - self.started_at
+        get_stage_histograms().observe(self.stage, seconds)
+        if timings_logger.handlers:
+            timings_logger.info(json.dumps({
+                'time': time.time(),
+                'pid': os.getpid(),
+                'thread': threading.current_thread().name,
+                'stage': self.stage,
+                'seconds': round(seconds, 6),
+                'status': 'ok' if exc_type is None else exc_type.__name__,
+                **self.fields
+            }, default=str))
+
+
+def timed(stage: str, **fields) -> StageTimer:
+    """ Times a stage, e.g. with timed('scrape.search', stock_code=stock_code): ... or @timed('dash.generate_data').
+
+    The duration is added to the stage's histogram and logged as a JSON object with the extra fields.
+
+    Args:
+        stage (str): Stage name, dot-separated by component.
+        **fields: Extra fields of the JSON log.
+
+    Returns:
+        StageTimer: Context manager and decorator.
+
+    """
+    return StageTimer(stage, **fields)
+
+
+class RequestProfiler:
+    """ Opt-in cProfile capture of the next requests, armed from the /profile endpoint of the Dash app.
+
+    Profiles are dumped to INSTRUMENTATION_PROFILE_DIR (readable with pstats or snakeviz), and their slowest
+    functions are logged.
+
+    """
+
+    def __init__(self, profile_dir: str = INSTRUMENTATION_PROFILE_DIR) -> None:
+        self.profile_dir = profile_dir
+        self.n_armed = 0
+        self.lock = threading.Lock()
+
+    def arm(self, n_requests: int = 1) -> int:
+        with self.lock:
+            self.n_armed = max(int(n_requests), 0)
+            return self.n_armed
+
+    def start(self) -> cProfile.Profile:
+        """ Starts profiling the calling thread if armed.
+
+        Returns:
+            cProfile.Profile: Running profile to be passed to stop(), or None when not armed.
+
+        """
+        with self.lock:
+            if not self.n_armed:
+                return None
+            self.n_armed -= 1
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def stop(self, profile: cProfile.Profile, name: str) -> str:
+        """ Stops a profile, dumps it and logs its slowest functions.
+
+        Args:
+            profile (cProfile.Profile): Profile returned by start().
+            name (str): Request name, used in the file name.
+
+        Returns:
+            str: Path of the dumped profile.
+
+        """
+        profile.disable()
+        os.makedirs(self.profile_dir, exist_ok=True)
+        safe_name = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in name)[:100]
+        path = os.path.join(self.profile_dir, f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-{safe_name}.prof')
+        profile.dump_stats(path)
+        summary = io.StringIO()
+        pstats.Stats(profile, stream=summary).sort_stats('cumulative').print_stats(INSTRUMENTATION_PROFILE_TOP_N)
+        logger.info(f'Profile of {name} saved to {path}:\n{summary.getvalue()}')
+        return path
+
+
+# Process-wide profiler
+_request_profiler = None
+_request_profiler_lock = threading.Lock()
+
+
+def get_request_profiler() -> RequestProfiler:
+    """ Returns the process-wide RequestProfiler, creating it on first use.
+
+    Returns:
+        RequestProfiler: Shared profiler.
+
+    """
+    global _request_profiler
+    with _request_profiler_lock:
+        if _request_profiler is None:
+            _request_profiler = RequestProfiler()
+        return _request_profiler
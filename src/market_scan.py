@@ -0,0 +1,179 @@
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from shareholding_display import ShareholdingDisplay
+from shareholding_writer import get_shareholding_writer
+from transaction_matcher import MATCH_MODES
+from utils import *
+from queries import *
+from config import *
+
+
+logger = logging.getLogger(__name__)
+
+MARKET_SCAN_RESULT_COLUMNS = [
+    'date', 'stock_code', 'buyer_id', 'buyer_name', 'seller_id', 'seller_name', 'quantity', 'buyer_pct_change',
+    'seller_pct_change', 'buyer_shareholding', 'seller_shareholding', 'match_type', 'match_group'
+]
+
+
+def scan_stock_codes(stock_codes: list, start_date: pd.Timestamp, end_date: pd.Timestamp, threshold_percentage: float, match_mode: str) -> tuple:
+    """ Runs the transaction finder over a chunk of stock codes. Runs in the worker processes of run_market_scan().
+
+    Args:
+        stock_codes (list): HKEX stock codes.
+        start_date (pd.Timestamp): Start of the date range.
+        end_date (pd.Timestamp): End of the date range.
+        threshold_percentage (float): Threshold for detecting possible transactions.
+        match_mode (str): Buyer/seller matching mode, see transaction_matcher.match_transactions().
+
+    Returns:
+        tuple: Number of stock codes scanned and the potential transactions, in MARKET_SCAN_RESULT_COLUMNS.
+
+    """
+    potential_transactions_concat_list = []
+    for stock_code in stock_codes:
+        try:
+            potential_transactions_concat_list.append(ShareholdingDisplay.find_potential_transactions(
+                start_date, end_date, stock_code, threshold_percentage, match_mode))
+        except Exception as e:
+            logger.error(f'stock_code={stock_code}, market scan failed: {e}')
+
+    potential_transactions = pd.concat(
+        potential_transactions_concat_list, ignore_index=True) if potential_transactions_concat_list else pd.DataFrame()
+    # The exact mode has no match_type or match_group
+    return len(stock_codes), potential_transactions.reindex(columns=MARKET_SCAN_RESULT_COLUMNS)
+
+
+def run_market_scan(
+    start_date: pd.Timestamp,
+    end_date: pd.Timestamp,
+    threshold_percentage: float,
+    match_mode: str = TRANSACTION_MATCH_MODE,
+    stock_codes: list = None,
+    max_workers: int = MARKET_SCAN_MAX_WORKERS,
+    chunk_size: int = MARKET_SCAN_CHUNK_SIZE
+) -> int:
+    """ Runs the transaction finder across every stored stock over a process pool.
+
+    Results are written to the market_scan_results table as chunks complete. Only stored data is scanned,
+    run prepopulate_db.py first to scrape the date range.
+
+    Args:
+        start_date (pd.Timestamp): Start of the date range.
+        end_date (pd.Timestamp): End of the date range.
+        threshold_percentage (float): Threshold for detecting possible transactions.
+        match_mode (str, optional): Buyer/seller matching mode. Defaults to TRANSACTION_MATCH_MODE.
+        stock_codes (list, optional): Stock codes to scan. Defaults to None (every stock with data in the date range).
+        max_workers (int, optional): Worker processes. Defaults to MARKET_SCAN_MAX_WORKERS.
+        chunk_size (int, optional): Stock codes per task. Defaults to MARKET_SCAN_CHUNK_SIZE.
+
+    Returns:
+        int: scan_id of the market_scans and market_scan_results rows.
+
+    """
+    initialise_shareholding_db()
+    with connect_db() as con:
+        if stock_codes is None:
+            stock_codes = [stock_code for stock_code, in con.execute(PULL_STORED_STOCK_CODES_QUERY, {
+                'start_date_key': date_to_key(start_date),
+                'end_date_key': date_to_key(end_date)
+            })]
+        scan_id = con.execute(INSERT_MARKET_SCAN_QUERY, (
+            start_date.strftime(DATE_BASE_FORMAT), end_date.strftime(DATE_BASE_FORMAT),
+            threshold_percentage, match_mode
+        )).lastrowid
+
+    logger.info(f'Market scan {scan_id}: scanning {len(stock_codes)} stock codes...')
+    started_at = time.perf_counter()
+    writer = get_shareholding_writer()
+    n_scanned, n_results, status = 0, 0, 'completed'
+    result_writes = []
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(scan_stock_codes, stock_codes[i:i + chunk_size], start_date, end_date,
+                                threshold_percentage, match_mode)
+                for i in range(0, len(stock_codes), chunk_size)
+            ]
+            for future in as_completed(futures):
+                n_chunk_scanned, potential_transactions = future.result()
+                potential_transactions.insert(0, 'scan_id', scan_id)
+                # NaN (e.g. the pct change of a participant entering) is stored as NULL
+                result_writes.append(writer.submit(INSERT_MARKET_SCAN_RESULT_QUERY, list(
+                    potential_transactions.astype(object).where(potential_transactions.notna(), None).itertuples(index=False, name=None))))
+                n_scanned += n_chunk_scanned
+                n_results += len(potential_transactions)
+                logger.info(f'Market scan {scan_id}: {n_scanned}/{len(stock_codes)} stock codes scanned, '
+                            f'{n_results} potential transactions, {time.perf_counter() - started_at:.1f}s elapsed.')
+    except BaseException:
+        status = 'failed'
+        raise
+    finally:
+        # A scan whose results failed to commit is incomplete
+        if any(written.exception() is not None for written in result_writes):
+            logger.error(f'Market scan {scan_id}: failed to store its results.')
+            status = 'failed'
+        writer.submit(UPDATE_MARKET_SCAN_QUERY, [(status, n_scanned, scan_id)])
+        writer.flush()
+    return scan_id
+
+
+def pull_top_market_scan_results(scan_id: int, top_n: int = MARKET_SCAN_TOP_N) -> pd.DataFrame:
+    """ Retrieves the largest potential transactions of a market scan by quantity.
+
+    Args:
+        scan_id (int): Market scan.
+        top_n (int, optional): Number of transactions. Defaults to MARKET_SCAN_TOP_N.
+
+    Returns:
+        pd.DataFrame: Table of potential transactions.
+
+    """
+    with connect_db() as con:
+        return pd.read_sql(sql=PULL_TOP_MARKET_SCAN_RESULTS_QUERY, con=con, params={'scan_id': int(scan_id), 'top_n': int(top_n)})
+
+
+def get_market_scan(start_date: pd.Timestamp, end_date: pd.Timestamp, threshold_percentage: float, match_mode: str = TRANSACTION_MATCH_MODE, max_age_seconds: float = MARKET_SCAN_REUSE_SECONDS) -> int:
+    """ Returns a completed scan with the same parameters finished within max_age_seconds, or runs a new one.
+
+    Args:
+        start_date (pd.Timestamp): Start of the date range.
+        end_date (pd.Timestamp): End of the date range.
+        threshold_percentage (float): Threshold for detecting possible transactions.
+        match_mode (str, optional): Buyer/seller matching mode. Defaults to TRANSACTION_MATCH_MODE.
+        max_age_seconds (float, optional): Maximum age of a reused scan. Defaults to MARKET_SCAN_REUSE_SECONDS.
+
+    Returns:
+        int: scan_id.
+
+    """
+    with connect_db() as con:
+        recent_scan = con.execute(PULL_RECENT_MARKET_SCAN_QUERY, (
+            start_date.strftime(DATE_BASE_FORMAT), end_date.strftime(DATE_BASE_FORMAT),
+            threshold_percentage, match_mode, max_age_seconds
+        )).fetchone()
+    if recent_scan is not None:
+        return recent_scan[0]
+    return run_market_scan(start_date, end_date, threshold_percentage, match_mode)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Run the transaction finder across every stored stock and list the largest potential transactions.')
+    parser.add_argument('start_date', type=pd.Timestamp, help='Start of the date range (YYYY-MM-DD).')
+    parser.add_argument('end_date', type=pd.Timestamp, help='End of the date range (YYYY-MM-DD).')
+    parser.add_argument('--threshold-percentage', type=float, default=2)
+    parser.add_argument('--match-mode', choices=MATCH_MODES, default=TRANSACTION_MATCH_MODE)
+    parser.add_argument('--top-n', type=int, default=MARKET_SCAN_TOP_N)
+    parser.add_argument('--max-workers', type=int, default=MARKET_SCAN_MAX_WORKERS)
+    parser.add_argument('--output', help='Optional CSV path for the top-N table.')
+    args = parser.parse_args()
+
+    scan_id = run_market_scan(args.start_date, args.end_date, args.threshold_percentage, args.match_mode,
+                              max_workers=args.max_workers)
+    top_results = pull_top_market_scan_results(scan_id, args.top_n)
+    if args.output:
+        top_results.to_csv(args.output, index=False)
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        logger.info(f'Market scan {scan_id}, top {args.top_n} potential transactions:\n{top_results}')
@@ -0,0 +1,179 @@
+import argparse
+import os
+import time
+from shareholding_writer import get_shareholding_writer, update_holding_deltas, update_holding_rankings
+from utils import *
+from queries import *
+from config import *
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_db_size_bytes(db_path: str = SHAREHOLDING_DATA_DB_PATH) -> int:
+    # Size of the database file after checkpointing the write-ahead log into it
+    with connect_db(db_path) as con:
+        con.execute('PRAGMA wal_checkpoint(TRUNCATE);')
+    return os.path.getsize(db_path)
+
+
+def time_query(sql: str, params: dict = None, repeats: int = 5) -> tuple:
+    """ Times a query read with pd.read_sql.
+
+    Args:
+        sql (str): Query.
+        params (dict, optional): Parameters of the query. Defaults to None.
+        repeats (int, optional): Number of runs. Defaults to 5.
+
+    Returns:
+        tuple: Median seconds and number of rows returned.
+
+    """
+    timings = []
+    for _ in range(repeats):
+        started_at = time.perf_counter()
+        with connect_db() as con:
+            response_df = pd.read_sql(sql=sql, con=con, params=params)
+        timings.append(time.perf_counter() - started_at)
+    return float(np.median(timings)), len(response_df)
+
+
+def migrate_legacy_shareholding_table(chunk_rows: int = DB_WRITER_BATCH_ROWS, keep_legacy_table: bool = False) -> dict:
+    """ Migrates the denormalised shareholding table of earlier versions to the normalised schema.
+
+    Reports the database size and the time of a 1-year pull of the stock with the most rows, before and after, and
+    the number of rows without a participant ID, which are stored with an empty participant_id (as scraped ones).
+
+    Args:
+        chunk_rows (int, optional): Rows read from the legacy table at a time. Defaults to DB_WRITER_BATCH_ROWS.
+        keep_legacy_table (bool, optional): If True, the legacy table is not dropped. Defaults to False.
+
+    Returns:
+        dict: Before/after report.
+
+    """
+    initialise_shareholding_db()
+    with connect_db() as con:
+        if not con.execute(LEGACY_SHAREHOLDING_TABLE_EXISTS_QUERY).fetchone():
+            logger.info('No legacy shareholding table found. Nothing to migrate.')
+            return {}
+        largest_stock = con.execute(PULL_LEGACY_LARGEST_STOCK_QUERY).fetchone()
+        n_rows_without_participant_id = con.execute(COUNT_LEGACY_ROWS_WITHOUT_PARTICIPANT_ID_QUERY).fetchone()[0]
+
+    if largest_stock is None:
+        logger.info('Legacy shareholding table is empty.')
+        report = {}
+    else:
+        stock_code, end_date = largest_stock
+        end_date = pd.Timestamp(end_date)
+        start_date = end_date - pd.Timedelta(days=364)
+        legacy_seconds, legacy_rows = time_query(PULL_LEGACY_SHAREHOLDING_DATA_QUERY, {
+            'start_date': start_date.strftime(DATE_BASE_FORMAT),
+            'end_date': end_date.strftime(DATE_BASE_FORMAT),
+            'stock_code': stock_code
+        })
+        report = {
+            'stock_code': stock_code,
+            'start_date': start_date.strftime(DATE_BASE_FORMAT),
+            'end_date': end_date.strftime(DATE_BASE_FORMAT),
+            'size_bytes_before': get_db_size_bytes(),
+            'pull_seconds_before': legacy_seconds,
+            'pull_rows_before': legacy_rows,
+        }
+
+    # Copy through the writer, which normalises rows and drops pages duplicated by date snapping
+    writer = get_shareholding_writer()
+    n_rows = 0
+    writes = []
+    with connect_db() as con:
+        for chunk in pd.read_sql(sql=PULL_ALL_LEGACY_SHAREHOLDING_DATA_QUERY, con=con, chunksize=chunk_rows):
+            writes.append(writer.submit_shareholding(chunk))
+            n_rows += len(chunk)
+            logger.info(f'{n_rows} rows migrated...')
+    writer.flush()
+    # The legacy table is only dropped once every chunk has been committed
+    for written in writes:
+        written.result()
+
+    if not keep_legacy_table:
+        with connect_db() as con:
+            con.execute(DROP_LEGACY_SHAREHOLDING_TABLE_QUERY)
+            con.execute('VACUUM;')
+
+    if report:
+        normalised_seconds, normalised_rows = time_query(PULL_SHAREHOLDING_DATA_QUERY, {
+            'start_date_key': date_to_key(start_date),
+            'end_date_key': date_to_key(end_date),
+            'stock_code': int(stock_code)
+        })
+        report.update({
+            'size_bytes_after': get_db_size_bytes(),
+            'pull_seconds_after': normalised_seconds,
+            'pull_rows_after': normalised_rows,
+        })
+    report['rows_migrated'] = n_rows
+    report['rows_without_participant_id'] = n_rows_without_participant_id
+    if n_rows_without_participant_id:
+        logger.info(f'{n_rows_without_participant_id} rows without a participant ID are stored with an empty participant_id.')
+    return report
+
+
+def rebuild_holding_deltas() -> int:
+    """ Recomputes the holding_deltas and holding_rankings tables from the holdings table, e.g. for databases created
+    before they existed.
+
+    Returns:
+        int: Number of (stock_code, date) pairs recomputed.
+
+    """
+    initialise_shareholding_db()
+    with connect_db() as con:
+        stock_dates = con.execute(PULL_HOLDING_DATES_QUERY).fetchall()
+    # One transaction per stock keeps the write lock short for a running app
+    for i, (stock_code, date_keys) in enumerate(pd.DataFrame(stock_dates, columns=['stock_code', 'date_key']).groupby('stock_code')['date_key']):
+        with connect_db() as con:
+            stock_date_keys = {(int(stock_code), int(date_key)) for date_key in date_keys}
+            update_holding_deltas(con, stock_date_keys)
+            update_holding_rankings(con, stock_date_keys)
+        if i % 100 == 0:
+            logger.info(f'Rebuilt holding deltas and rankings of {i + 1} stocks...')
+    # Refresh the planner statistics so the finder ranges over the abs(pct_change) index
+    with connect_db() as con:
+        con.execute('PRAGMA optimize;')
+    return len(stock_dates)
+
+
+def rebuild_trading_calendar() -> int:
+    """ Learns the non_trading_dates table from the dates snapped back in scrape_dates.
+
+    Returns:
+        int: Number of non-trading dates known.
+
+    """
+    initialise_shareholding_db()
+    with connect_db() as con:
+        con.execute(LEARN_NON_TRADING_DATES_QUERY, {'today_key': date_to_key(pd.Timestamp.today())})
+        return len(con.execute(PULL_NON_TRADING_DATES_QUERY).fetchall())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Migrate the shareholding table of earlier versions to the normalised schema.')
+    parser.add_argument('--rebuild-deltas', action='store_true',
+                        help='Only recompute the holding_deltas and holding_rankings tables from the holdings table.')
+    parser.add_argument('--rebuild-calendar', action='store_true',
+                        help='Only learn the non_trading_dates table from the scrape_dates table.')
+    parser.add_argument('--keep-legacy-table', action='store_true',
+                        help='Keep the legacy shareholding table after migrating (the size report then includes it).')
+    args = parser.parse_args()
+
+    if args.rebuild_deltas:
+        logger.info(f'Rebuilt holding deltas and rankings of {rebuild_holding_deltas()} dates.')
+        raise SystemExit
+    if args.rebuild_calendar:
+        logger.info(f'{rebuild_trading_calendar()} non-trading dates known.')
+        raise SystemExit
+
+    report = migrate_legacy_shareholding_table(keep_legacy_table=args.keep_legacy_table)
+    for key, value in report.items():
+        logger.info(f'{key}: {value}')
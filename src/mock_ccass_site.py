@@ -0,0 +1,243 @@
+import argparse
+import html
+import os
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+from synthetic_data import SyntheticCCASSDataset
+from config import *
+
+
+logger = logging.getLogger(__name__)
+
+SEARCH_FORM_FIXTURE_NAME = 'search_form.html'
+
+SEARCH_FORM_TEMPLATE = """<!DOCTYPE html>
+<html>
+<body>
+<form method="post" action="./searchsdw.aspx" id="form1">
+<input type="hidden" name="__EVENTTARGET" id="__EVENTTARGET" value="" />
+<input type="hidden" name="__EVENTARGUMENT" id="__EVENTARGUMENT" value="" />
+<input type="hidden" name="__VIEWSTATE" id="__VIEWSTATE" value="mock-viewstate" />
+<input type="hidden" name="__VIEWSTATEGENERATOR" id="__VIEWSTATEGENERATOR" value="3B50BBBD" />
+<input type="hidden" name="__EVENTVALIDATION" id="__EVENTVALIDATION" value="mock-eventvalidation" />
+<input type="hidden" name="today" id="today" value="{today}" />
+<input type="hidden" name="sortBy" id="sortBy" value="shareholding" />
+<input type="hidden" name="sortDirection" id="sortDirection" value="desc" />
+<input type="hidden" name="alertMsg" id="alertMsg" value="{alert_message}" />
+<input type="text" name="txtShareholdingDate" id="txtShareholdingDate" value="{date_hkex}" />
+<input type="text" name="txtStockCode" id="txtStockCode" value="{stock_code}" />
+<input type="text" name="txtStockName" id="txtStockName" value="{stock_name}" />
+<input type="text" name="txtParticipantID" id="txtParticipantID" value="" />
+<input type="text" name="txtParticipantName" id="txtParticipantName" value="" />
+<input type="text" name="txtSelPartID" id="txtSelPartID" value="" />
+<a id="btnSearch" href="javascript:__doPostBack('btnSearch','')">Search</a>
+{results}</form>
+</body>
+</html>
+"""
+
+
+def render_search_form(date_hkex: str = '', stock_code: str = '', alert_message: str = '') -> str:
+    """ Renders a search page without results, optionally carrying an alert message.
+
+    Args:
+        date_hkex (str, optional): Value of the shareholding date field. Defaults to ''.
+        stock_code (str, optional): Value of the stock code field. Defaults to ''.
+        alert_message (str, optional): Value of the alertMsg field. Defaults to ''.
+
+    Returns:
+        str: HTML of the search page.
+
+    """
+    return SEARCH_FORM_TEMPLATE.format(
+        today=pd.Timestamp.now().strftime('%Y%m%d'),
+        alert_message=alert_message,
+        date_hkex=date_hkex,
+        stock_code=stock_code,
+        stock_name='',
+        results=''
+    )
+
+
+SEARCH_RESULT_TABLE_TEMPLATE = """<div id="pnlResultNormal"><div class="search-details-table-container table-mobile-list-container"><table class="table table-scroll table-sort table-mobile-list"><thead><tr>
+<th>Participant ID</th><th>Name of CCASS Participant(* for Consenting Investor Participants )</th><th>Address</th><th>Shareholding</th><th>% of the total number of Issued Shares/ Warrants/ Units</th></tr></thead><tbody>{rows}</tbody></table></div></div>
+"""
+
+SEARCH_RESULT_ROW_TEMPLATE = """<tr>
+<td class="col-participant-id"><div class="mobile-list-heading">Participant ID:</div><div class="mobile-list-body">{participant_id}</div></td>
+<td class="col-participant-name"><div class="mobile-list-heading">Name of CCASS Participant(* for Consenting Investor Participants ):</div><div class="mobile-list-body">{participant_name}</div></td>
+<td class="col-address"><div class="mobile-list-heading">Address:</div><div class="mobile-list-body">SYNTHETIC ADDRESS, HONG KONG</div></td>
+<td class="col-shareholding text-right"><div class="mobile-list-heading">Shareholding:</div><div class="mobile-list-body">{shareholding:,}</div></td>
+<td class="col-shareholding-percent text-right"><div class="mobile-list-heading">% of the total number of Issued Shares/ Warrants/ Units:</div><div class="mobile-list-body">{pct_total_issued:.2f}%</div></td>
+</tr>"""
+
+
+def render_search_result_page(date_hkex: str, stock_code: str, stock_name: str, df: pd.DataFrame) -> str:
+    """ Renders a search page with the shareholding table of a stock, in the markup of the real search page.
+
+    Args:
+        date_hkex (str): Displayed shareholding date (YYYY/MM/DD).
+        stock_code (str): Value of the stock code field.
+        stock_name (str): Value of the stock name field.
+        df (pd.DataFrame): Rows with the columns participant_id, participant_name, shareholding and pct_total_issued.
+
+    Returns:
+        str: HTML of the search page.
+
+    """
+    rows = ''.join(
+        SEARCH_RESULT_ROW_TEMPLATE.format(
+            participant_id=html.escape(participant_id),
+            participant_name=html.escape(participant_name),
+            shareholding=shareholding,
+            pct_total_issued=pct_total_issued
+        )
+        for participant_id, participant_name, shareholding, pct_total_issued in df[
+            ['participant_id', 'participant_name', 'shareholding', 'pct_total_issued']].itertuples(index=False, name=None)
+    )
+    return SEARCH_FORM_TEMPLATE.format(
+        today=pd.Timestamp.now().strftime('%Y%m%d'),
+        alert_message='',
+        date_hkex=date_hkex,
+        stock_code=stock_code,
+        stock_name=html.escape(stock_name),
+        results=SEARCH_RESULT_TABLE_TEMPLATE.format(rows=rows)
+    )
+
+
+def get_fixture_name(date: pd.Timestamp, stock_code: int) -> str:
+    # Recorded result pages are named after the requested stock code and date
+    return f'{stock_code}_{date.strftime("%Y%m%d")}.html'
+
+
+class MockCCASSRequestHandler(BaseHTTPRequestHandler):
+    """ Stand-in for the CCASS search page, serving recorded HTML fixtures or a synthetic dataset.
+
+    GET returns the search form. POST returns the fixture recorded for the requested (stock_code, date). Otherwise
+    stock codes of the dataset get the page of the latest trading date on or before the requested date, and dates
+    outside its range get an alert. Any other stock code gets the search form with an 'unavailable' alert.
+    Every response is delayed by latency_seconds, plus or minus up to latency_jitter_seconds.
+
+    """
+    # Keep-alive, as the real site, so that clients can reuse their connections
+    protocol_version = 'HTTP/1.1'
+    fixtures_dir = None
+    dataset = None
+    latency_seconds = 0.0
+    latency_jitter_seconds = 0.0
+
+    def _inject_latency(self) -> None:
+        latency = self.latency_seconds + random.uniform(-self.latency_jitter_seconds, self.latency_jitter_seconds)
+        if latency > 0:
+            time.sleep(latency)
+
+    def _send_html(self, html: str, status: int = 200) -> None:
+        body = html.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        self._inject_latency()
+        fixture_path = os.path.join(
+            self.fixtures_dir, SEARCH_FORM_FIXTURE_NAME) if self.fixtures_dir else None
+        if fixture_path is not None and os.path.exists(fixture_path):
+            with open(fixture_path, encoding='utf-8') as f:
+                self._send_html(f.read())
+        else:
+            self._send_html(render_search_form())
+
+    def do_POST(self) -> None:
+        self._inject_latency()
+        content_length = int(self.headers.get('Content-Length', 0))
+        form = parse_qs(self.rfile.read(content_length).decode('utf-8'))
+        date_hkex = form.get('txtShareholdingDate', [''])[0]
+        stock_code = form.get('txtStockCode', [''])[0]
+
+        try:
+            date, stock_code_int = pd.Timestamp(date_hkex), int(stock_code)
+        except ValueError:
+            date, stock_code_int = None, None
+        fixture_path = os.path.join(self.fixtures_dir, get_fixture_name(date, stock_code_int)) if (
+            self.fixtures_dir and date is not None) else None
+
+        if fixture_path is not None and os.path.exists(fixture_path):
+            with open(fixture_path, encoding='utf-8') as f:
+                self._send_html(f.read())
+        elif self.dataset is not None and stock_code_int in self.dataset:
+            trading_date = self.dataset.get_trading_date(date)
+            if trading_date is None:
+                self._send_html(render_search_form(
+                    date_hkex=date_hkex,
+                    stock_code=stock_code,
+                    alert_message='The shareholding date entered is outside the range available for enquiry.'
+                ))
+            else:
+                stock_name, df = self.dataset.get_shareholding(trading_date, stock_code_int)
+                self._send_html(render_search_result_page(
+                    trading_date.strftime(DATE_HKEX_FORMAT), stock_code, stock_name, df))
+        else:
+            self._send_html(render_search_form(
+                date_hkex=date_hkex,
+                stock_code=stock_code,
+                alert_message='The stock code entered does not exist OR not available for enquiry.'
+            ))
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug(format % args)
+
+
+def run_mock_ccass_site(fixtures_dir: str = None, host: str = '127.0.0.1', port: int = 8888, dataset: SyntheticCCASSDataset = None, latency_seconds: float = 0.0, latency_jitter_seconds: float = 0.0) -> ThreadingHTTPServer:
+    """ Creates the stand-in CCASS search site. Call serve_forever() on the returned server to run it.
+
+    Point CCASS_SHAREHOLDING_SEARCH_URL at http://{host}:{port}/ to scrape from it.
+
+    Args:
+        fixtures_dir (str, optional): Directory of recorded search result pages. Defaults to None.
+        host (str, optional): Host to bind. Defaults to '127.0.0.1'.
+        port (int, optional): Port to bind, 0 for any free port. Defaults to 8888.
+        dataset (SyntheticCCASSDataset, optional): Synthetic data served for stock codes without fixtures.
+            Defaults to None.
+        latency_seconds (float, optional): Delay of every response. Defaults to 0.0.
+        latency_jitter_seconds (float, optional): Maximum random variation of the delay. Defaults to 0.0.
+
+    Returns:
+        ThreadingHTTPServer: The bound server.
+
+    """
+    handler = type('Handler', (MockCCASSRequestHandler,), {
+        'fixtures_dir': fixtures_dir,
+        'dataset': dataset,
+        'latency_seconds': latency_seconds,
+        'latency_jitter_seconds': latency_jitter_seconds,
+    })
+    return ThreadingHTTPServer((host, port), handler)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Serve recorded or synthetic CCASS search pages locally.')
+    parser.add_argument('fixtures_dir', nargs='?', help='Directory of recorded search result pages.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8888)
+    parser.add_argument('--synthetic-stock-codes', type=int, nargs='+', default=[],
+                        help='Stock codes served from synthetic data.')
+    parser.add_argument('--synthetic-participants', type=int, default=500)
+    parser.add_argument('--synthetic-days', type=int, default=365, help='Calendar days of synthetic data.')
+    parser.add_argument('--synthetic-start-date', type=pd.Timestamp, default=pd.Timestamp('2022-01-03'))
+    parser.add_argument('--latency-ms', type=float, default=0, help='Delay of every response.')
+    parser.add_argument('--latency-jitter-ms', type=float, default=0)
+    args = parser.parse_args()
+    if not args.fixtures_dir and not args.synthetic_stock_codes:
+        parser.error('Pass a fixtures directory or --synthetic-stock-codes.')
+
+    dataset = SyntheticCCASSDataset(args.synthetic_stock_codes, args.synthetic_participants, args.synthetic_days,
+                                    args.synthetic_start_date) if args.synthetic_stock_codes else None
+    server = run_mock_ccass_site(args.fixtures_dir, args.host, args.port, dataset,
+                                 args.latency_ms / 1000, args.latency_jitter_ms / 1000)
+    logger.info(f'Serving {args.fixtures_dir or "synthetic data"} on http://{args.host}:{args.port}/')
+    server.serve_forever()
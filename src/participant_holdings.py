@@ -0,0 +1,83 @@
+import argparse
+from instrumentation import timed
+from utils import *
+from queries import *
+from config import *
+
+
+logger = logging.getLogger(__name__)
+
+
+@timed('db.pull_participant_holdings')
+def pull_participant_holdings(participant_id: str, start_date: pd.Timestamp, end_date: pd.Timestamp) -> pd.DataFrame:
+    """ Retrieves a participant's holdings across every stock stored for the date range.
+
+    Each stock's holding is that of its last stored date within the date range. Only stored data is read.
+
+    Args:
+        participant_id (str): CCASS participant ID, e.g. 'C00019'.
+        start_date (pd.Timestamp): Start of the date range.
+        end_date (pd.Timestamp): End of the date range.
+
+    Returns:
+        pd.DataFrame: Table of holdings, by pct_total_issued in descending order.
+
+    """
+    with connect_db() as con:
+        return pd.read_sql(
+            sql=PULL_PARTICIPANT_HOLDINGS_QUERY,
+            con=con,
+            params={
+                'participant_id': participant_id,
+                'start_date_key': date_to_key(start_date),
+                'end_date_key': date_to_key(end_date)
+            }
+        )
+
+
+@timed('db.pull_participant_holding_changes')
+def pull_participant_holding_changes(participant_id: str, start_date: pd.Timestamp, end_date: pd.Timestamp, top_n: int = PARTICIPANT_HOLDINGS_TOP_N) -> pd.DataFrame:
+    """ Retrieves the largest net changes of a participant's holdings across stocks over a date range.
+
+    Changes are between the first and last stored dates of each stock within the date range, and ranked by their
+    percentage of the total number of issued shares of the stock, so that they compare across stocks. Stocks the
+    participant entered or left within the date range are included.
+
+    Args:
+        participant_id (str): CCASS participant ID, e.g. 'C00019'.
+        start_date (pd.Timestamp): Start of the date range.
+        end_date (pd.Timestamp): End of the date range.
+        top_n (int, optional): Number of stocks. Defaults to PARTICIPANT_HOLDINGS_TOP_N.
+
+    Returns:
+        pd.DataFrame: Table of the shareholding on the last stored date and the net change (shareholding_change,
+            pct_total_issued_change) of each stock.
+
+    """
+    with connect_db() as con:
+        return pd.read_sql(
+            sql=PULL_PARTICIPANT_HOLDING_CHANGES_QUERY,
+            con=con,
+            params={
+                'participant_id': participant_id,
+                'start_date_key': date_to_key(start_date),
+                'end_date_key': date_to_key(end_date),
+                'top_n': int(top_n)
+            }
+        )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="List a participant's holdings across the stored stocks and their largest changes.")
+    parser.add_argument('participant_id', help="CCASS participant ID, e.g. 'C00019'.")
+    parser.add_argument('start_date', type=pd.Timestamp, help='Start of the date range (YYYY-MM-DD).')
+    parser.add_argument('end_date', type=pd.Timestamp, help='End of the date range (YYYY-MM-DD).')
+    parser.add_argument('--top-n', type=int, default=PARTICIPANT_HOLDINGS_TOP_N)
+    args = parser.parse_args()
+
+    holdings = pull_participant_holdings(args.participant_id, args.start_date, args.end_date)
+    holding_changes = pull_participant_holding_changes(args.participant_id, args.start_date, args.end_date, args.top_n)
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        logger.info(f'{args.participant_id}: holdings of {len(holdings)} stocks:\n{holdings}')
+        logger.info(f'{args.participant_id}: largest {args.top_n} changes:\n{holding_changes}')
@@ -1,21 +1,36 @@
-from shareholding_data import ShareholdingData
-from concurrent.futures import ThreadPoolExecutor
+import argparse
+from scrape_scheduler import ScrapeScheduler, ScrapeCheckpoint
+from stock_code_registry import seed_unavailable_stock_codes
 from config import *
 
 logger = logging.getLogger(__name__)
 
 if __name__ == '__main__':
-    if USE_MULTITHREADING:
-        # Distribute stock_code to threads
-        with ThreadPoolExecutor(MULTITHREADING_MAX_WORKERS) as executor:
-            executor.map(
-                lambda stock_code: ShareholdingData.pull_shareholding_data(
-                    PREPOPULATE_START_DATE, PREPOPULATE_END_DATE, stock_code),
-                PREPOPULATE_STOCK_CODE_RANGE
-            )
-    else:
-        for stock_code in PREPOPULATE_STOCK_CODE_RANGE:
-            ShareholdingData.pull_shareholding_data(
-                PREPOPULATE_START_DATE, PREPOPULATE_END_DATE, stock_code)
+    parser = argparse.ArgumentParser(
+        description='Scrape PREPOPULATE_STOCK_CODE_RANGE between PREPOPULATE_START_DATE and PREPOPULATE_END_DATE into the database.')
+    parser.add_argument('--concurrency', type=int, default=PREPOPULATE_CONCURRENCY,
+                        help='Number of concurrent scraper workers.')
+    parser.add_argument('--rate-limit', type=float, default=PREPOPULATE_RATE_LIMIT_PER_SECOND,
+                        help='Maximum number of searches per second across all workers.')
+    parser.add_argument('--reset-checkpoint', action='store_true',
+                        help='Discard the checkpoint of previous runs instead of resuming.')
+    parser.add_argument('--listed-securities', metavar='PATH',
+                        help='Listed securities file (e.g. HKEX ListOfSecurities.xlsx). Stock codes missing from it are '
+                        'registered as unavailable and skipped.')
+    args = parser.parse_args()
 
-logger.info('All done.')
+    if args.listed_securities:
+        seed_unavailable_stock_codes(args.listed_securities)
+
+    if args.reset_checkpoint:
+        ScrapeCheckpoint.reset(PREPOPULATE_START_DATE, PREPOPULATE_END_DATE)
+
+    ScrapeScheduler(
+        start_date=PREPOPULATE_START_DATE,
+        end_date=PREPOPULATE_END_DATE,
+        stock_codes=PREPOPULATE_STOCK_CODE_RANGE,
+        concurrency=args.concurrency,
+        rate_limit_per_second=args.rate_limit
+    ).run()
+
+    logger.info('All done.')
@@ -1,38 +1,789 @@
 from config import *
 
-CREATE_SHAREHOLDING_TABLE_QUERY = """
-CREATE TABLE IF NOT EXISTS shareholding (
-    date_requested TEXT,
-    date TEXT,
+# Shareholding data is normalised into stock and participant dimension tables and a holdings fact table
+# Dates are stored as integer day keys (days since 1970-01-01), see utils.date_to_key()
+CREATE_STOCKS_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS stocks (
+    stock_code INTEGER PRIMARY KEY,
+    stock_name TEXT
+);
+"""
+
+CREATE_PARTICIPANTS_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS participants (
+    participant_key INTEGER PRIMARY KEY,
+    participant_id TEXT NOT NULL,
+    participant_name TEXT NOT NULL,
+    UNIQUE (participant_id, participant_name)
+);
+"""
+
+# Maps each requested date to the date displayed by the site, which snaps Sundays and holidays back
+CREATE_SCRAPE_DATES_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS scrape_dates (
+    stock_code INTEGER,
+    date_requested_key INTEGER,
+    date_key INTEGER,
+    PRIMARY KEY (stock_code, date_requested_key)
+) WITHOUT ROWID;
+"""
+
+# Dates on which the site displayed an earlier trading date, learned from scrape_dates, see trading_calendar.py
+CREATE_NON_TRADING_DATES_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS non_trading_dates (
+    date_key INTEGER PRIMARY KEY,
+    trading_date_key INTEGER
+);
+"""
+
+CREATE_HOLDINGS_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS holdings (
     stock_code INTEGER,
-    stock_name TEXT,
-    participant_id TEXT,
-    participant_name TEXT,
+    date_key INTEGER,
+    participant_key INTEGER,
     shareholding INTEGER,
-    pct_total_issued REAL
+    pct_total_issued REAL,
+    PRIMARY KEY (stock_code, date_key, participant_key)
+) WITHOUT ROWID;
+"""
+
+# Day-over-day change of each participant's holding against the previous stored date of the stock
+# Participants leaving have a row with a shareholding of 0, participants entering have a NULL pct_change
+CREATE_HOLDING_DELTAS_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS holding_deltas (
+    stock_code INTEGER,
+    date_key INTEGER,
+    participant_key INTEGER,
+    prev_date_key INTEGER,
+    shareholding INTEGER,
+    shareholding_diff INTEGER,
+    pct_change REAL,
+    PRIMARY KEY (stock_code, date_key, participant_key)
+) WITHOUT ROWID;
+"""
+
+# Lets the transaction finder range over abs(pct_change) within each date of a stock
+# Entering participants (NULL pct_change) are indexed as an infinite change
+CREATE_HOLDING_DELTAS_PCT_CHANGE_INDEX_QUERY = """
+CREATE INDEX IF NOT EXISTS holding_deltas_abs_pct_change_index
+ON holding_deltas (stock_code, date_key, abs(ifnull(pct_change, 9e999)));
+"""
+
+UPSERT_STOCK_QUERY = """
+INSERT INTO stocks (stock_code, stock_name) VALUES (?, ?)
+ON CONFLICT (stock_code) DO UPDATE SET stock_name = excluded.stock_name;
+"""
+
+INSERT_PARTICIPANT_QUERY = """
+INSERT OR IGNORE INTO participants (participant_id, participant_name) VALUES (?, ?);
+"""
+
+PULL_PARTICIPANT_KEY_QUERY = """
+SELECT participant_key FROM participants
+WHERE participant_id = ? AND participant_name = ?;
+"""
+
+PULL_PARTICIPANT_KEYS_QUERY = """
+SELECT participant_id, participant_name, participant_key FROM participants;
+"""
+
+INSERT_SCRAPE_DATE_QUERY = """
+INSERT OR REPLACE INTO scrape_dates (stock_code, date_requested_key, date_key) VALUES (?, ?, ?);
+"""
+
+INSERT_NON_TRADING_DATE_QUERY = """
+INSERT OR IGNORE INTO non_trading_dates (date_key, trading_date_key) VALUES (?, ?);
+"""
+
+PULL_NON_TRADING_DATES_QUERY = """
+SELECT date_key, trading_date_key FROM non_trading_dates;
+"""
+
+# Backfill of non_trading_dates from the dates snapped back in scrape_dates before today
+LEARN_NON_TRADING_DATES_QUERY = """
+INSERT OR IGNORE INTO non_trading_dates (date_key, trading_date_key)
+SELECT date_requested_key, MIN(date_key) FROM scrape_dates
+WHERE date_key < date_requested_key AND date_requested_key < :today_key
+GROUP BY date_requested_key;
+"""
+
+# Maps a non-trading date to the stored holdings of its trading date, instead of scraping it
+INSERT_SCRAPE_DATE_MAPPING_QUERY = """
+INSERT OR IGNORE INTO scrape_dates (stock_code, date_requested_key, date_key)
+SELECT :stock_code, :date_requested_key, :date_key
+WHERE EXISTS (SELECT 1 FROM holdings WHERE stock_code = :stock_code AND date_key = :date_key);
+"""
+
+PULL_STOCK_DATE_KEYS_QUERY = """
+SELECT DISTINCT date_key FROM scrape_dates WHERE stock_code = :stock_code;
+"""
+
+INSERT_HOLDING_QUERY = """
+INSERT OR REPLACE INTO holdings (stock_code, date_key, participant_key, shareholding, pct_total_issued)
+VALUES (?, ?, ?, ?, ?);
+"""
+
+PULL_PREV_HOLDING_DATE_QUERY = """
+SELECT MAX(date_key) FROM holdings WHERE stock_code = ? AND date_key < ?;
+"""
+
+PULL_NEXT_HOLDING_DATE_QUERY = """
+SELECT MIN(date_key) FROM holdings WHERE stock_code = ? AND date_key > ?;
+"""
+
+DELETE_HOLDING_DELTAS_QUERY = """
+DELETE FROM holding_deltas WHERE stock_code = :stock_code AND date_key = :date_key;
+"""
+
+# Participants holding on date_key, against their holding on prev_date_key (NULL on the first stored date)
+INSERT_HOLDING_DELTAS_QUERY = """
+INSERT INTO holding_deltas
+SELECT
+    h.stock_code,
+    h.date_key,
+    h.participant_key,
+    :prev_date_key,
+    h.shareholding,
+    CASE WHEN :prev_date_key IS NULL THEN NULL ELSE h.shareholding - COALESCE(p.shareholding, 0) END,
+    CASE WHEN p.shareholding > 0 THEN (h.shareholding - p.shareholding) * 1.0 / p.shareholding END
+FROM holdings h
+LEFT JOIN holdings p
+ON (p.stock_code = h.stock_code) AND (p.date_key = :prev_date_key) AND (p.participant_key = h.participant_key)
+WHERE h.stock_code = :stock_code AND h.date_key = :date_key;
+"""
+
+# Participants holding on prev_date_key but not on date_key
+INSERT_LEAVING_HOLDING_DELTAS_QUERY = """
+INSERT INTO holding_deltas
+SELECT p.stock_code, :date_key, p.participant_key, :prev_date_key, 0, -p.shareholding, -1.0
+FROM holdings p
+WHERE p.stock_code = :stock_code AND p.date_key = :prev_date_key AND p.shareholding > 0
+AND NOT EXISTS (
+    SELECT 1 FROM holdings h
+    WHERE (h.stock_code = p.stock_code) AND (h.date_key = :date_key) AND (h.participant_key = p.participant_key)
 );
 """
 
-CREATE_SHAREHOLDING_INDEX_QUERY = """
-CREATE INDEX IF NOT EXISTS shareholding_idx ON shareholding (date_requested, date, stock_code)
+PULL_HOLDING_DATES_QUERY = """
+SELECT DISTINCT stock_code, date_key FROM holdings;
+"""
+
+CHECK_HOLDING_DELTAS_MISSING_QUERY = """
+SELECT 1 WHERE EXISTS (SELECT 1 FROM holdings) AND NOT EXISTS (SELECT 1 FROM holding_deltas);
 """
 
+# Write counter of the data of each stock and month of date_requested (YYYYMM), bumped by the ShareholdingWriter
+# whenever holdings or scrape dates of the month are written. Tells the columnar cache which partitions are stale
+CREATE_STOCK_MONTH_GENERATIONS_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS stock_month_generations (
+    stock_code INTEGER,
+    month_key INTEGER,
+    generation INTEGER NOT NULL,
+    PRIMARY KEY (stock_code, month_key)
+) WITHOUT ROWID;
+"""
+
+# Bumps the months of the requested dates displayed as a written (stock_code, date_key)
+BUMP_STOCK_MONTH_GENERATIONS_QUERY = """
+INSERT INTO stock_month_generations (stock_code, month_key, generation)
+SELECT DISTINCT stock_code, CAST(strftime('%Y%m', date_requested_key * 86400, 'unixepoch') AS INTEGER), 1
+FROM scrape_dates
+WHERE stock_code = :stock_code AND date_key = :date_key
+ON CONFLICT (stock_code, month_key) DO UPDATE SET generation = generation + 1;
+"""
+
+# Largest HOLDING_RANKINGS_DEPTH holders of each stored (stock_code, date_key), maintained at ingest
+CREATE_HOLDING_RANKINGS_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS holding_rankings (
+    stock_code INTEGER,
+    date_key INTEGER,
+    rank INTEGER,
+    participant_key INTEGER,
+    shareholding INTEGER,
+    PRIMARY KEY (stock_code, date_key, rank)
+) WITHOUT ROWID;
+"""
+
+DELETE_HOLDING_RANKINGS_QUERY = """
+DELETE FROM holding_rankings WHERE stock_code = :stock_code AND date_key = :date_key;
+"""
+
+INSERT_HOLDING_RANKINGS_QUERY = """
+INSERT INTO holding_rankings
+SELECT stock_code, date_key, rank, participant_key, shareholding
+FROM (
+    SELECT
+        stock_code,
+        date_key,
+        ROW_NUMBER() OVER (ORDER BY shareholding DESC, participant_key) AS rank,
+        participant_key,
+        shareholding
+    FROM holdings
+    WHERE stock_code = :stock_code AND date_key = :date_key
+)
+WHERE rank <= :depth;
+"""
+
+CHECK_HOLDING_RANKINGS_MISSING_QUERY = """
+SELECT 1 WHERE EXISTS (SELECT 1 FROM holdings) AND NOT EXISTS (SELECT 1 FROM holding_rankings);
+"""
+
+# Stored dates of a stock within a date range, from the rank 1 rows
+PULL_RANKED_DATE_KEYS_QUERY = """
+SELECT date_key FROM holding_rankings
+WHERE stock_code = :stock_code AND date_key BETWEEN :start_date_key AND :end_date_key AND rank = 1
+ORDER BY date_key;
+"""
+
+PULL_TOP_PARTICIPANTS_BY_SHAREHOLDING_QUERY = """
+SELECT participant_key FROM holding_rankings
+WHERE stock_code = :stock_code AND date_key = :date_key AND rank <= :top_n
+ORDER BY rank;
+"""
+
+# Largest absolute changes between two stored dates, counting participants missing on either date as holding 0
+PULL_TOP_PARTICIPANTS_BY_CHANGE_QUERY = """
+SELECT participant_key
+FROM holdings
+WHERE stock_code = :stock_code AND date_key IN (:first_date_key, :last_date_key)
+GROUP BY participant_key
+ORDER BY abs(SUM(CASE WHEN date_key = :last_date_key THEN shareholding ELSE -shareholding END)) DESC, participant_key
+LIMIT :top_n;
+"""
+
+# Holdings of the given participants on the given dates, looked up by primary key
+PULL_PARTICIPANTS_HISTORY_QUERY = """
+SELECT
+    date(h.date_key * 86400, 'unixepoch') AS date,
+    h.stock_code,
+    s.stock_name,
+    p.participant_id,
+    p.participant_name,
+    h.shareholding,
+    h.pct_total_issued
+FROM holdings h
+JOIN stocks s ON s.stock_code = h.stock_code
+JOIN participants p ON p.participant_key = h.participant_key
+WHERE h.stock_code = ? AND h.date_key IN ({date_keys}) AND h.participant_key IN ({participant_keys})
+ORDER BY h.date_key, p.participant_id;
+"""
 
 CHECK_DATE_STOCK_DATA_IN_DB_QUERY = """
-SELECT 1 FROM shareholding
-WHERE (date_requested = '{date_requested}') AND (stock_code={stock_code})
+SELECT 1 FROM scrape_dates
+WHERE (stock_code = :stock_code) AND (date_requested_key = :date_requested_key)
 LIMIT 1;
 """
 
+# Stored dates of a date range, a range of the primary key of scrape_dates
 CHECK_DATE_RANGE_STOCK_DATA_IN_DB_QUERY = """
-SELECT DISTINCT date_requested FROM shareholding
-WHERE stock_code={stock_code};
+SELECT date_requested_key FROM scrape_dates
+WHERE stock_code = :stock_code AND date_requested_key >= :start_date_key AND date_requested_key <= :end_date_key;
 """
 
 PULL_SHAREHOLDING_DATA_QUERY = """
+SELECT
+    date(sd.date_requested_key * 86400, 'unixepoch') AS date_requested,
+    date(sd.date_key * 86400, 'unixepoch') AS date,
+    sd.stock_code,
+    s.stock_name,
+    p.participant_id,
+    p.participant_name,
+    h.shareholding,
+    h.pct_total_issued
+FROM scrape_dates sd
+JOIN holdings h ON (h.stock_code = sd.stock_code) AND (h.date_key = sd.date_key)
+JOIN participants p ON p.participant_key = h.participant_key
+JOIN stocks s ON s.stock_code = sd.stock_code
+WHERE sd.stock_code = :stock_code
+AND sd.date_requested_key >= :start_date_key
+AND sd.date_requested_key <= :end_date_key
+ORDER BY sd.date_requested_key ASC, sd.date_key ASC;
+"""
+
+# Holdings of a stock on the stored dates of a date range, once per date displayed by the site (for export.py)
+PULL_EXPORT_SHAREHOLDING_DATA_QUERY = """
+SELECT
+    date(h.date_key * 86400, 'unixepoch') AS date,
+    h.stock_code,
+    s.stock_name,
+    p.participant_id,
+    p.participant_name,
+    h.shareholding,
+    h.pct_total_issued
+FROM holdings h
+JOIN participants p ON p.participant_key = h.participant_key
+JOIN stocks s ON s.stock_code = h.stock_code
+WHERE h.stock_code = :stock_code
+AND h.date_key >= :start_date_key
+AND h.date_key <= :end_date_key
+ORDER BY h.date_key ASC;
+"""
+
+# Dates displayed for the stored dates of a date range, without reading their holdings
+PULL_DATE_REQUESTED_MAP_QUERY = """
+SELECT
+    date(sd.date_requested_key * 86400, 'unixepoch') AS date_requested,
+    date(sd.date_key * 86400, 'unixepoch') AS date,
+    s.stock_name
+FROM scrape_dates sd
+JOIN stocks s ON s.stock_code = sd.stock_code
+WHERE sd.stock_code = :stock_code
+AND sd.date_requested_key >= :start_date_key
+AND sd.date_requested_key <= :end_date_key
+ORDER BY sd.date_requested_key ASC;
+"""
+
+# Write generation of a stock and month, used to detect stale columnar cache partitions
+PULL_STOCK_MONTH_GENERATION_QUERY = """
+SELECT generation FROM stock_month_generations WHERE stock_code = ? AND month_key = ?;
+"""
+
+# Changes in shareholding of at least a threshold proportion (and participants entering or leaving) on the
+# dates displayed for a date range, against the previous date within the range starting on range_start_date_key
+# (before start_date_key for the chunks of a longer range). Shaped like the finder data
+PULL_TRANSACTION_FINDER_DATA_QUERY = """
+WITH window_dates AS (
+    SELECT date_key FROM scrape_dates
+    WHERE stock_code = :stock_code
+    AND date_requested_key >= :range_start_date_key
+    AND date_requested_key <= :end_date_key
+    GROUP BY date_key
+    HAVING MIN(date_requested_key) >= :start_date_key
+)
+SELECT
+    date(d.date_key * 86400, 'unixepoch') AS date,
+    d.stock_code,
+    s.stock_name,
+    p.participant_id,
+    p.participant_name,
+    d.shareholding,
+    d.shareholding_diff,
+    d.pct_change AS shareholding_pct_change
+FROM holding_deltas d
+JOIN participants p ON p.participant_key = d.participant_key
+JOIN stocks s ON s.stock_code = d.stock_code
+WHERE d.stock_code = :stock_code
+AND d.date_key IN (SELECT date_key FROM window_dates)
+AND d.prev_date_key >= (
+    SELECT MIN(date_key) FROM scrape_dates
+    WHERE stock_code = :stock_code
+    AND date_requested_key >= :range_start_date_key
+    AND date_requested_key <= :end_date_key
+)
+AND abs(ifnull(d.pct_change, 9e999)) >= :threshold_proportion
+ORDER BY d.date_key ASC, p.participant_id ASC;
+"""
+
+# Participant queries, see participant_holdings.py
+# Driven stock by stock through the primary keys of scrape_dates and holdings, so that they cost a few lookups per
+# stock whatever the length of the date range. CROSS JOIN keeps that join order rather than a scan of holdings
+
+# Last stored date of each stock within a date range, and the first one for holding changes
+PARTICIPANT_STOCK_DATES_CTE = """
+WITH stock_dates AS (
+    SELECT
+        s.stock_code,
+        s.stock_name,
+        (
+            SELECT sd.date_key FROM scrape_dates sd
+            WHERE sd.stock_code = s.stock_code
+            AND sd.date_requested_key >= :start_date_key
+            AND sd.date_requested_key <= :end_date_key
+            ORDER BY sd.date_requested_key ASC LIMIT 1
+        ) AS start_date_key,
+        (
+            SELECT sd.date_key FROM scrape_dates sd
+            WHERE sd.stock_code = s.stock_code
+            AND sd.date_requested_key >= :start_date_key
+            AND sd.date_requested_key <= :end_date_key
+            ORDER BY sd.date_requested_key DESC LIMIT 1
+        ) AS end_date_key
+    FROM stocks s
+)
+"""
+
+# Holdings of a participant across stocks, on the last stored date of each stock within the date range
+PULL_PARTICIPANT_HOLDINGS_QUERY = PARTICIPANT_STOCK_DATES_CTE + """
+SELECT
+    date(h.date_key * 86400, 'unixepoch') AS date,
+    t.stock_code,
+    t.stock_name,
+    p.participant_id,
+    p.participant_name,
+    h.shareholding,
+    h.pct_total_issued
+FROM stock_dates t
+CROSS JOIN participants p
+CROSS JOIN holdings h
+WHERE p.participant_id = :participant_id
+AND h.stock_code = t.stock_code
+AND h.date_key = t.end_date_key
+AND h.participant_key = p.participant_key
+ORDER BY h.pct_total_issued DESC, t.stock_code ASC;
+"""
+
+# Net change of a participant's holding of each stock between its first and last stored dates within a date range
+# Issued shares are derived from the largest holder on the last stored date, so that changes compare across stocks
+PULL_PARTICIPANT_HOLDING_CHANGES_QUERY = PARTICIPANT_STOCK_DATES_CTE + """,
+stock_changes AS (
+    SELECT
+        t.stock_code,
+        t.stock_name,
+        t.end_date_key,
+        SUM(CASE WHEN h.date_key = t.end_date_key THEN h.shareholding ELSE 0 END) AS shareholding,
+        SUM(CASE WHEN h.date_key = t.end_date_key THEN h.shareholding ELSE -h.shareholding END) AS shareholding_change
+    FROM stock_dates t
+    CROSS JOIN participants p
+    CROSS JOIN holdings h
+    WHERE p.participant_id = :participant_id
+    AND t.start_date_key < t.end_date_key
+    AND h.stock_code = t.stock_code
+    AND h.date_key IN (t.start_date_key, t.end_date_key)
+    AND h.participant_key = p.participant_key
+    GROUP BY t.stock_code
+    HAVING shareholding_change <> 0
+)
+SELECT
+    date(c.end_date_key * 86400, 'unixepoch') AS date,
+    c.stock_code,
+    c.stock_name,
+    c.shareholding,
+    c.shareholding_change,
+    round(100 * c.shareholding_change / (
+        SELECT h.shareholding * 100.0 / h.pct_total_issued
+        FROM holding_rankings k
+        JOIN holdings h
+        ON (h.stock_code = k.stock_code) AND (h.date_key = k.date_key) AND (h.participant_key = k.participant_key)
+        WHERE k.stock_code = c.stock_code AND k.date_key = c.end_date_key AND k.rank = 1 AND h.pct_total_issued > 0
+    ), 4) AS pct_total_issued_change
+FROM stock_changes c
+ORDER BY abs(pct_total_issued_change) DESC NULLS LAST, abs(c.shareholding_change) DESC
+LIMIT :top_n;
+"""
+
+CREATE_SCRAPE_CHECKPOINT_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS scrape_checkpoint (
+    stock_code INTEGER,
+    date_requested TEXT,
+    status TEXT,
+    attempts INTEGER,
+    updated_at TEXT,
+    PRIMARY KEY (stock_code, date_requested)
+);
+"""
+
+UPSERT_SCRAPE_CHECKPOINT_QUERY = """
+INSERT OR REPLACE INTO scrape_checkpoint (stock_code, date_requested, status, attempts, updated_at)
+VALUES (?, ?, ?, ?, ?);
+"""
+
+PULL_SCRAPE_CHECKPOINT_QUERY = """
+SELECT stock_code, date_requested, status FROM scrape_checkpoint
+WHERE date_requested >= :start_date
+AND date_requested <= :end_date
+AND status IN ('done', 'unavailable');
+"""
+
+DELETE_SCRAPE_CHECKPOINT_QUERY = """
+DELETE FROM scrape_checkpoint
+WHERE date_requested >= :start_date
+AND date_requested <= :end_date;
+"""
+
+PULL_SCRAPED_DATE_STOCK_PAIRS_QUERY = """
+SELECT stock_code, date(date_requested_key * 86400, 'unixepoch') AS date_requested FROM scrape_dates
+WHERE date_requested_key >= :start_date_key
+AND date_requested_key <= :end_date_key;
+"""
+
+# Stock codes found unavailable for enquiry, re-checked once last_checked (unix epoch seconds) is older than a TTL
+CREATE_UNAVAILABLE_STOCK_CODES_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS unavailable_stock_codes (
+    stock_code INTEGER PRIMARY KEY,
+    first_seen REAL,
+    last_checked REAL,
+    source TEXT
+);
+"""
+
+UPSERT_UNAVAILABLE_STOCK_CODE_QUERY = """
+INSERT INTO unavailable_stock_codes (stock_code, first_seen, last_checked, source) VALUES (?, ?, ?, ?)
+ON CONFLICT (stock_code) DO UPDATE SET last_checked = excluded.last_checked, source = excluded.source;
+"""
+
+DELETE_UNAVAILABLE_STOCK_CODE_QUERY = """
+DELETE FROM unavailable_stock_codes WHERE stock_code = ?;
+"""
+
+PULL_UNAVAILABLE_STOCK_CODES_QUERY = """
+SELECT stock_code FROM unavailable_stock_codes WHERE last_checked >= ?;
+"""
+
+PULL_UNAVAILABLE_STOCK_CODES_SUMMARY_QUERY = """
+SELECT source, COUNT(*), SUM(last_checked >= ?) FROM unavailable_stock_codes GROUP BY source;
+"""
+
+# Background scrape jobs of the Dash app, one per (stock_code, date_requested_key), see scrape_jobs.py
+# Times are unix epoch seconds
+CREATE_SCRAPE_JOBS_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS scrape_jobs (
+    stock_code INTEGER,
+    date_requested_key INTEGER,
+    status TEXT,
+    attempts INTEGER DEFAULT 0,
+    requested_at REAL,
+    available_at REAL,
+    claimed_by TEXT,
+    claimed_at REAL,
+    updated_at REAL,
+    PRIMARY KEY (stock_code, date_requested_key)
+) WITHOUT ROWID;
+"""
+
+CREATE_SCRAPE_JOBS_STATUS_INDEX_QUERY = """
+CREATE INDEX IF NOT EXISTS scrape_jobs_status_index ON scrape_jobs (status, available_at);
+"""
+
+# Requests for a job that is already queued or running coalesce into it, failed jobs are queued again
+SUBMIT_SCRAPE_JOB_QUERY = """
+INSERT INTO scrape_jobs (stock_code, date_requested_key, status, attempts, requested_at, available_at, updated_at)
+VALUES (:stock_code, :date_requested_key, 'pending', 0, :now, :now, :now)
+ON CONFLICT (stock_code, date_requested_key) DO UPDATE
+SET status = 'pending', attempts = 0, requested_at = :now, available_at = :now, updated_at = :now
+WHERE scrape_jobs.status IN ('failed', 'done');
+"""
+
+# Oldest pending job, or a running job whose worker stopped responding
+PULL_NEXT_SCRAPE_JOB_QUERY = """
+SELECT stock_code, date_requested_key, attempts FROM scrape_jobs
+WHERE (status = 'pending' AND available_at <= :now)
+OR (status = 'running' AND claimed_at <= :now - :stale_seconds)
+ORDER BY requested_at ASC
+LIMIT 1;
+"""
+
+CLAIM_SCRAPE_JOB_QUERY = """
+UPDATE scrape_jobs
+SET status = 'running', attempts = attempts + 1, claimed_by = :claimed_by, claimed_at = :now, updated_at = :now
+WHERE stock_code = :stock_code AND date_requested_key = :date_requested_key;
+"""
+
+UPDATE_SCRAPE_JOB_QUERY = """
+UPDATE scrape_jobs SET status = ?, available_at = ?, updated_at = ?
+WHERE stock_code = ? AND date_requested_key = ?;
+"""
+
+# Pending jobs of a stock code found to be unavailable
+SKIP_UNAVAILABLE_SCRAPE_JOBS_QUERY = """
+UPDATE scrape_jobs SET status = 'unavailable', updated_at = ?
+WHERE stock_code = ? AND status = 'pending';
+"""
+
+PULL_SCRAPE_JOBS_PROGRESS_QUERY = """
+SELECT status, COUNT(*) FROM scrape_jobs
+WHERE stock_code = ? AND date_requested_key >= ? AND date_requested_key <= ?
+GROUP BY status;
+"""
+
+# Market-wide transaction scans, see market_scan.py
+CREATE_MARKET_SCANS_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS market_scans (
+    scan_id INTEGER PRIMARY KEY,
+    start_date TEXT,
+    end_date TEXT,
+    threshold_percentage REAL,
+    match_mode TEXT,
+    status TEXT,
+    stock_codes_scanned INTEGER,
+    started_at TEXT,
+    finished_at TEXT
+);
+"""
+
+CREATE_MARKET_SCAN_RESULTS_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS market_scan_results (
+    scan_id INTEGER,
+    date TEXT,
+    stock_code INTEGER,
+    buyer_id TEXT,
+    buyer_name TEXT,
+    seller_id TEXT,
+    seller_name TEXT,
+    quantity INTEGER,
+    buyer_pct_change REAL,
+    seller_pct_change REAL,
+    buyer_shareholding INTEGER,
+    seller_shareholding INTEGER,
+    match_type TEXT,
+    match_group INTEGER
+);
+"""
+
+CREATE_MARKET_SCAN_RESULTS_INDEX_QUERY = """
+CREATE INDEX IF NOT EXISTS market_scan_results_quantity_index
+ON market_scan_results (scan_id, quantity DESC);
+"""
+
+INSERT_MARKET_SCAN_QUERY = """
+INSERT INTO market_scans (start_date, end_date, threshold_percentage, match_mode, status, stock_codes_scanned, started_at)
+VALUES (?, ?, ?, ?, 'running', 0, datetime('now'));
+"""
+
+UPDATE_MARKET_SCAN_QUERY = """
+UPDATE market_scans SET status = ?, stock_codes_scanned = ?, finished_at = datetime('now')
+WHERE scan_id = ?;
+"""
+
+INSERT_MARKET_SCAN_RESULT_QUERY = """
+INSERT INTO market_scan_results (
+    scan_id, date, stock_code, buyer_id, buyer_name, seller_id, seller_name, quantity,
+    buyer_pct_change, seller_pct_change, buyer_shareholding, seller_shareholding, match_type, match_group
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+"""
+
+# Latest completed scan with the same parameters finished within max_age_seconds
+PULL_RECENT_MARKET_SCAN_QUERY = """
+SELECT scan_id FROM market_scans
+WHERE start_date = ? AND end_date = ? AND threshold_percentage = ? AND match_mode = ? AND status = 'completed'
+AND finished_at >= datetime('now', '-' || ? || ' seconds')
+ORDER BY scan_id DESC
+LIMIT 1;
+"""
+
+PULL_TOP_MARKET_SCAN_RESULTS_QUERY = """
+SELECT r.date, r.stock_code, s.stock_name, r.buyer_id, r.buyer_name, r.seller_id, r.seller_name, r.quantity,
+    r.buyer_pct_change, r.seller_pct_change, r.buyer_shareholding, r.seller_shareholding, r.match_type, r.match_group
+FROM market_scan_results r
+LEFT JOIN stocks s ON s.stock_code = r.stock_code
+WHERE r.scan_id = :scan_id
+ORDER BY r.quantity DESC
+LIMIT :top_n;
+"""
+
+PULL_STORED_STOCK_CODES_QUERY = """
+SELECT DISTINCT stock_code FROM scrape_dates
+WHERE date_requested_key >= :start_date_key AND date_requested_key <= :end_date_key
+ORDER BY stock_code ASC;
+"""
+
+# Shared tier of the result cache, in its own database file (SHARED_RESULT_CACHE_DB_PATH), see result_cache.py
+# Entries are pickled, keyed by the repr() of their key, and only served while their stock's generation is current
+CREATE_RESULT_CACHE_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS result_cache (
+    cache_key TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    stock_code INTEGER NOT NULL,
+    key BLOB NOT NULL,
+    value BLOB NOT NULL,
+    size_bytes INTEGER NOT NULL,
+    generation INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    last_used_at REAL NOT NULL
+);
+"""
+
+CREATE_RESULT_CACHE_INDEX_QUERY = """
+CREATE INDEX IF NOT EXISTS result_cache_stock_code_kind_index ON result_cache (stock_code, kind);
+"""
+
+CREATE_RESULT_CACHE_GENERATIONS_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS result_cache_generations (
+    stock_code INTEGER PRIMARY KEY,
+    generation INTEGER NOT NULL
+);
+"""
+
+PULL_RESULT_CACHE_GENERATION_QUERY = """
+SELECT generation FROM result_cache_generations WHERE stock_code = ?;
+"""
+
+BUMP_RESULT_CACHE_GENERATION_QUERY = """
+INSERT INTO result_cache_generations (stock_code, generation) VALUES (?, 1)
+ON CONFLICT (stock_code) DO UPDATE SET generation = generation + 1;
+"""
+
+UPSERT_RESULT_CACHE_ENTRY_QUERY = """
+INSERT OR REPLACE INTO result_cache (cache_key, kind, stock_code, key, value, size_bytes, generation, expires_at, last_used_at)
+VALUES (:cache_key, :kind, :stock_code, :key, :value, :size_bytes, :generation, :expires_at, :now);
+"""
+
+PULL_RESULT_CACHE_ENTRY_QUERY = """
+SELECT value FROM result_cache
+WHERE cache_key = :cache_key AND generation = :generation AND expires_at >= :now;
+"""
+
+# Keys of a kind and stock, most recently used first, to find an entry covering a request
+PULL_RESULT_CACHE_KEYS_QUERY = """
+SELECT cache_key, key FROM result_cache
+WHERE stock_code = :stock_code AND kind = :kind AND generation = :generation AND expires_at >= :now
+ORDER BY last_used_at DESC;
+"""
+
+TOUCH_RESULT_CACHE_ENTRY_QUERY = """
+UPDATE result_cache SET last_used_at = :now WHERE cache_key = :cache_key;
+"""
+
+DELETE_RESULT_CACHE_STOCK_ENTRIES_QUERY = """
+DELETE FROM result_cache WHERE stock_code = ?;
+"""
+
+DELETE_RESULT_CACHE_ENTRIES_QUERY = """
+DELETE FROM result_cache;
+"""
+
+# Expired entries, then least recently used ones beyond max_size_bytes
+EVICT_RESULT_CACHE_ENTRIES_QUERY = """
+DELETE FROM result_cache WHERE expires_at < :now OR cache_key IN (
+    SELECT cache_key FROM (
+        SELECT cache_key, SUM(size_bytes) OVER (ORDER BY last_used_at DESC, cache_key) AS cumulative_size_bytes
+        FROM result_cache
+    )
+    WHERE cumulative_size_bytes > :max_size_bytes
+);
+"""
+
+PULL_RESULT_CACHE_SUMMARY_QUERY = """
+SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM result_cache;
+"""
+
+# Denormalised table of earlier versions, only read by migrate_db.py
+LEGACY_SHAREHOLDING_TABLE_EXISTS_QUERY = """
+SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'shareholding';
+"""
+
+PULL_LEGACY_SHAREHOLDING_DATA_QUERY = """
 SELECT * FROM shareholding
-WHERE date_requested >= '{start_date}'
-AND date_requested <= '{end_date}'
-AND stock_code = {stock_code}
+WHERE date_requested >= :start_date
+AND date_requested <= :end_date
+AND stock_code = :stock_code
 ORDER BY date_requested ASC, date ASC;
 """
+
+PULL_ALL_LEGACY_SHAREHOLDING_DATA_QUERY = """
+SELECT date_requested, date, stock_code, stock_name, participant_id, participant_name, shareholding, pct_total_issued
+FROM shareholding
+ORDER BY rowid ASC;
+"""
+
+# Participants without an ID are stored with an empty participant_id in the participants table
+COUNT_LEGACY_ROWS_WITHOUT_PARTICIPANT_ID_QUERY = """
+SELECT COUNT(*) FROM shareholding WHERE participant_id IS NULL OR participant_id = '';
+"""
+
+PULL_LEGACY_LARGEST_STOCK_QUERY = """
+SELECT stock_code, MAX(date_requested) AS end_date FROM shareholding
+GROUP BY stock_code
+ORDER BY COUNT(*) DESC
+LIMIT 1;
+"""
+
+DROP_LEGACY_SHAREHOLDING_TABLE_QUERY = """
+DROP TABLE IF EXISTS shareholding;
+"""
+
+PULL_LARGEST_STOCK_QUERY = """
+SELECT stock_code, date(MAX(date_key) * 86400, 'unixepoch') AS end_date FROM holdings
+GROUP BY stock_code
+ORDER BY COUNT(*) DESC
+LIMIT 1;
+"""
@@ -0,0 +1,307 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from utils import connect_db
+from queries import *
+from config import *
+
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_size_bytes(value) -> int:
+    # DataFrames are measured directly, other values (figure and table payloads) by their pickled size
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+class ResultCache:
+    """ Memory-bounded LRU cache of ShareholdingDisplay frames and tab payloads.
+
+    Keys are tuples whose second item is the stock_code, so that entries can be invalidated when the
+    ShareholdingWriter commits new data for a stock. Entries expire after ttl_seconds.
+
+    """
+
+    def __init__(self, max_size_mb: float = RESULT_CACHE_MAX_SIZE_MB, ttl_seconds: float = RESULT_CACHE_TTL_SECONDS) -> None:
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024)
+        self.ttl_seconds = ttl_seconds
+        # key -> (value, size_bytes, expires_at), least recently used first
+        self.entries = OrderedDict()
+        self.size_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _remove(self, key: tuple) -> None:
+        _, size_bytes, _ = self.entries.pop(key)
+        self.size_bytes -= size_bytes
+
+    def get(self, key: tuple):
+        """ Returns the cached value of key, or None on a miss.
+
+        Args:
+            key (tuple): Cache key, (kind, stock_code, ...).
+
+        Returns:
+            Cached value or None.
+
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[2] < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def find(self, kind: str, stock_code: int, predicate):
+        """ Returns the most recently used value of a (kind, stock_code, ...) key satisfying predicate, or None.
+
+        Used to serve a request from an entry computed for a wider one.
+
+        Args:
+            kind (str): First item of the key.
+            stock_code (int): Second item of the key.
+            predicate (callable): Called with the remaining items of the key.
+
+        Returns:
+            tuple: (key, value), or None on a miss.
+
+        """
+        with self.lock:
+            now = time.monotonic()
+            for key in reversed(self.entries):
+                if key[:2] == (kind, stock_code) and self.entries[key][2] >= now and predicate(*key[2:]):
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return key, self.entries[key][0]
+            self.misses += 1
+            return None
+
+    def put(self, key: tuple, value) -> None:
+        """ Caches value under key, evicting least recently used entries to stay within the size limit.
+
+        Cached values are shared between callers and must not be modified.
+
+        Args:
+            key (tuple): Cache key, (kind, stock_code, ...).
+            value: Value to be cached.
+
+        """
+        size_bytes = estimate_size_bytes(value)
+        if size_bytes > self.max_size_bytes:
+            logger.debug(f'{key} not cached: {size_bytes} bytes exceeds the cache size.')
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, size_bytes, time.monotonic() + self.ttl_seconds)
+            self.size_bytes += size_bytes
+            while self.size_bytes > self.max_size_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate_stock_codes(self, stock_codes: set) -> None:
+        """ Removes every entry of the given stock codes.
+
+        Args:
+            stock_codes (set): HKEX stock codes.
+
+        """
+        with self.lock:
+            for key in [key for key in self.entries if key[1] in stock_codes]:
+                self._remove(key)
+                self.invalidations += 1
+
+    def invalidate_committed(self, committed_stock_dates: set) -> None:
+        # ShareholdingWriter commit listener
+        self.invalidate_stock_codes({stock_code for stock_code, _ in committed_stock_dates})
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.size_bytes = 0
+
+    def get_metrics(self) -> dict:
+        """ Returns cache counters.
+
+        Returns:
+            dict: Entries, size, hits, misses, hit ratio, evictions and invalidations.
+
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'size_bytes': self.size_bytes,
+                'max_size_bytes': self.max_size_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else None,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
+class SharedResultCache(ResultCache):
+    """ ResultCache with a second tier in a SQLite file, shared by the worker processes of the WSGI server (wsgi.py).
+
+    Lookups missing the in-memory tier are served from the shared tier, and values put are written to both.
+    Invalidating a stock bumps its generation in the shared tier, so that every process drops its in-memory entries
+    of the stock on its next lookup, and the shared entries of older generations are no longer served.
+
+    """
+
+    def __init__(self, db_path: str = SHARED_RESULT_CACHE_DB_PATH, shared_max_size_mb: float = SHARED_RESULT_CACHE_MAX_SIZE_MB, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.db_path = db_path
+        self.shared_max_size_bytes = int(shared_max_size_mb * 1024 * 1024)
+        # stock_code -> generation of the stock's in-memory entries
+        self.generations = {}
+        self.shared_hits = 0
+        self.shared_misses = 0
+        with connect_db(db_path) as con:
+            con.execute('PRAGMA journal_mode=WAL;')
+            con.execute(CREATE_RESULT_CACHE_TABLE_QUERY)
+            con.execute(CREATE_RESULT_CACHE_INDEX_QUERY)
+            con.execute(CREATE_RESULT_CACHE_GENERATIONS_TABLE_QUERY)
+
+    @staticmethod
+    def _get_generation(con, stock_code: int) -> int:
+        row = con.execute(PULL_RESULT_CACHE_GENERATION_QUERY, (int(stock_code),)).fetchone()
+        return row[0] if row else 0
+
+    def _sync_generation(self, con, stock_code: int) -> int:
+        # Drops the in-memory entries of a stock invalidated by another process
+        generation = self._get_generation(con, stock_code)
+        if self.generations.get(stock_code, generation) != generation:
+            super().invalidate_stock_codes({stock_code})
+        self.generations[stock_code] = generation
+        return generation
+
+    def _load_shared(self, con, cache_key: str, generation: int):
+        row = con.execute(PULL_RESULT_CACHE_ENTRY_QUERY, {
+            'cache_key': cache_key, 'generation': generation, 'now': time.time()}).fetchone()
+        if row is None:
+            return None
+        con.execute(TOUCH_RESULT_CACHE_ENTRY_QUERY, {'cache_key': cache_key, 'now': time.time()})
+        return row[0]
+
+    def get(self, key: tuple):
+        with connect_db(self.db_path) as con:
+            generation = self._sync_generation(con, key[1])
+            value = super().get(key)
+            if value is not None:
+                return value
+            blob = self._load_shared(con, repr(key), generation)
+        if blob is None:
+            self.shared_misses += 1
+            return None
+        self.shared_hits += 1
+        value = pickle.loads(blob)
+        super().put(key, value)
+        return value
+
+    def find(self, kind: str, stock_code: int, predicate):
+        with connect_db(self.db_path) as con:
+            generation = self._sync_generation(con, stock_code)
+            found = super().find(kind, stock_code, predicate)
+            if found is not None:
+                return found
+            blob = None
+            for cache_key, key_blob in con.execute(PULL_RESULT_CACHE_KEYS_QUERY, {
+                    'kind': kind, 'stock_code': int(stock_code), 'generation': generation, 'now': time.time()}).fetchall():
+                key = pickle.loads(key_blob)
+                if predicate(*key[2:]):
+                    blob = self._load_shared(con, cache_key, generation)
+                    break
+        if blob is None:
+            self.shared_misses += 1
+            return None
+        self.shared_hits += 1
+        value = pickle.loads(blob)
+        super().put(key, value)
+        return key, value
+
+    def put(self, key: tuple, value) -> None:
+        super().put(key, value)
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(blob) > self.shared_max_size_bytes:
+            return
+        now = time.time()
+        with connect_db(self.db_path) as con:
+            # Values computed before an invalidation keep the generation they were computed from, and are not served
+            generation = self.generations.get(key[1])
+            if generation is None:
+                generation = self._get_generation(con, key[1])
+            con.execute(UPSERT_RESULT_CACHE_ENTRY_QUERY, {
+                'cache_key': repr(key),
+                'kind': key[0],
+                'stock_code': int(key[1]),
+                'key': pickle.dumps(key, protocol=pickle.HIGHEST_PROTOCOL),
+                'value': blob,
+                'size_bytes': len(blob),
+                'generation': generation,
+                'expires_at': now + self.ttl_seconds,
+                'now': now
+            })
+            con.execute(EVICT_RESULT_CACHE_ENTRIES_QUERY, {'now': now, 'max_size_bytes': self.shared_max_size_bytes})
+
+    def invalidate_stock_codes(self, stock_codes: set) -> None:
+        super().invalidate_stock_codes(stock_codes)
+        if not stock_codes:
+            return
+        with connect_db(self.db_path) as con:
+            stock_code_params = [(int(stock_code),) for stock_code in stock_codes]
+            con.executemany(BUMP_RESULT_CACHE_GENERATION_QUERY, stock_code_params)
+            con.executemany(DELETE_RESULT_CACHE_STOCK_ENTRIES_QUERY, stock_code_params)
+
+    def clear(self) -> None:
+        super().clear()
+        with connect_db(self.db_path) as con:
+            con.execute(DELETE_RESULT_CACHE_ENTRIES_QUERY)
+
+    def get_metrics(self) -> dict:
+        metrics = super().get_metrics()
+        with connect_db(self.db_path) as con:
+            shared_entries, shared_size_bytes = con.execute(PULL_RESULT_CACHE_SUMMARY_QUERY).fetchone()
+        shared_lookups = self.shared_hits + self.shared_misses
+        metrics.update({
+            'shared_entries': shared_entries,
+            'shared_size_bytes': shared_size_bytes,
+            'shared_max_size_bytes': self.shared_max_size_bytes,
+            'shared_hits': self.shared_hits,
+            'shared_misses': self.shared_misses,
+            'shared_hit_ratio': self.shared_hits / shared_lookups if shared_lookups else None,
+        })
+        return metrics
+
+
+# Process-wide cache, registered with the process-wide writer when first used
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> ResultCache:
+    """ Returns the process-wide ResultCache, creating it on first use.
+
+    Returns:
+        ResultCache: Shared result cache.
+
+    """
+    global _result_cache
+    from shareholding_writer import get_shareholding_writer
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = SharedResultCache() if USE_SHARED_RESULT_CACHE else ResultCache()
+            get_shareholding_writer().add_commit_listener(_result_cache.invalidate_committed)
+        return _result_cache
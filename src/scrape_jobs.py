@@ -0,0 +1,181 @@
+import argparse
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+from shareholding_data import ShareholdingData
+from scrape_scheduler import TokenBucket
+from scrapers import *
+from utils import *
+from shareholding_writer import get_shareholding_writer
+from stock_code_registry import get_unavailable_stock_codes
+from result_cache import get_result_cache
+from scrape_locks import scrape_locks
+from queries import *
+from config import *
+
+
+logger = logging.getLogger(__name__)
+
+
+class ScrapeJobQueue:
+    """ SQLite-backed queue of the (stock_code, date) scrapes requested by the Dash app.
+
+    Jobs are submitted with ShareholdingData.submit_scrape_jobs(), which coalesces requests for the same
+    (stock_code, date). Worker processes claim them one at a time in a BEGIN IMMEDIATE transaction, so that
+    a job is never claimed twice.
+
+    """
+
+    @staticmethod
+    def claim(worker_id: str) -> tuple:
+        """ Claims the oldest available job.
+
+        Args:
+            worker_id (str): Identifies the claiming worker in the scrape_jobs table.
+
+        Returns:
+            tuple: (stock_code, date, attempts) of the claimed job, or None when there is none.
+
+        """
+        now = time.time()
+        with connect_db() as con:
+            # Take the write lock before reading, so that concurrent workers can't claim the same job
+            con.execute('BEGIN IMMEDIATE;')
+            job = con.execute(PULL_NEXT_SCRAPE_JOB_QUERY, {
+                'now': now, 'stale_seconds': SCRAPE_JOB_STALE_SECONDS}).fetchone()
+            if job is None:
+                return None
+            stock_code, date_requested_key, attempts = job
+            con.execute(CLAIM_SCRAPE_JOB_QUERY, {
+                'stock_code': stock_code,
+                'date_requested_key': date_requested_key,
+                'claimed_by': worker_id,
+                'now': now
+            })
+        return stock_code, key_to_date(date_requested_key), attempts + 1
+
+    @staticmethod
+    def record(stock_code: int, date: pd.Timestamp, status: str, available_at: float = None) -> None:
+        # Goes through the ShareholdingWriter after the job's rows, so a job is only 'done' once they are committed
+        now = time.time()
+        get_shareholding_writer().submit(UPDATE_SCRAPE_JOB_QUERY, [(
+            status, available_at if available_at is not None else now, now, int(stock_code), date_to_key(date)
+        )])
+        if status == 'unavailable':
+            get_shareholding_writer().submit(
+                SKIP_UNAVAILABLE_SCRAPE_JOBS_QUERY, [(now, int(stock_code))])
+
+    @staticmethod
+    def get_progress(start_date: pd.Timestamp, end_date: pd.Timestamp, stock_code: int) -> dict:
+        """ Counts the jobs of a stock and date range by status.
+
+        Args:
+            start_date (pd.Timestamp): Start of the date range.
+            end_date (pd.Timestamp): End of the date range.
+            stock_code (int): HKEX stock code.
+
+        Returns:
+            dict: Number of jobs per status, and 'remaining' (pending or running) and 'total'.
+
+        """
+        with connect_db() as con:
+            progress = dict(con.execute(PULL_SCRAPE_JOBS_PROGRESS_QUERY, (
+                int(stock_code), date_to_key(start_date), date_to_key(end_date))).fetchall())
+        progress['total'] = sum(progress.values())
+        progress['remaining'] = progress.get('pending', 0) + progress.get('running', 0)
+        return progress
+
+
+def run_scrape_job_worker(
+    rate_limit_per_second: float = SCRAPE_JOB_RATE_LIMIT_PER_SECOND,
+    max_retries: int = SCRAPE_JOB_MAX_RETRIES,
+    retry_backoff_seconds: float = SCRAPE_JOB_RETRY_BACKOFF_SECONDS,
+    poll_interval_seconds: float = SCRAPE_JOB_POLL_INTERVAL_SECONDS
+) -> None:
+    """ Claims and runs scrape jobs until the process is stopped.
+
+    Args:
+        rate_limit_per_second (float, optional): Maximum searches per second. Defaults to SCRAPE_JOB_RATE_LIMIT_PER_SECOND.
+        max_retries (int, optional): Retries of a failed job. Defaults to SCRAPE_JOB_MAX_RETRIES.
+        retry_backoff_seconds (float, optional): Delay before the first retry, doubled on each retry.
+            Defaults to SCRAPE_JOB_RETRY_BACKOFF_SECONDS.
+        poll_interval_seconds (float, optional): Delay between polls of an empty queue. Defaults to SCRAPE_JOB_POLL_INTERVAL_SECONDS.
+
+    """
+    worker_id = f'{socket.gethostname()}:{os.getpid()}'
+    rate_limiter = TokenBucket(rate_limit_per_second)
+    logger.info(f'Scrape job worker {worker_id} started.')
+    if USE_RESULT_CACHE:
+        # Invalidates the cached results of the stocks it commits, for the app processes sharing the cache
+        get_result_cache()
+    with initialise_scraper() as scraper:
+        while True:
+            job = ScrapeJobQueue.claim(worker_id)
+            if job is None:
+                # Commit the outcomes of finished jobs while idle
+                get_shareholding_writer().flush()
+                time.sleep(poll_interval_seconds)
+                continue
+
+            stock_code, date, attempts = job
+            rate_limiter.acquire()
+            try:
+                # A request of the app may be scraping the same date, skip it if stored meanwhile
+                with scrape_locks(stock_code, [date]):
+                    if not ShareholdingData._check_date_stock_data_exists_in_db(date, stock_code):
+                        written = ShareholdingData._scrape_and_store_date_stock_data(date, stock_code, scraper)
+                        get_shareholding_writer().flush()
+                        # The rows may have been lost in an earlier batch than the flushed one, retry the job then
+                        written.result()
+                ScrapeJobQueue.record(stock_code, date, 'done')
+
+            except StockCodeUnavailableError as e:
+                logger.info(f'stock_code={stock_code} is unavailable ({e}). Skipping its queued dates.')
+                get_unavailable_stock_codes().add(stock_code)
+                ScrapeJobQueue.record(stock_code, date, 'unavailable')
+
+            except Exception as e:
+                if attempts > max_retries:
+                    logger.error(
+                        f'date={date.strftime(DATE_BASE_FORMAT)}, stock_code={stock_code}, failed after {attempts} attempts: {e}')
+                    ScrapeJobQueue.record(stock_code, date, 'failed')
+                else:
+                    backoff_seconds = retry_backoff_seconds * 2 ** (attempts - 1)
+                    logger.warning(
+                        f'date={date.strftime(DATE_BASE_FORMAT)}, stock_code={stock_code}, attempt {attempts} failed: {e}. '
+                        f'Retrying in {backoff_seconds}s.')
+                    ScrapeJobQueue.record(stock_code, date, 'pending', time.time() + backoff_seconds)
+
+
+def start_scrape_job_workers(n_processes: int = SCRAPE_JOB_WORKER_PROCESSES) -> list:
+    """ Starts scrape job workers in daemon processes, which stop with the calling process.
+
+    Args:
+        n_processes (int, optional): Number of worker processes. Defaults to SCRAPE_JOB_WORKER_PROCESSES.
+
+    Returns:
+        list: Started multiprocessing.Process objects.
+
+    """
+    processes = [
+        multiprocessing.Process(target=run_scrape_job_worker, name=f'ScrapeJobWorker-{i}', daemon=True)
+        for i in range(n_processes)
+    ]
+    for process in processes:
+        process.start()
+    return processes
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Run background scrape job workers for the Dash app, e.g. on another host or with SCRAPE_JOB_WORKER_PROCESSES = 0.')
+    parser.add_argument('--processes', type=int, default=SCRAPE_JOB_WORKER_PROCESSES)
+    args = parser.parse_args()
+
+    # Exit normally on SIGTERM (e.g. from the gunicorn master), which stops the daemon worker processes
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    for process in start_scrape_job_workers(args.processes):
+        process.join()
@@ -0,0 +1,43 @@
+import fcntl
+import os
+import zlib
+from contextlib import contextmanager
+from utils import *
+from config import *
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_scrape_lock_stripe(stock_code: int, date: pd.Timestamp, n_stripes: int = SCRAPE_LOCK_STRIPES) -> int:
+    # Stable across processes, unlike hash() of strings
+    return zlib.crc32(f'{int(stock_code)}:{date_to_key(date)}'.encode()) % n_stripes
+
+
+@contextmanager
+def scrape_locks(stock_code: int, dates, lock_dir: str = SCRAPE_LOCK_DIR, n_stripes: int = SCRAPE_LOCK_STRIPES):
+    """ Holds exclusive locks on the (stock_code, date) scrapes of dates, across the processes of the host.
+
+    Locks are flock()s of lock files, released by the OS if the holder dies. They are taken in a fixed order, so
+    that processes locking overlapping dates don't deadlock. Scrapes of other (stock_code, date) pairs sharing a
+    lock file wait as well.
+
+    Args:
+        stock_code (int): HKEX stock code.
+        dates (iterable): Shareholding dates.
+        lock_dir (str, optional): Directory of the lock files. Defaults to SCRAPE_LOCK_DIR.
+        n_stripes (int, optional): Number of lock files. Defaults to SCRAPE_LOCK_STRIPES.
+
+    """
+    os.makedirs(lock_dir, exist_ok=True)
+    lock_files = []
+    try:
+        for stripe in sorted({get_scrape_lock_stripe(stock_code, date, n_stripes) for date in dates}):
+            lock_file = open(os.path.join(lock_dir, f'scrape-{stripe:04d}.lock'), 'a')
+            lock_files.append(lock_file)
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+    finally:
+        for lock_file in reversed(lock_files):
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
@@ -0,0 +1,268 @@
+import queue
+import threading
+import time
+from shareholding_data import ShareholdingData
+from scrapers import *
+from utils import *
+from webdriver_pool import get_webdriver_pool
+from shareholding_writer import get_shareholding_writer
+from trading_calendar import get_trading_calendar
+from stock_code_registry import get_unavailable_stock_codes
+from queries import *
+from config import *
+
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """ Thread-safe token bucket used as a global rate limit across scraper workers. """
+
+    def __init__(self, rate: float, capacity: float = None) -> None:
+        """ Initialises a full bucket.
+
+        Args:
+            rate (float): Tokens added per second.
+            capacity (float, optional): Maximum number of tokens, i.e. the allowed burst. Defaults to rate.
+
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """ Blocks until a token is available and consumes it. """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens +
+                                  (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_seconds = (1 - self.tokens) / self.rate
+            time.sleep(wait_seconds)
+
+
+class ScrapeCheckpoint:
+    """ Persists the outcome of each (stock_code, date) job in the scrape_checkpoint table.
+
+    Records go through the ShareholdingWriter after the job's rows, so a job is never checkpointed as done
+    before its data has been committed, and is not checkpointed when they failed to commit.
+
+    """
+
+    @staticmethod
+    def record(stock_code: int, date: pd.Timestamp, status: str, attempts: int, after: list = ()) -> None:
+        # after: Futures of the job's rows, see ShareholdingWriter.submit()
+        get_shareholding_writer().submit(UPSERT_SCRAPE_CHECKPOINT_QUERY, [(
+            int(stock_code),
+            date.strftime(DATE_BASE_FORMAT),
+            status,
+            attempts,
+            pd.Timestamp.now().isoformat()
+        )], after=after)
+
+    @staticmethod
+    def load(start_date: pd.Timestamp, end_date: pd.Timestamp) -> tuple:
+        """ Loads the jobs that don't need to run again for a date range.
+
+        Args:
+            start_date (pd.Timestamp): Start of the date range.
+            end_date (pd.Timestamp): End of the date range.
+
+        Returns:
+            tuple: Set of completed (stock_code, date_requested) pairs and set of unavailable stock codes, from the
+                checkpoint and the registry of unavailable stock codes.
+
+        """
+        query_kwargs = dict(
+            start_date=start_date.strftime(DATE_BASE_FORMAT),
+            end_date=end_date.strftime(DATE_BASE_FORMAT)
+        )
+        with connect_db() as con:
+            checkpoint_rows = con.execute(PULL_SCRAPE_CHECKPOINT_QUERY, query_kwargs).fetchall()
+            # Data scraped outside of prepopulate_db (e.g. by the Dash app) also counts as done
+            scraped_rows = con.execute(PULL_SCRAPED_DATE_STOCK_PAIRS_QUERY, {
+                'start_date_key': date_to_key(start_date),
+                'end_date_key': date_to_key(end_date)
+            }).fetchall()
+
+        done_jobs = {(stock_code, date_requested)
+                     for stock_code, date_requested, status in checkpoint_rows if status == 'done'}
+        done_jobs.update(scraped_rows)
+        unavailable_stock_codes = {
+            stock_code for stock_code, _, status in checkpoint_rows if status == 'unavailable'}
+        unavailable_stock_codes.update(get_unavailable_stock_codes().get_stock_codes())
+        return done_jobs, unavailable_stock_codes
+
+    @staticmethod
+    def reset(start_date: pd.Timestamp, end_date: pd.Timestamp) -> None:
+        with connect_db() as con:
+            con.execute(DELETE_SCRAPE_CHECKPOINT_QUERY, {
+                'start_date': start_date.strftime(DATE_BASE_FORMAT),
+                'end_date': end_date.strftime(DATE_BASE_FORMAT)
+            })
+
+
+class ScrapeScheduler:
+    """ Runs (stock_code, date) scrape jobs over a pool of worker threads.
+
+    Jobs are rate limited by a global token bucket, retried with exponential backoff, and checkpointed so
+    that an interrupted run resumes where it stopped. Throughput and ETA are logged while running.
+
+    """
+
+    def __init__(
+        self,
+        start_date: pd.Timestamp,
+        end_date: pd.Timestamp,
+        stock_codes: list,
+        concurrency: int = PREPOPULATE_CONCURRENCY,
+        rate_limit_per_second: float = PREPOPULATE_RATE_LIMIT_PER_SECOND,
+        max_retries: int = PREPOPULATE_MAX_RETRIES,
+        retry_backoff_seconds: float = PREPOPULATE_RETRY_BACKOFF_SECONDS,
+        progress_interval_seconds: float = PREPOPULATE_PROGRESS_INTERVAL_SECONDS
+    ) -> None:
+        self.start_date = start_date
+        self.end_date = end_date
+        self.stock_codes = stock_codes
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.retry_backoff_seconds = retry_backoff_seconds
+        self.progress_interval_seconds = progress_interval_seconds
+
+        self.rate_limiter = TokenBucket(rate_limit_per_second)
+        self.jobs = queue.Queue(maxsize=concurrency * 4)
+        self.unavailable_stock_codes = set()
+        self.finished = threading.Event()
+
+        # Each trading date is scraped once, and the other dates of the range are mapped to it when done
+        collapsed_dates = get_trading_calendar().collapse(
+            pd.date_range(start=start_date, end=end_date))
+        self.scrape_dates = list(collapsed_dates)
+        self.mapped_dates = [(date, trading_date) for trading_date, other_dates in collapsed_dates.values()
+                             for date in other_dates]
+
+        # Progress counters, guarded by counter_lock
+        self.counter_lock = threading.Lock()
+        self.total_jobs = 0
+        self.completed_jobs = 0
+        self.failed_jobs = 0
+
+    def _iter_pending_jobs(self, done_jobs: set) -> iter:
+        # Stock-major order so that an unavailable stock_code is detected before its other dates are queued
+        for stock_code in self.stock_codes:
+            if stock_code in self.unavailable_stock_codes:
+                continue
+            for date in self.scrape_dates:
+                if (stock_code, date.strftime(DATE_BASE_FORMAT)) not in done_jobs:
+                    yield int(stock_code), date
+
+    def _run_job(self, scraper: Scraper, stock_code: int, date: pd.Timestamp) -> None:
+        date_base = date.strftime(DATE_BASE_FORMAT)
+        for attempt in range(1, self.max_retries + 2):
+            if stock_code in self.unavailable_stock_codes:
+                return
+            self.rate_limiter.acquire()
+            try:
+                written = ShareholdingData._scrape_and_store_date_stock_data(
+                    date, stock_code, scraper)
+                ScrapeCheckpoint.record(stock_code, date, 'done', attempt, after=[written])
+                return
+
+            except StockCodeUnavailableError as e:
+                logger.info(
+                    f'stock_code={stock_code} is unavailable ({e}). Skipping its remaining dates.')
+                self.unavailable_stock_codes.add(stock_code)
+                ShareholdingData.unavailable_stock_codes.add(stock_code)
+                ScrapeCheckpoint.record(
+                    stock_code, date, 'unavailable', attempt)
+                return
+
+            except Exception as e:
+                if attempt > self.max_retries:
+                    logger.error(
+                        f'date={date_base}, stock_code={stock_code}, failed after {attempt} attempts: {e}')
+                    ScrapeCheckpoint.record(stock_code, date, 'failed', attempt)
+                    with self.counter_lock:
+                        self.failed_jobs += 1
+                    return
+                backoff_seconds = self.retry_backoff_seconds * \
+                    2 ** (attempt - 1)
+                logger.warning(
+                    f'date={date_base}, stock_code={stock_code}, attempt {attempt} failed: {e}. Retrying in {backoff_seconds}s.')
+                time.sleep(backoff_seconds)
+
+    def _worker(self) -> None:
+        with initialise_scraper() as scraper:
+            while True:
+                job = self.jobs.get()
+                if job is None:
+                    break
+                try:
+                    self._run_job(scraper, *job)
+                finally:
+                    with self.counter_lock:
+                        self.completed_jobs += 1
+
+    def _report_progress(self, started_at: float) -> None:
+        while not self.finished.wait(self.progress_interval_seconds):
+            with self.counter_lock:
+                completed_jobs, failed_jobs = self.completed_jobs, self.failed_jobs
+            elapsed_seconds = time.monotonic() - started_at
+            jobs_per_second = completed_jobs / elapsed_seconds if elapsed_seconds else 0
+            remaining_jobs = max(self.total_jobs - completed_jobs, 0)
+            eta = pd.Timedelta(seconds=round(remaining_jobs / jobs_per_second)
+                               ) if jobs_per_second else 'unknown'
+            logger.info(
+                f'Progress: {completed_jobs}/{self.total_jobs} jobs ({failed_jobs} failed), '
+                f'{jobs_per_second:.2f} jobs/sec, ETA {eta}.')
+
+    def run(self) -> None:
+        """ Runs all pending jobs and blocks until they have finished. """
+        done_jobs, self.unavailable_stock_codes = ScrapeCheckpoint.load(
+            self.start_date, self.end_date)
+        n_dates = len(self.scrape_dates)
+        scrape_dates = {date.strftime(DATE_BASE_FORMAT) for date in self.scrape_dates}
+        done_jobs = {(stock_code, date) for stock_code, date in done_jobs if date in scrape_dates}
+        available_stock_codes = set(
+            self.stock_codes) - self.unavailable_stock_codes
+        self.total_jobs = len(available_stock_codes) * n_dates - sum(
+            stock_code in available_stock_codes for stock_code, _ in done_jobs)
+        logger.info(
+            f'{self.total_jobs} pending jobs, {len(self.unavailable_stock_codes)} stock codes previously found unavailable, '
+            f'{len(self.mapped_dates)} non-trading dates per stock mapped instead of scraped.')
+
+        started_at = time.monotonic()
+        workers = [threading.Thread(target=self._worker, daemon=True)
+                   for _ in range(self.concurrency)]
+        reporter = threading.Thread(
+            target=self._report_progress, args=(started_at,), daemon=True)
+        for thread in workers + [reporter]:
+            thread.start()
+
+        try:
+            for job in self._iter_pending_jobs(done_jobs):
+                self.jobs.put(job)
+            for _ in workers:
+                self.jobs.put(None)
+            for thread in workers:
+                thread.join()
+            for stock_code in set(self.stock_codes) - self.unavailable_stock_codes:
+                ShareholdingData.submit_date_mappings(self.mapped_dates, stock_code)
+        finally:
+            self.finished.set()
+            get_shareholding_writer().flush()
+
+        pool_metrics = get_webdriver_pool().get_metrics()
+        if pool_metrics['checkouts']:
+            logger.info(f'WebDriver pool metrics: {pool_metrics}')
+        get_webdriver_pool().close()
+
+        elapsed_seconds = time.monotonic() - started_at
+        logger.info(
+            f'Finished {self.completed_jobs} jobs ({self.failed_jobs} failed) in {pd.Timedelta(seconds=round(elapsed_seconds))}.')
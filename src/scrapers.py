@@ -0,0 +1,307 @@
+import threading
+from typing import Union
+import lxml.html
+import requests
+from requests.adapters import HTTPAdapter
+from selenium.webdriver.common.by import By
+from selenium.common.exceptions import UnexpectedAlertPresentException
+from webdriver_pool import WebDriverPool, get_webdriver_pool
+
+from utils import *
+from config import *
+
+
+logger = logging.getLogger(__name__)
+
+# Message shown by the CCASS search page for stock codes that cannot be queried
+STOCK_CODE_UNAVAILABLE_MESSAGE = 'does not exist OR not available for enquiry'
+
+# Headers of the participant_id, participant_name, shareholding and pct_total_issued columns of the results table
+SEARCH_RESULT_COLUMNS = [
+    'Participant ID',
+    'Name of CCASS Participant(* for Consenting Investor Participants )',
+    'Shareholding',
+    '% of the total number of Issued Shares/ Warrants/ Units'
+]
+
+
+class ScrapeError(Exception):
+    """ Raised when the CCASS search page does not return a shareholding table. """
+
+
+class StockCodeUnavailableError(ScrapeError):
+    """ Raised when the CCASS search page reports that a stock code does not exist or is not available. """
+
+
+def _get_input_value(root: lxml.html.HtmlElement, element_id: str) -> str:
+    values = root.xpath(f'//input[@id="{element_id}"]/@value')
+    # Attribute results are lxml string proxies holding a reference to the tree
+    return str(values[0]) if values else None
+
+
+def _get_cell_text(td: lxml.html.HtmlElement) -> str:
+    # Cells repeat their column header in a mobile-list-heading div, the value is in the last (mobile-list-body) div
+    body = td[-1] if len(td) else td
+    return ((body.text if len(body) == 0 else body.text_content()) or '').strip()
+
+
+def parse_search_result_page(page_source: str) -> tuple:
+    """ Parses a CCASS search result page.
+
+    The page is parsed once with lxml, and the participant rows are read straight into typed columns.
+
+    Args:
+        page_source (str): HTML of the search page after a search has been submitted.
+
+    Returns:
+        tuple: Displayed shareholding date (HKEX format), stock name and a DataFrame with the columns
+            participant_id, participant_name, shareholding and pct_total_issued.
+
+    """
+    root = lxml.html.fromstring(page_source)
+
+    # Site will auto-correct back values that are Sundays or HK public holidays
+    date_hkex_displayed = _get_input_value(root, 'txtShareholdingDate')
+
+    # Get stock_name
+    stock_name = _get_input_value(root, 'txtStockName')
+
+    # Reading detailed shareholding table
+    pnl_result_normal_tags = root.xpath('//div[@id="pnlResultNormal"]')
+    if not pnl_result_normal_tags:
+        raise ScrapeError('pnlResultNormal not found in page')
+    table_tags = pnl_result_normal_tags[0].xpath('.//table')
+    if not table_tags:
+        raise ScrapeError('No table found in pnlResultNormal')
+    table_tag = table_tags[0]
+
+    # Locate the columns by header, the address column is not stored
+    headers = [th.text_content().strip() for th in table_tag.xpath('.//thead/tr[1]/th')]
+    column_indexes = [headers.index(header) for header in SEARCH_RESULT_COLUMNS]
+    rows = [
+        [_get_cell_text(td) for td in tds]
+        for tds in (tr.findall('td') for tr in table_tag.xpath('./tbody/tr | ./tr'))
+        if len(tds) == len(headers)
+    ]
+    participant_ids, participant_names, shareholdings, pcts_total_issued = (
+        [row[column_index] for row in rows] for column_index in column_indexes)
+
+    # Participants without an ID (e.g. consenting investor participants) have an empty cell
+    df = pd.DataFrame({
+        'participant_id': pd.Series([value or np.nan for value in participant_ids], dtype=object),
+        'participant_name': pd.Series(participant_names, dtype=object),
+        'shareholding': np.array([value.replace(',', '') for value in shareholdings], dtype=np.int64),
+        'pct_total_issued': pd.to_numeric(pd.Series([value.rstrip('%') or np.nan for value in pcts_total_issued], dtype=object)).astype(np.float64)
+    })
+
+    return date_hkex_displayed, stock_name, df
+
+
+class SeleniumScraper:
+    """ Submits CCASS searches by driving a Selenium WebDriver session.
+
+    Each search checks a warm session out of the process-wide WebDriverPool instead of starting a browser.
+
+    """
+
+    def __init__(self, pool: WebDriverPool = None) -> None:
+        self.pool = pool if pool is not None else get_webdriver_pool()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        # Sessions are owned by the pool and returned after each search
+        pass
+
+    def search(self, date: pd.Timestamp, stock_code: int) -> str:
+        """ Submits the search form for a given date and stock_code.
+
+        Args:
+            date (pd.Timestamp): Shareholding date.
+            stock_code (int): HKEX stock code.
+
+        Returns:
+            str: HTML of the search result page.
+
+        """
+        date_hkex = date.strftime(DATE_HKEX_FORMAT)
+        with self.pool.driver() as driver:
+            try:
+                # Locate btnSearch element to confirm search dialog has loaded (implicit wait)
+                btn_search_element = driver.find_element(By.ID, 'btnSearch')
+
+                # Enter date field
+                driver.execute_script(
+                    f'document.getElementById("txtShareholdingDate").setAttribute("value", "{date_hkex}")')
+
+                # Enter stock code field
+                driver.execute_script(
+                    f'document.getElementById("txtStockCode").setAttribute("value", {stock_code})')
+
+                # Click search button
+                btn_search_element.click()
+
+                # Locate pnlResultNormal (table) element to confirm table has loaded (implicit wait)
+                driver.find_element(By.ID, 'pnlResultNormal')
+
+            except UnexpectedAlertPresentException as e:
+                if STOCK_CODE_UNAVAILABLE_MESSAGE in (e.msg or ''):
+                    raise StockCodeUnavailableError(e.msg) from e
+                raise
+
+            return driver.page_source
+
+
+# requests.Session is not thread-safe, so each thread keeps its own pooled session
+_http_session_local = threading.local()
+
+
+def get_http_session() -> requests.Session:
+    """ Returns the calling thread's HTTP session, creating it on first use.
+
+    Returns:
+        requests.Session: Session with a pooled adapter for the CCASS host.
+
+    """
+    session = getattr(_http_session_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=HTTP_SCRAPER_POOL_SIZE,
+            pool_maxsize=HTTP_SCRAPER_POOL_SIZE
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers.update({'User-Agent': HTTP_SCRAPER_USER_AGENT})
+        _http_session_local.session = session
+    return session
+
+
+class HttpScraper:
+    """ Submits CCASS searches by posting the ASP.NET search form directly, without a browser.
+
+    The hidden ASP.NET state fields (__VIEWSTATE, __EVENTVALIDATION, ...) are carried over from the
+    previously loaded page, as a browser would. When fallback is enabled, failed searches are retried
+    with a lazily started SeleniumScraper.
+
+    """
+
+    def __init__(self, search_url: str = CCASS_SHAREHOLDING_SEARCH_URL, fallback_to_selenium: bool = SCRAPER_FALLBACK_TO_SELENIUM) -> None:
+        self.search_url = search_url
+        self.fallback_to_selenium = fallback_to_selenium
+        self.session = get_http_session()
+        self.form_fields = None
+        self.fallback_scraper = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self.fallback_scraper is not None:
+            self.fallback_scraper.close()
+            self.fallback_scraper = None
+
+    @staticmethod
+    def _parse_form_fields(page_source: str) -> dict:
+        # Collect every named input of the search form so that the post-back matches a browser submit
+        forms = lxml.html.fromstring(page_source).xpath(
+            '//input[@id="txtStockCode"]/ancestor::form[1]')
+        if not forms:
+            raise ScrapeError('Search form not found in page')
+        form = forms[0]
+        return {
+            element.get('name'): element.get('value', '')
+            for element in form.iter('input')
+            if element.get('name') and element.get('type') not in ('submit', 'button', 'image')
+        }
+
+    def _load_form(self) -> None:
+        response = self.session.get(
+            self.search_url, timeout=HTTP_SCRAPER_TIMEOUT_SECONDS)
+        response.raise_for_status()
+        self.form_fields = self._parse_form_fields(response.text)
+
+    def _search(self, date: pd.Timestamp, stock_code: int) -> str:
+        if self.form_fields is None:
+            self._load_form()
+
+        form_data = dict(self.form_fields)
+        form_data.update({
+            '__EVENTTARGET': 'btnSearch',
+            '__EVENTARGUMENT': '',
+            'txtShareholdingDate': date.strftime(DATE_HKEX_FORMAT),
+            'txtStockCode': f'{stock_code:05d}',
+            'txtStockName': '',
+            'txtParticipantID': '',
+            'txtParticipantName': '',
+            'txtSelPartID': '',
+        })
+        response = self.session.post(
+            self.search_url, data=form_data, timeout=HTTP_SCRAPER_TIMEOUT_SECONDS)
+        response.raise_for_status()
+        page_source = response.text
+
+        # The response carries fresh ASP.NET state for the next post-back
+        form_fields = self._parse_form_fields(page_source)
+        alert_message = form_fields.get('alertMsg', '')
+        self.form_fields = form_fields
+
+        if STOCK_CODE_UNAVAILABLE_MESSAGE in alert_message:
+            raise StockCodeUnavailableError(alert_message)
+        elif alert_message:
+            raise ScrapeError(alert_message)
+        return page_source
+
+    def search(self, date: pd.Timestamp, stock_code: int) -> str:
+        """ Submits the search form for a given date and stock_code.
+
+        Args:
+            date (pd.Timestamp): Shareholding date.
+            stock_code (int): HKEX stock code.
+
+        Returns:
+            str: HTML of the search result page.
+
+        """
+        try:
+            return self._search(date, stock_code)
+        except StockCodeUnavailableError:
+            raise
+        except (requests.RequestException, ScrapeError) as e:
+            # Stale ASP.NET state is the usual cause, so reload the form on the next search
+            self.form_fields = None
+            if not self.fallback_to_selenium:
+                raise
+            logger.warning(
+                f'date={date.strftime(DATE_BASE_FORMAT)}, stock_code={stock_code}, HTTP scrape failed ({e}). Falling back to Selenium.')
+            if self.fallback_scraper is None:
+                self.fallback_scraper = SeleniumScraper()
+            return self.fallback_scraper.search(date, stock_code)
+
+
+Scraper = Union[HttpScraper, SeleniumScraper]
+
+
+def initialise_scraper(backend: str = SCRAPER_BACKEND) -> Scraper:
+    """ Initialises the scraper backend selected in config.py.
+
+    Args:
+        backend (str, optional): 'http' or 'selenium'. Defaults to SCRAPER_BACKEND.
+
+    Returns:
+        Scraper: HttpScraper or SeleniumScraper, to be used as a context manager.
+
+    """
+    if backend == 'http':
+        return HttpScraper()
+    elif backend == 'selenium':
+        return SeleniumScraper()
+    else:
+        raise ValueError(f'Unknown scraper backend: {backend}')
@@ -1,13 +1,17 @@
+import time
+from concurrent.futures import Future
 import pandas as pd
-import selenium
-from selenium.webdriver.common.by import By
-from selenium.common.exceptions import UnexpectedAlertPresentException
-from bs4 import BeautifulSoup
-import sqlite3
 
 from utils import *
 from config import *
 from queries import *
+from scrapers import *
+from shareholding_writer import get_shareholding_writer
+from columnar_cache import get_columnar_cache
+from trading_calendar import get_trading_calendar
+from stock_code_registry import get_unavailable_stock_codes
+from scrape_locks import scrape_locks
+from instrumentation import timed
 
 
 logger = logging.getLogger(__name__)
@@ -16,15 +20,16 @@ logger = logging.getLogger(__name__)
 class ShareholdingData:
     """ Web scraper for the CCASS shareholding search page. 
     
-    Uses a local SQLite database to store and retrieve the scraped data.
+    Uses a local SQLite database to store and retrieve the scraped data, normalised into the stocks, participants,
+    scrape_dates and holdings tables (see queries.py).
 
     """
     # Initialise the shareholding database and table
     initialise_shareholding_db()
 
-    # Initialise ephemeral list to store unavailable stock_code values to speed up scraper
-    # Not stored permanently because new stock codes may be created in the future
-    unavailable_stock_codes = []
+    # Registry of unavailable stock_code values shared across processes to speed up scraper
+    # Entries expire after UNAVAILABLE_STOCK_CODE_RECHECK_DAYS because new stock codes may be created in the future
+    unavailable_stock_codes = get_unavailable_stock_codes()
 
     @staticmethod
     def _check_date_stock_data_exists_in_db(date: pd.Timestamp, stock_code: int) -> bool:
@@ -39,15 +44,10 @@ class ShareholdingData:
 
         """
         # Returns True when the requested date and stock_code already exist in the DB
-        with sqlite3.connect(SHAREHOLDING_DATA_DB_PATH) as con:
-            response_df = pd.read_sql(
-                sql=CHECK_DATE_STOCK_DATA_IN_DB_QUERY.format(
-                    date_requested=date.strftime(DATE_BASE_FORMAT),
-                    stock_code=stock_code
-                ),
-                con=con
-            )
-        return not response_df.empty
+        return query_exists(CHECK_DATE_STOCK_DATA_IN_DB_QUERY, {
+            'stock_code': int(stock_code),
+            'date_requested_key': date_to_key(date)
+        })
 
     @staticmethod
     def _check_date_range_stock_data_exists_in_db(start_date: pd.Timestamp, end_date: pd.Timestamp, stock_code: int) -> pd.Series:
@@ -63,27 +63,27 @@ class ShareholdingData:
 
         """
         # For a given date_range and stock_code, returns whether each date already exists in the DB
-        with sqlite3.connect(SHAREHOLDING_DATA_DB_PATH) as con:
-            response_df = pd.read_sql(
-                sql=CHECK_DATE_RANGE_STOCK_DATA_IN_DB_QUERY.format(
-                    stock_code=stock_code
-                ),
-                con=con
-            )
-        return pd.Series(pd.date_range(start=start_date, end=end_date)).isin(response_df['date_requested'])
+        stored_date_keys = query_column(CHECK_DATE_RANGE_STOCK_DATA_IN_DB_QUERY, {
+            'stock_code': int(stock_code),
+            'start_date_key': date_to_key(start_date),
+            'end_date_key': date_to_key(end_date)
+        })
+        return pd.Series(np.isin(dates_to_keys(pd.date_range(start=start_date, end=end_date)), stored_date_keys))
 
     @classmethod
-    def _scrape_date_stock_data(cls, date: pd.Timestamp, stock_code: int, driver: selenium.webdriver, check_if_exists_in_db: bool = False) -> None:
+    def _scrape_date_stock_data(cls, date: pd.Timestamp, stock_code: int, scraper: Scraper, check_if_exists_in_db: bool = False) -> Future:
         """ Scrapes the CCASS shareholding data for a given date and stock_code. Stores the output in the shareholding table of the SQLite database.
 
         Args:
             date (pd.Timestamp): Shareholding date.
             stock_code (int): HKEX stock code.
-            driver (selenium.webdriver): Selenium WebDriver to be used to scrape the website.
+            scraper (Scraper): Scraper backend (HttpScraper or SeleniumScraper) to be used to scrape the website.
             check_if_exists_in_db (bool, optional): If True, it will skip when the relevant data already exists in the database. Defaults to False.
+
+        Returns:
+            Future: The ShareholdingWriter's Future of the queued rows, or None when nothing was queued.
         """
         date_base = date.strftime(DATE_BASE_FORMAT)
-        date_hkex = date.strftime(DATE_HKEX_FORMAT)
 
         # Checking whether to skip
         if check_if_exists_in_db and cls._check_date_stock_data_exists_in_db(date, stock_code):
@@ -98,128 +98,356 @@ class ShareholdingData:
             return
 
         # Running scraper
-        logger.info(
-            f'Scraping data for date={date_base}, stock_code={stock_code}...')
         try:
-            # Locate btnSearch element to confirm search dialog has loaded (implicit wait)
-            btn_search_element = driver.find_element(By.ID, 'btnSearch')
-
-            # Enter date field
-            driver.execute_script(
-                f'document.getElementById("txtShareholdingDate").setAttribute("value", "{date_hkex}")')
-
-            # Enter stock code field
-            driver.execute_script(
-                f'document.getElementById("txtStockCode").setAttribute("value", {stock_code})')
-
-            # Click search button
-            btn_search_element.click()
-
-            # Locate pnlResultNormal (table) element to confirm table has loaded (implicit wait)
-            driver.find_element(By.ID, 'pnlResultNormal')
-
-            # Site will auto-correct back values that are Sundays or HK public holidays
-            shareholding_date_element = driver.find_element(
-                By.ID, 'txtShareholdingDate')
-            date_hkex_displayed = shareholding_date_element.get_attribute(
-                'value')
-
-            # Get stock_name
-            stock_name = driver.find_element(
-                By.ID, 'txtStockName').get_attribute('value')
-
-            # Use bs4 to parse table
-            soup = BeautifulSoup(driver.page_source, 'html.parser')
-            # Reading detailed shareholding table
-            pnl_result_normal_tag = soup.find('div', id='pnlResultNormal')
-
-            # Remove duplicated header values from rows in table by removing tags
-            mobile_list_heading_tag_list = pnl_result_normal_tag.find_all(
-                'div', class_='mobile-list-heading')
-            for element in mobile_list_heading_tag_list:
-                element.decompose()
-
-            # Read table from the tag as a data frame
-            df = pd.read_html(str(pnl_result_normal_tag))[0]
-
-            df = df.rename(columns={
-                'Participant ID': 'participant_id',
-                'Name of CCASS Participant(* for Consenting Investor Participants )': 'participant_name',
-                'Shareholding': 'shareholding',
-                '% of the total number of Issued Shares/ Warrants/ Units': 'pct_total_issued'
-            }
-            )
-            df = df[['participant_id', 'participant_name',
-                     'shareholding', 'pct_total_issued']]
-
-            # Convert pct_total_issued to numeric
-            df['pct_total_issued'] = pd.to_numeric(
-                df['pct_total_issued'].str.rstrip('%'))
-
-            # Append date_requested, date and stock_code as a columns
-            df.insert(0, 'date_requested', date_base),
-            df.insert(1, 'date', pd.Timestamp(
-                date_hkex_displayed).strftime(DATE_BASE_FORMAT))
-            df.insert(2, 'stock_code', stock_code)
-            df.insert(3, 'stock_name', stock_name)
-
-            # Verify columns before writing to database
-            assert list(df.columns) == ['date_requested', 'date', 'stock_code', 'stock_name', 'participant_id',
-                                        'participant_name', 'shareholding', 'pct_total_issued'], 'Columns do not match schema'
-
-            # Write to shareholding database table
-            with sqlite3.connect(SHAREHOLDING_DATA_DB_PATH) as con:
-                df.to_sql(
-                    name='shareholding',
-                    con=con,
-                    if_exists='append',
-                    index=False
-                )
-                logger.info(
-                    f'date={date_base}, stock_code={stock_code}, successfully written to database.')
-
-        except UnexpectedAlertPresentException as e:
+            return cls._scrape_and_store_date_stock_data(date, stock_code, scraper)
+
+        except StockCodeUnavailableError as e:
             logger.error(f'date={date_base}, stock_code={stock_code}, {e}')
-            if 'does not exist OR not available for enquiry' in e.msg:
-                cls.unavailable_stock_codes.append(stock_code)
-                logger.info(
-                    f'stock_code={stock_code} added to list of unavailable stock codes.')
+            cls.unavailable_stock_codes.add(stock_code)
+            logger.info(
+                f'stock_code={stock_code} added to registry of unavailable stock codes.')
 
         except BaseException as e:
             logger.error(f'date={date_base}, stock_code={stock_code}, {e}')
 
+    @staticmethod
+    def _scrape_and_store_date_stock_data(date: pd.Timestamp, stock_code: int, scraper: Scraper) -> Future:
+        """ Scrapes the CCASS shareholding data for a given date and stock_code and queues it for the shareholding table.
+
+        Unlike _scrape_date_stock_data(), errors are raised to the caller so that they can be retried.
+        Rows are committed by the ShareholdingWriter thread, call its flush() before reading them back.
+
+        Args:
+            date (pd.Timestamp): Shareholding date.
+            stock_code (int): HKEX stock code.
+            scraper (Scraper): Scraper backend (HttpScraper or SeleniumScraper) to be used to scrape the website.
+
+        Returns:
+            Future: The ShareholdingWriter's Future of the queued rows, resolved once they are committed.
+
+        Raises:
+            StockCodeUnavailableError: When the stock_code does not exist or is not available for enquiry.
+
+        """
+        date_base = date.strftime(DATE_BASE_FORMAT)
+
+        logger.info(
+            f'Scraping data for date={date_base}, stock_code={stock_code}...')
+        with timed('scrape.search', stock_code=stock_code, date=date_base):
+            page_source = scraper.search(date, stock_code)
+        with timed('scrape.parse', stock_code=stock_code, date=date_base):
+            date_hkex_displayed, stock_name, df = parse_search_result_page(
+                page_source)
+
+        # Append date_requested, date and stock_code as a columns
+        df.insert(0, 'date_requested', date_base),
+        df.insert(1, 'date', pd.Timestamp(
+            date_hkex_displayed).strftime(DATE_BASE_FORMAT))
+        df.insert(2, 'stock_code', stock_code)
+        df.insert(3, 'stock_name', stock_name)
+
+        # Verify columns before writing to database
+        assert list(df.columns) == ['date_requested', 'date', 'stock_code', 'stock_name', 'participant_id',
+                                    'participant_name', 'shareholding', 'pct_total_issued'], 'Columns do not match schema'
+
+        # Queue for the shareholding database table
+        with timed('scrape.submit', stock_code=stock_code, date=date_base):
+            written = get_shareholding_writer().submit_shareholding(df)
+        # A re-checked stock_code may have been listed since it was registered as unavailable
+        get_unavailable_stock_codes().discard(stock_code)
+        logger.info(
+            f'date={date_base}, stock_code={stock_code}, successfully queued for database.')
+        return written
+
+    @staticmethod
+    def _plan_scrapes(dates: pd.DatetimeIndex, stock_code: int) -> tuple:
+        """ Collapses missing dates to the trading dates that need to be scraped, see TradingCalendar.
+
+        Args:
+            dates (pd.DatetimeIndex): Missing shareholding dates.
+            stock_code (int): HKEX stock code.
+
+        Returns:
+            tuple: Dates to be scraped, and list of (date, trading_date) pairs to be mapped to the stored data of
+                their trading date.
+
+        """
+        stored_date_keys = set(query_column(PULL_STOCK_DATE_KEYS_QUERY, {'stock_code': int(stock_code)}))
+
+        scrape_dates, mapped_dates = [], []
+        for scrape_date, (trading_date, other_dates) in get_trading_calendar().collapse(dates).items():
+            if date_to_key(trading_date) in stored_date_keys:
+                mapped_dates.append((scrape_date, trading_date))
+            else:
+                scrape_dates.append(scrape_date)
+            mapped_dates.extend((date, trading_date) for date in other_dates)
+
+        if mapped_dates:
+            logger.info(f'stock_code={stock_code}, {len(mapped_dates)} non-trading dates mapped to their trading date instead of scraped.')
+        return pd.DatetimeIndex(scrape_dates), mapped_dates
+
+    @staticmethod
+    def submit_date_mappings(mapped_dates: list, stock_code: int) -> None:
+        """ Queues scrape_dates rows mapping non-trading dates to the stored data of their trading date.
+
+        Dates whose trading date has no stored data (e.g. its scrape failed) are left missing.
+
+        Args:
+            mapped_dates (list): (date, trading_date) pairs.
+            stock_code (int): HKEX stock code.
+
+        """
+        if mapped_dates:
+            mappings = [
+                {'stock_code': int(stock_code), 'date_requested_key': date_to_key(date), 'date_key': date_to_key(trading_date)}
+                for date, trading_date in mapped_dates
+            ]
+            get_shareholding_writer().submit(INSERT_SCRAPE_DATE_MAPPING_QUERY, mappings)
+            get_shareholding_writer().submit(BUMP_STOCK_MONTH_GENERATIONS_QUERY, mappings)
+
+    @staticmethod
+    def submit_scrape_jobs(dates: pd.DatetimeIndex, stock_code: int) -> None:
+        """ Queues (date, stock_code) scrapes for the background workers of scrape_jobs.py.
+
+        Jobs already queued or running for the same (date, stock_code) are not duplicated.
+
+        Args:
+            dates (pd.DatetimeIndex): Shareholding dates.
+            stock_code (int): HKEX stock code.
+
+        """
+        now = time.time()
+        with connect_db() as con:
+            con.executemany(SUBMIT_SCRAPE_JOB_QUERY, [
+                {'stock_code': int(stock_code), 'date_requested_key': date_to_key(date), 'now': now}
+                for date in dates
+            ])
+        logger.info(f'stock_code={stock_code}, {len(dates)} dates queued for scraping.')
+
     @classmethod
-    def pull_shareholding_data(cls, start_date: pd.Timestamp, end_date: pd.Timestamp, stock_code: int) -> pd.DataFrame:
-        """ Retrieves shareholding data from the SQLite database. Runs scraper when the requested data doesn't already exist in the database.
+    def fetch_missing_dates(cls, start_date: pd.Timestamp, end_date: pd.Timestamp, stock_code: int, scrape_missing: bool = True) -> None:
+        """ Scrapes and stores the dates of a date range missing from the database, or queues them for the background scrape workers.
 
         Args:
             start_date (pd.Timestamp): Start of the date range.
             end_date (pd.Timestamp): End of the date range.
             stock_code (int): HKEX stock code.
+            scrape_missing (bool, optional): If True, missing dates are scraped before returning. Otherwise they are
+                queued for the background scrape workers. Defaults to True.
 
-        Returns:
-            pd.DataFrame: Table of shareholding data.
         """
         date_range = pd.date_range(start=start_date, end=end_date)
 
         # Check which dates in date_range already exist in DB
-        date_range_check = cls._check_date_range_stock_data_exists_in_db(
-            start_date, end_date, stock_code)
+        with timed('db.check_dates', stock_code=stock_code):
+            date_range_check = cls._check_date_range_stock_data_exists_in_db(
+                start_date, end_date, stock_code)
 
         # Run scraper if not all dates already available in the DB
-        if not cls._check_date_range_stock_data_exists_in_db(start_date, end_date, stock_code).all():
-            with initialise_driver() as driver:
-                for date in date_range[~date_range_check]:
-                    cls._scrape_date_stock_data(date, stock_code, driver)
+        if not date_range_check.all():
+            # Only scrape each trading date once, and map the other dates to its stored data
+            scrape_dates, mapped_dates = cls._plan_scrapes(
+                date_range[~date_range_check], stock_code)
+            if not scrape_missing:
+                if stock_code not in cls.unavailable_stock_codes and len(scrape_dates):
+                    cls.submit_scrape_jobs(scrape_dates, stock_code)
+            else:
+                # Another process may be scraping the same dates. Wait for it, and skip the dates it has stored
+                with scrape_locks(stock_code, scrape_dates):
+                    with initialise_scraper() as scraper:
+                        writes = [cls._scrape_date_stock_data(date, stock_code, scraper, check_if_exists_in_db=True)
+                                  for date in scrape_dates]
+                    get_shareholding_writer().flush()
+                # Rows committed before the flush, in a batch that failed, are not reported by it
+                for written in writes:
+                    if written is not None:
+                        written.result()
+            cls.submit_date_mappings(mapped_dates, stock_code)
+            with timed('db.flush', stock_code=stock_code):
+                get_shareholding_writer().flush()
+
+    @staticmethod
+    def read_shareholding_data(start_date: pd.Timestamp, end_date: pd.Timestamp, stock_code: int) -> pd.DataFrame:
+        """ Reads the stored shareholding data of a date range, without scraping.
+
+        Args:
+            start_date (pd.Timestamp): Start of the date range.
+            end_date (pd.Timestamp): End of the date range.
+            stock_code (int): HKEX stock code.
+
+        Returns:
+            pd.DataFrame: Table of shareholding data, see pull_shareholding_data().
+
+        """
+        # Serve from the memory-mapped columnar cache when enabled
+        if USE_COLUMNAR_CACHE:
+            with timed('db.read_columnar_cache', stock_code=stock_code):
+                return get_columnar_cache().read(start_date, end_date, stock_code)
 
         # Pull from DB as a DataFarme
-        with sqlite3.connect(SHAREHOLDING_DATA_DB_PATH) as con:
+        with timed('db.read_shareholding_data', stock_code=stock_code), connect_db() as con:
+            response_df = pd.read_sql(
+                sql=PULL_SHAREHOLDING_DATA_QUERY,
+                con=con,
+                params={
+                    'start_date_key': date_to_key(start_date),
+                    'end_date_key': date_to_key(end_date),
+                    'stock_code': int(stock_code)
+                }
+            )
+        return response_df
+
+    @classmethod
+    @timed('data.pull_shareholding_data')
+    def pull_shareholding_data(cls, start_date: pd.Timestamp, end_date: pd.Timestamp, stock_code: int, scrape_missing: bool = True) -> pd.DataFrame:
+        """ Retrieves shareholding data from the SQLite database. Runs scraper when the requested data doesn't already exist in the database.
+
+        Args:
+            start_date (pd.Timestamp): Start of the date range.
+            end_date (pd.Timestamp): End of the date range.
+            stock_code (int): HKEX stock code.
+            scrape_missing (bool, optional): If True, missing dates are scraped before returning. Otherwise they are
+                queued for the background scrape workers and the data already stored is returned. Defaults to True.
+
+        Returns:
+            pd.DataFrame: Table of shareholding data. Stock and participant columns are categorical when served
+                from the columnar cache (USE_COLUMNAR_CACHE).
+        """
+        cls.fetch_missing_dates(start_date, end_date, stock_code, scrape_missing)
+        return cls.read_shareholding_data(start_date, end_date, stock_code)
+
+    @classmethod
+    def iter_shareholding_data(cls, start_date: pd.Timestamp, end_date: pd.Timestamp, stock_code: int, scrape_missing: bool = True, chunk_days: int = SHAREHOLDING_CHUNK_DAYS):
+        """ Streaming pull_shareholding_data(), which fetches, stores and reads the date range chunk_days at a time.
+
+        Args:
+            start_date (pd.Timestamp): Start of the date range.
+            end_date (pd.Timestamp): End of the date range.
+            stock_code (int): HKEX stock code.
+            scrape_missing (bool, optional): See pull_shareholding_data(). Defaults to True.
+            chunk_days (int, optional): Days per chunk. Defaults to SHAREHOLDING_CHUNK_DAYS.
+
+        Yields:
+            pd.DataFrame: Table of shareholding data of a chunk of the date range.
+
+        """
+        for chunk_start_date, chunk_end_date in iter_date_chunks(start_date, end_date, chunk_days):
+            yield cls.pull_shareholding_data(chunk_start_date, chunk_end_date, stock_code, scrape_missing)
+
+    @staticmethod
+    def pull_date_requested_map(start_date: pd.Timestamp, end_date: pd.Timestamp, stock_code: int) -> pd.Series:
+        """ Retrieves the dates displayed by the site for the stored dates of a date range, without reading their rows.
+
+        Args:
+            start_date (pd.Timestamp): Start of the date range.
+            end_date (pd.Timestamp): End of the date range.
+            stock_code (int): HKEX stock code.
+
+        Returns:
+            pd.Series: Displayed dates (YYYY-MM-DD) indexed by date_requested, named after the stock.
+
+        """
+        with connect_db() as con:
+            response_df = pd.read_sql(
+                sql=PULL_DATE_REQUESTED_MAP_QUERY,
+                con=con,
+                params={
+                    'start_date_key': date_to_key(start_date),
+                    'end_date_key': date_to_key(end_date),
+                    'stock_code': int(stock_code)
+                }
+            )
+        stock_name = response_df['stock_name'].iloc[-1] if len(response_df) else None
+        return response_df.set_index('date_requested')['date'].rename(stock_name)
+
+    @staticmethod
+    @timed('db.pull_transaction_finder_data')
+    def pull_transaction_finder_data(start_date: pd.Timestamp, end_date: pd.Timestamp, stock_code: int, threshold_proportion: float, range_start_date: pd.Timestamp = None) -> pd.DataFrame:
+        """ Retrieves the changes in shareholding detected as potential transactions from the holding_deltas table.
+
+        Changes are against the previous date within the date range. Participants entering or leaving are always
+        detected. Does not scrape, call pull_shareholding_data() first for dates that may be missing.
+
+        Args:
+            start_date (pd.Timestamp): Start of the date range.
+            end_date (pd.Timestamp): End of the date range.
+            stock_code (int): HKEX stock code.
+            threshold_proportion (float): Minimum absolute proportional change in shareholding.
+            range_start_date (pd.Timestamp, optional): Start of the whole date range when start_date is that of a
+                chunk, so that the changes of the chunk's first date against the previous chunk are kept.
+                Defaults to None (start_date).
+
+        Returns:
+            pd.DataFrame: Table of detected changes, with the shareholding_diff, shareholding_pct_change and
+                transaction_detected columns.
+        """
+        with connect_db() as con:
+            response_df = pd.read_sql(
+                sql=PULL_TRANSACTION_FINDER_DATA_QUERY,
+                con=con,
+                params={
+                    'range_start_date_key': date_to_key(range_start_date if range_start_date is not None else start_date),
+                    'start_date_key': date_to_key(start_date),
+                    'end_date_key': date_to_key(end_date),
+                    'stock_code': int(stock_code),
+                    'threshold_proportion': float(threshold_proportion)
+                }
+            )
+        response_df['transaction_detected'] = True
+        return response_df
+
+    @staticmethod
+    @timed('db.pull_top_participants_data')
+    def pull_top_participants_data(start_date: pd.Timestamp, end_date: pd.Timestamp, stock_code: int, top_n: int = TREND_TOP_N, rank_by: str = TREND_RANK_BY) -> pd.DataFrame:
+        """ Retrieves the history of the top_n participants of a stock over a date range, from the holding_rankings table.
+
+        Participants are looked up by primary key on the stored dates of the range instead of scanning every holding.
+        Does not scrape, call pull_shareholding_data() first for dates that may be missing.
+
+        Args:
+            start_date (pd.Timestamp): Start of the date range.
+            end_date (pd.Timestamp): End of the date range.
+            stock_code (int): HKEX stock code.
+            top_n (int, optional): Number of participants. Defaults to TREND_TOP_N.
+            rank_by (str, optional): 'shareholding' on the last stored date of the range, or absolute 'change' in
+                shareholding between its first and last stored dates. Defaults to TREND_RANK_BY.
+
+        Raises:
+            ValueError: When rank_by is unknown, or top_n exceeds HOLDING_RANKINGS_DEPTH when ranking by shareholding.
+
+        Returns:
+            pd.DataFrame: Shareholding of the top participants on each stored date, with the columns date,
+                stock_code, stock_name, participant_id, participant_name, shareholding and pct_total_issued.
+        """
+        if rank_by == 'shareholding' and top_n > HOLDING_RANKINGS_DEPTH:
+            raise ValueError(f'top_n={top_n} exceeds HOLDING_RANKINGS_DEPTH={HOLDING_RANKINGS_DEPTH}.')
+        elif rank_by not in ('shareholding', 'change'):
+            raise ValueError(f'Unknown rank_by: {rank_by}')
+
+        with connect_db() as con:
+            date_keys = [date_key for date_key, in con.execute(PULL_RANKED_DATE_KEYS_QUERY, {
+                'stock_code': int(stock_code),
+                'start_date_key': date_to_key(start_date),
+                'end_date_key': date_to_key(end_date)
+            })]
+            if not date_keys:
+                participant_keys = []
+            elif rank_by == 'shareholding':
+                participant_keys = [participant_key for participant_key, in con.execute(
+                    PULL_TOP_PARTICIPANTS_BY_SHAREHOLDING_QUERY,
+                    {'stock_code': int(stock_code), 'date_key': date_keys[-1], 'top_n': int(top_n)})]
+            else:
+                participant_keys = [participant_key for participant_key, in con.execute(
+                    PULL_TOP_PARTICIPANTS_BY_CHANGE_QUERY,
+                    {'stock_code': int(stock_code), 'first_date_key': date_keys[0], 'last_date_key': date_keys[-1], 'top_n': int(top_n)})]
+
+            # The key lists vary in length and get a placeholder per key, an empty IN () list matches no rows
             response_df = pd.read_sql(
-                sql=PULL_SHAREHOLDING_DATA_QUERY.format(
-                    start_date=start_date.strftime(DATE_BASE_FORMAT),
-                    end_date=end_date.strftime(DATE_BASE_FORMAT),
-                    stock_code=stock_code
+                sql=PULL_PARTICIPANTS_HISTORY_QUERY.format(
+                    date_keys=sql_placeholders(len(date_keys)),
+                    participant_keys=sql_placeholders(len(participant_keys))
                 ),
-                con=con
+                con=con,
+                params=[int(stock_code), *map(int, date_keys), *map(int, participant_keys)]
             )
         return response_df
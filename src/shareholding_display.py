@@ -1,8 +1,12 @@
 import pandas as pd
 from shareholding_data import ShareholdingData
+from transaction_matcher import FINDER_DATA_COLUMNS, match_transactions
 import plotly.express as px
 from config import *
 from utils import *
+from result_cache import get_result_cache
+from trend_figure import build_trend_figure
+from instrumentation import timed
 
 
 logger = logging.getLogger(__name__)
@@ -15,7 +19,8 @@ class ShareholdingDisplay(ShareholdingData):
 
     """
 
-    def __init__(self, start_date: pd.Timestamp, end_date: pd.Timestamp, stock_code: int, threshold_percentage: float) -> None:
+    @timed('display.load_data')
+    def __init__(self, start_date: pd.Timestamp, end_date: pd.Timestamp, stock_code: int, threshold_percentage: float, match_mode: str = TRANSACTION_MATCH_MODE, scrape_missing: bool = True) -> None:
         """ Initialises an instance for a given set of inputs from the Dash application.
 
         Args:
@@ -23,109 +28,221 @@ class ShareholdingDisplay(ShareholdingData):
             end_date (pd.Timestamp): End of the date range.
             stock_code (int): HKEX stock code.
             threshold_percentage (float): Threshold for detecting possible transactions.
+            match_mode (str, optional): Buyer/seller matching mode, see transaction_matcher.match_transactions(). Defaults to TRANSACTION_MATCH_MODE.
+            scrape_missing (bool, optional): If False, missing dates are queued for the background scrape workers
+                instead of being scraped, and only the stored data is displayed. Defaults to True.
 
         """
         self.start_date = start_date
         self.end_date = end_date
         self.stock_code = stock_code
         self.threshold_percentage = threshold_percentage
+        self.match_mode = match_mode
+        self.result_cache = get_result_cache() if USE_RESULT_CACHE else None
+
+        # Missing dates are fetched and stored a chunk at a time. Their rows are only read when .data is used, the
+        # tabs are served from the holding_rankings and holding_deltas tables
+        if not self._check_date_range_stock_data_exists_in_db(start_date, end_date, stock_code).all():
+            for chunk_start_date, chunk_end_date in iter_date_chunks(start_date, end_date, SHAREHOLDING_CHUNK_DAYS):
+                self.fetch_missing_dates(chunk_start_date, chunk_end_date, stock_code, scrape_missing)
+        self.date_requested_map = self.pull_date_requested_map(start_date, end_date, stock_code)
+        self.stock_name = self.date_requested_map.name
+        self.has_data = not self.date_requested_map.empty
+        self.complete = len(self.date_requested_map) == len(pd.date_range(start_date, end_date))
+        self._data = None
+
+    @property
+    def data(self) -> pd.DataFrame:
+        """ Pre-processed shareholding data of the date range, read on first use.
+
+        Cached once all dates are stored, and sliced from a cached frame covering the date range when there is one.
+        The frame has the compact layout of compact_shareholding_data(), see participant_labels() for the labels of
+        its participants.
 
-        # Pull and pre-process shareholding data
-        data = self.pull_shareholding_data(start_date, end_date, stock_code)
-        data = data.drop(columns='date_requested')
-        data = data.sort_values(by=['date', 'participant_id'], ascending=True)
-        data = data.drop_duplicates(
-            subset=['date', 'stock_code', 'participant_id'])
-        data['participant'] = data['participant_id'] + \
-            ': ' + data['participant_name']
-        self.data = data
+        Returns:
+            pd.DataFrame: Shareholding data sorted by date and participant_id.
+
+        """
+        if self._data is not None:
+            return self._data
+
+        cached = self.result_cache.find('data', self.stock_code, lambda cached_start_date, cached_end_date: (
+            cached_start_date <= self.start_date and self.end_date <= cached_end_date)) if self.result_cache else None
+        if cached is None:
+            data, date_requested_map = self._preprocess_shareholding_data(
+                self.read_shareholding_data(self.start_date, self.end_date, self.stock_code))
+            # Frames with dates that are missing (not yet scraped or failed) are not cached, so that the next
+            # request picks them up
+            if self.result_cache and len(date_requested_map) == len(pd.date_range(self.start_date, self.end_date)):
+                self.result_cache.put(
+                    ('data', self.stock_code, self.start_date, self.end_date), (data, date_requested_map))
+        else:
+            (_, _, cached_start_date, cached_end_date), (data, date_requested_map) = cached
+            if (cached_start_date, cached_end_date) != (self.start_date, self.end_date):
+                data, _ = self._slice_shareholding_data(
+                    data, date_requested_map, self.start_date, self.end_date)
+        self._data = data
+        return data
+
+    @staticmethod
+    def _preprocess_shareholding_data(data: pd.DataFrame) -> tuple:
+        """ Sorts, de-duplicates and compacts the output of pull_shareholding_data() for display.
+
+        Args:
+            data (pd.DataFrame): Table of shareholding data.
+
+        Returns:
+            tuple: Pre-processed data, and the dates displayed by the site indexed by date_requested.
+
+        """
+        # Requested dates snapped back to the same trading day are only displayed once
+        date_requested_map = data.drop_duplicates('date_requested').set_index('date_requested')['date']
+        data = data.loc[~data.duplicated(subset=['date', 'stock_code', 'participant_id'])]
+        data = compact_shareholding_data(data.drop(columns='date_requested'))
+        data = data.sort_values(by=['date', 'participant_id'], ascending=True, ignore_index=True)
+        return data, date_requested_map
+
+    @staticmethod
+    def _slice_shareholding_data(data: pd.DataFrame, date_requested_map: pd.Series, start_date: pd.Timestamp, end_date: pd.Timestamp) -> tuple:
+        # Rows of a pre-processed frame displayed for the dates requested within a narrower date range
+        date_requested_map = date_requested_map.loc[
+            start_date.strftime(DATE_BASE_FORMAT):end_date.strftime(DATE_BASE_FORMAT)]
+        dates = pd.to_datetime(date_requested_map.unique(), format=DATE_BASE_FORMAT)
+        return data.loc[data['date'].isin(dates)], date_requested_map
+
+    def _get_cached_tab_data(self, kind: str, generate, *options) -> dict:
+        # Tab payloads are cached per stock, date range and the options they depend on, once all dates are stored
+        if self.result_cache is None or not self.complete:
+            return generate()
+        key = (kind, self.stock_code, self.start_date, self.end_date, *options)
+        tab_data = self.result_cache.get(key)
+        if tab_data is None:
+            tab_data = generate()
+            self.result_cache.put(key, tab_data)
+        return tab_data
 
     def generate_trend_tab_data(self) -> dict:
         """ Generates items for display in the 'Trend Plot' tab.
 
-        Uses a serialisable dictionary for return in order store data in a dcc.Store element.
+        The table stays on the server, and is paged, filtered and sorted by the DataTable callbacks.
 
         Returns:
-            dict: A dictionary containing a Plotly line plot figure and a DataFrame in dictionary format.
+            dict: A dictionary containing a Plotly line plot figure and a DataFrame.
 
         """
-        # Identify top 10 participants as of the end_date
-        data_end_date = self.data.loc[self.data['date'].eq(
-            self.data['date'].max())].reset_index(drop=True).copy(deep=True)
-        top_participants_ids = data_end_date.sort_values(
-            'shareholding', ascending=False).loc[range(10), 'participant_id'].to_list()
-
-        # Filter data to the top 10 participants
-        data_top_participants = self.data.loc[self.data['participant_id'].isin(
-            top_participants_ids)].reset_index(drop=True)
-
-        # 1. Build trend plot of shareholding of top 10 participants
-        trend_fig = px.line(
-            data_frame=data_top_participants,
-            x='date',
-            y='shareholding',
-            color='participant',
-            title=f'Stock: {self.data["stock_name"].mode().iloc[0]} ({self.stock_code}), Shareholding of Top 10 Participants',
-            markers=True,
-            labels={
-                'date': 'Date',
-                'shareholding': 'Shareholding',
-                'participant': 'Participants'
-            }
-        )
-        #trend_fig.show()
+        return self._get_cached_tab_data('trend', self._generate_trend_tab_data)
+
+    def generate_finder_tab_data(self) -> dict:
+        """ Generates items for display in the 'Transaction Finder' tab.
+
+        The table stays on the server, and is paged, filtered and sorted by the DataTable callbacks.
+
+        Returns:
+            dict: A dictionary containing a DataFrame.
+
+        """
+        return self._get_cached_tab_data('finder', self._generate_finder_tab_data, self.threshold_percentage, self.match_mode)
+
+    @timed('display.trend_tab_data')
+    def _generate_trend_tab_data(self) -> dict:
+        # Top participants and their history, looked up in the holding_rankings table
+        data_top_participants = self.pull_top_participants_data(
+            self.start_date, self.end_date, self.stock_code, TREND_TOP_N, TREND_RANK_BY)
+        data_top_participants['participant'] = participant_labels(data_top_participants)
+        ranking = 'Shareholding' if TREND_RANK_BY == 'shareholding' else 'Change in Shareholding'
+
+        # 1. Build trend plot of shareholding of top participants
+        title = f'Stock: {self.stock_name} ({self.stock_code}), Shareholding of Top {TREND_TOP_N} Participants by {ranking}'
+        if TREND_USE_WEBGL:
+            trend_fig = build_trend_figure(data_top_participants, title)
+        else:
+            trend_fig = px.line(
+                data_frame=data_top_participants,
+                x='date',
+                y='shareholding',
+                color='participant',
+                title=title,
+                markers=True,
+                labels={
+                    'date': 'Date',
+                    'shareholding': 'Shareholding',
+                    'participant': 'Participants'
+                }
+            )
 
         # 2. Build table for display
         trend_data = data_top_participants[['date', 'stock_code', 'participant_id',
-                                            'participant_name', 'shareholding', 'pct_total_issued']].drop_duplicates()
+                                            'participant_name', 'shareholding', 'pct_total_issued']]
 
         return {
             'trend_fig': trend_fig,
-            'trend_data_dict': trend_data.to_dict()
+            'trend_data': trend_data
         }
 
-    def generate_finder_tab_data(self) -> dict:
-        """ Generates items for display in the 'Transaction Finder' tab.
+    @timed('display.finder_tab_data')
+    def _generate_finder_tab_data(self) -> dict:
+        potential_transactions = self.find_potential_transactions(
+            self.start_date, self.end_date, self.stock_code, self.threshold_percentage, self.match_mode)
 
-        Uses a serialisable dictionary for return in order store data in a dcc.Store element.
+        return {
+            'potential_transactions': potential_transactions
+        }
 
-        Returns:
-            dict: A dictionary containing a DataFrame in dictionary format.
+    @classmethod
+    def iter_potential_transactions(cls, start_date: pd.Timestamp, end_date: pd.Timestamp, stock_code: int, threshold_percentage: float, match_mode: str = TRANSACTION_MATCH_MODE, chunk_days: int = SHAREHOLDING_CHUNK_DAYS):
+        """ Runs the transaction finder on the stored data of a stock chunk_days at a time, without scraping.
+
+        Changes on the first date of a chunk are against the last date of the previous chunk, as for the whole
+        date range.
+
+        Args:
+            start_date (pd.Timestamp): Start of the date range.
+            end_date (pd.Timestamp): End of the date range.
+            stock_code (int): HKEX stock code.
+            threshold_percentage (float): Threshold for detecting possible transactions.
+            match_mode (str, optional): Buyer/seller matching mode, see transaction_matcher.match_transactions(). Defaults to TRANSACTION_MATCH_MODE.
+            chunk_days (int, optional): Days per chunk. Defaults to SHAREHOLDING_CHUNK_DAYS.
+
+        Yields:
+            pd.DataFrame: Table of potential transactions of a chunk of the date range.
 
         """
-        threshold_proportion = self.threshold_percentage / 100
-
-        # Identify transactions as a shareholding_pct_change >= threshold_proportion
-        finder_data = self.data.copy(deep=True)
-        finder_data['shareholding_diff'] = finder_data.groupby('participant_id')['shareholding'].transform(lambda s: s.diff())
-        finder_data['shareholding_pct_change'] = finder_data.groupby('participant_id')['shareholding'].transform(lambda s: s.pct_change())
-        finder_data['transaction_detected'] = finder_data['shareholding_pct_change'].abs().ge(threshold_proportion)
-
-        # Detect transaction parties
-        # For each day, find parties with inverse changes
-        potential_transactions_concat_list = []
-        for _, date_df in finder_data.loc[finder_data['transaction_detected']].groupby('date'):
-            # Loop through net buyers
-            for _, buyer_row in date_df.loc[date_df['shareholding_diff'].gt(0)].iterrows():
-                # Loop through net sellers with the opposite shareholding_diff
-                for _, seller_row in date_df.loc[date_df['shareholding_diff'].eq(-1 * buyer_row['shareholding_diff'])].iterrows():
-                    output = {
-                        'date': buyer_row['date'],
-                        'stock_code': buyer_row['stock_code'],
-                        'buyer_id': buyer_row['participant_id'],
-                        'buyer_name': buyer_row['participant_name'],
-                        'seller_id' : seller_row['participant_id'],
-                        'seller_name': seller_row['participant_name'],
-                        'quantity': buyer_row['shareholding_diff'],
-                        'buyer_pct_change': np.round(100 * buyer_row['shareholding_pct_change'], 5),
-                        'seller_pct_change': np.round(100 * buyer_row['shareholding_pct_change'], 5),
-                        'buyer_shareholding': buyer_row['shareholding'],
-                        'seller_shareholding': seller_row['shareholding']
-                    }
-                    potential_transactions_concat_list.append(output)
-
-        potential_transactions = pd.DataFrame(potential_transactions_concat_list)
+        threshold_proportion = threshold_percentage / 100
+        # match_group numbers restart with each chunk, and are offset to stay unique across the date range
+        n_match_groups = 0
+        for chunk_start_date, chunk_end_date in iter_date_chunks(start_date, end_date, chunk_days):
+            # Identify transactions as a shareholding_pct_change >= threshold_proportion, precomputed at ingest
+            finder_data = cls.pull_transaction_finder_data(
+                chunk_start_date, chunk_end_date, stock_code, threshold_proportion, range_start_date=start_date)
+
+            # Detect transaction parties
+            # For each day, match net buyers with net sellers of the opposite shareholding_diff
+            potential_transactions = match_transactions(finder_data, mode=match_mode)
+            if 'match_group' in potential_transactions and len(potential_transactions):
+                potential_transactions['match_group'] += n_match_groups
+                n_match_groups = int(potential_transactions['match_group'].max()) + 1
+            yield potential_transactions
+
+    @classmethod
+    def find_potential_transactions(cls, start_date: pd.Timestamp, end_date: pd.Timestamp, stock_code: int, threshold_percentage: float, match_mode: str = TRANSACTION_MATCH_MODE) -> pd.DataFrame:
+        """ Runs the transaction finder on the stored data of a stock, without scraping.
 
-        return {
-            'potential_transactions_dict': potential_transactions.to_dict()
-        }
+        Args:
+            start_date (pd.Timestamp): Start of the date range.
+            end_date (pd.Timestamp): End of the date range.
+            stock_code (int): HKEX stock code.
+            threshold_percentage (float): Threshold for detecting possible transactions.
+            match_mode (str, optional): Buyer/seller matching mode, see transaction_matcher.match_transactions(). Defaults to TRANSACTION_MATCH_MODE.
+
+        Returns:
+            pd.DataFrame: Table of potential transactions.
+
+        """
+        chunks = list(cls.iter_potential_transactions(
+            start_date, end_date, stock_code, threshold_percentage, match_mode))
+        if not chunks:
+            # A start_date after end_date has no chunk, return the empty table of the match mode
+            return match_transactions(pd.DataFrame(columns=FINDER_DATA_COLUMNS), mode=match_mode)
+        # Chunks without any stored date are empty frames of object columns, which would upcast the others
+        chunks = [chunk for chunk in chunks if len(chunk)] or chunks[:1]
+        return pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
@@ -0,0 +1,331 @@
+import atexit
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from utils import *
+from queries import *
+from config import *
+
+
+logger = logging.getLogger(__name__)
+
+# Queue key of scraped shareholding frames, which are normalised by the writer rather than run as a statement
+SHAREHOLDING_FRAMES = 'shareholding_frames'
+
+
+def is_busy_error(error: Exception) -> bool:
+    # Whether a write failed because another connection held the database lock for longer than the busy timeout
+    return isinstance(error, sqlite3.OperationalError) and ('locked' in str(error) or 'busy' in str(error))
+
+
+def update_holding_deltas(con, stock_dates: set) -> None:
+    """ Recomputes the holding_deltas rows of the given dates, and of the next stored date of each stock.
+
+    Holdings are append-only by date, so a new date only changes its own deltas and those of the next date
+    (when an earlier gap is filled in).
+
+    Args:
+        con (sqlite3.Connection): Connection within the transaction that wrote the holdings.
+        stock_dates (set): (stock_code, date_key) pairs whose holdings were written.
+
+    """
+    stale_stock_dates = set(stock_dates)
+    for stock_code, date_key in stock_dates:
+        next_date_key = con.execute(
+            PULL_NEXT_HOLDING_DATE_QUERY, (stock_code, date_key)).fetchone()[0]
+        if next_date_key is not None:
+            stale_stock_dates.add((stock_code, next_date_key))
+
+    for stock_code, date_key in stale_stock_dates:
+        params = {
+            'stock_code': stock_code,
+            'date_key': date_key,
+            'prev_date_key': con.execute(PULL_PREV_HOLDING_DATE_QUERY, (stock_code, date_key)).fetchone()[0]
+        }
+        con.execute(DELETE_HOLDING_DELTAS_QUERY, params)
+        con.execute(INSERT_HOLDING_DELTAS_QUERY, params)
+        if params['prev_date_key'] is not None:
+            con.execute(INSERT_LEAVING_HOLDING_DELTAS_QUERY, params)
+
+
+def update_holding_rankings(con, stock_dates: set, depth: int = HOLDING_RANKINGS_DEPTH) -> None:
+    """ Recomputes the holding_rankings rows of the given dates.
+
+    Args:
+        con (sqlite3.Connection): Connection within the transaction that wrote the holdings.
+        stock_dates (set): (stock_code, date_key) pairs whose holdings were written.
+        depth (int, optional): Number of ranked holders per date. Defaults to HOLDING_RANKINGS_DEPTH.
+
+    """
+    for stock_code, date_key in stock_dates:
+        params = {'stock_code': stock_code, 'date_key': date_key, 'depth': depth}
+        con.execute(DELETE_HOLDING_RANKINGS_QUERY, params)
+        con.execute(INSERT_HOLDING_RANKINGS_QUERY, params)
+
+
+class ShareholdingWriter:
+    """ Single writer thread for the shareholding database.
+
+    Scraper threads submit parsed rows to a queue instead of opening their own connections. The writer thread
+    buffers them and commits in large executemany batches, so writes never contend for the SQLite lock.
+    Scraped pages are normalised into the stocks, participants, scrape_dates and holdings tables on the way, and
+    the holding_deltas and holding_rankings of the dates they affect are recomputed in the same transaction.
+    Submissions are committed in order. Each returns a Future, resolved when its batch is committed or has failed,
+    so that a failure is reported to the submitters whose rows were lost.
+
+    """
+
+    def __init__(
+        self,
+        db_path: str = SHAREHOLDING_DATA_DB_PATH,
+        batch_rows: int = DB_WRITER_BATCH_ROWS,
+        flush_interval_seconds: float = DB_WRITER_FLUSH_INTERVAL_SECONDS,
+        queue_max_size: int = DB_WRITER_QUEUE_MAX_SIZE,
+        commit_retries: int = DB_WRITER_COMMIT_RETRIES,
+        commit_retry_backoff_seconds: float = DB_WRITER_COMMIT_RETRY_BACKOFF_SECONDS
+    ) -> None:
+        self.db_path = db_path
+        self.batch_rows = batch_rows
+        self.flush_interval_seconds = flush_interval_seconds
+        self.commit_retries = commit_retries
+        self.commit_retry_backoff_seconds = commit_retry_backoff_seconds
+        # Bounded so that scrapers are slowed down rather than buffering without limit
+        self.queue = queue.Queue(maxsize=queue_max_size)
+        self.thread = None
+        self.lock = threading.Lock()
+        # (participant_id, participant_name) -> participant_key, only used by the writer thread
+        self.participant_keys = None
+        self.commit_listeners = []
+
+    def start(self) -> None:
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self._run, name='ShareholdingWriter', daemon=True)
+                self.thread.start()
+
+    def add_commit_listener(self, listener) -> None:
+        """ Registers a callback run by the writer thread after each commit of shareholding data.
+
+        Listeners run before pending flush() calls return, so readers see their effects after flushing.
+
+        Args:
+            listener (callable): Called with the set of committed (stock_code, date_requested_key) pairs.
+
+        """
+        self.commit_listeners.append(listener)
+
+    def submit(self, sql: str, rows: list, after: list = ()) -> Future:
+        """ Queues rows to be written with an executemany() of sql.
+
+        Args:
+            sql (str): Parameterised statement.
+            rows (list): Parameter tuples.
+            after (list, optional): Futures of earlier submissions the rows depend on, e.g. the scraped rows of a
+                job whose outcome they record. When one of them has failed, the rows are not written and fail
+                with the same error. Defaults to ().
+
+        Returns:
+            Future: Resolved when the rows are committed, or set to the error of their failed batch.
+
+        """
+        self.start()
+        written = Future()
+        self.queue.put((sql, rows, written, list(after)))
+        return written
+
+    def submit_shareholding(self, df: pd.DataFrame) -> Future:
+        """ Queues scraped shareholding data.
+
+        Args:
+            df (pd.DataFrame): Rows with the columns date_requested, date, stock_code, stock_name, participant_id,
+                participant_name, shareholding and pct_total_issued.
+
+        Returns:
+            Future: Resolved when the rows are committed, or set to the error of their failed batch.
+
+        """
+        return self.submit(SHAREHOLDING_FRAMES, [df])
+
+    def flush(self, timeout: float = None) -> None:
+        """ Blocks until everything submitted so far has been committed.
+
+        Args:
+            timeout (float, optional): Maximum seconds to wait. Defaults to None (no limit).
+
+        Raises:
+            RuntimeError: When the batch committed by this flush failed. Failures of earlier batches are reported
+                to the Futures of their submissions instead.
+
+        """
+        if self.thread is None:
+            return
+        committed = Future()
+        self.queue.put(committed)
+        try:
+            error = committed.exception(timeout)
+        except TimeoutError:
+            raise TimeoutError(f'Writer did not flush within {timeout}s')
+        if error is not None:
+            raise RuntimeError(f'Failed to write to database: {error}')
+
+    def _get_participant_keys(self, con, participants: pd.DataFrame) -> list:
+        # Looks up (and creates when new) the participant_key of each (participant_id, participant_name)
+        if self.participant_keys is None:
+            self.participant_keys = {
+                (participant_id, participant_name): participant_key
+                for participant_id, participant_name, participant_key in con.execute(PULL_PARTICIPANT_KEYS_QUERY)
+            }
+
+        participant_tuples = list(participants.itertuples(index=False, name=None))
+        for participant in set(participant_tuples) - self.participant_keys.keys():
+            con.execute(INSERT_PARTICIPANT_QUERY, participant)
+            # Another process may have created the participant, so read the key back rather than using lastrowid
+            self.participant_keys[participant] = con.execute(
+                PULL_PARTICIPANT_KEY_QUERY, participant).fetchone()[0]
+        return [self.participant_keys[participant] for participant in participant_tuples]
+
+    def _write_shareholding(self, con, frames: list) -> set:
+        df = pd.concat(frames, ignore_index=True)
+        df[['participant_id', 'participant_name']] = df[[
+            'participant_id', 'participant_name']].fillna('')
+
+        stocks = df.drop_duplicates('stock_code', keep='last')
+        con.executemany(UPSERT_STOCK_QUERY, stocks[[
+            'stock_code', 'stock_name']].itertuples(index=False, name=None))
+
+        df['participant_key'] = self._get_participant_keys(
+            con, df[['participant_id', 'participant_name']])
+        df['date_requested_key'] = dates_to_keys(df['date_requested'])
+        df['date_key'] = dates_to_keys(df['date'])
+
+        scrape_dates = df[['stock_code', 'date_requested_key',
+                           'date_key']].drop_duplicates()
+        con.executemany(INSERT_SCRAPE_DATE_QUERY,
+                        scrape_dates.itertuples(index=False, name=None))
+        # Requested dates displayed as an earlier date are non-trading dates, unless they are today's date (whose
+        # data may not have been published yet)
+        non_trading_dates = scrape_dates.loc[scrape_dates['date_key'].lt(scrape_dates['date_requested_key']) &
+                                             scrape_dates['date_requested_key'].lt(date_to_key(pd.Timestamp.today()))]
+        con.executemany(INSERT_NON_TRADING_DATE_QUERY, non_trading_dates[[
+            'date_requested_key', 'date_key']].drop_duplicates('date_requested_key').itertuples(index=False, name=None))
+        # Pages requested for a non-trading day repeat the previous trading day, and are stored once
+        holdings = df[['stock_code', 'date_key', 'participant_key', 'shareholding', 'pct_total_issued']].drop_duplicates(
+            subset=['stock_code', 'date_key', 'participant_key'], keep='last')
+        con.executemany(INSERT_HOLDING_QUERY,
+                        holdings.itertuples(index=False, name=None))
+        written_stock_dates = set(holdings[['stock_code', 'date_key']].drop_duplicates().itertuples(
+            index=False, name=None))
+        con.executemany(BUMP_STOCK_MONTH_GENERATIONS_QUERY, [
+            {'stock_code': stock_code, 'date_key': date_key} for stock_code, date_key in written_stock_dates])
+        update_holding_deltas(con, written_stock_dates)
+        update_holding_rankings(con, written_stock_dates)
+        return set(scrape_dates[['stock_code', 'date_requested_key']].itertuples(index=False, name=None))
+
+    def _commit(self, pending: list) -> Exception:
+        # Commits the batch in one transaction, retrying when the database is locked. Returns the error of a
+        # failed batch, or None
+        if not pending:
+            return None
+        n_rows = sum(sum(len(row) for row in rows) if sql == SHAREHOLDING_FRAMES else len(rows)
+                     for sql, rows in pending)
+        for attempt in range(self.commit_retries + 1):
+            started_at = time.perf_counter()
+            committed_stock_dates = set()
+            try:
+                with timed('db.commit', rows=n_rows), connect_db(self.db_path) as con:
+                    for sql, rows in pending:
+                        if sql == SHAREHOLDING_FRAMES:
+                            committed_stock_dates |= self._write_shareholding(
+                                con, rows)
+                        else:
+                            con.executemany(sql, rows)
+                logger.debug(
+                    f'Committed {n_rows} rows in {time.perf_counter() - started_at:.3f}s.')
+                break
+            except Exception as e:
+                # Keys created in the rolled back transaction are no longer valid
+                self.participant_keys = None
+                if is_busy_error(e) and attempt < self.commit_retries:
+                    backoff_seconds = self.commit_retry_backoff_seconds * 2 ** attempt
+                    logger.warning(f'Failed to commit {n_rows} rows: {e}. Retrying in {backoff_seconds}s.')
+                    time.sleep(backoff_seconds)
+                    continue
+                logger.error(f'Failed to commit {n_rows} rows: {e}')
+                return e
+
+        if committed_stock_dates:
+            for listener in self.commit_listeners:
+                try:
+                    listener(committed_stock_dates)
+                except Exception as e:
+                    logger.error(f'Commit listener {listener} failed: {e}')
+        return None
+
+    def _run(self) -> None:
+        pending = []
+        pending_rows = 0
+        # Futures of the pending submissions, and of the flush() calls waiting for them
+        pending_futures = []
+        flush_futures = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(
+                deadline - time.monotonic(), 0)
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if isinstance(item, Future):
+                flush_futures.append(item)
+            elif item is not None:
+                sql, rows, written, after = item
+                # Submissions are committed in order, so the submissions they depend on are either in the pending
+                # batch (and fail with it) or already resolved
+                failed_after = next((future for future in after if future.done() and future.exception()), None)
+                if failed_after is not None:
+                    written.set_exception(failed_after.exception())
+                else:
+                    pending_futures.append(written)
+                    # Consecutive submissions of the same statement (or of shareholding frames) are merged
+                    if pending and pending[-1][0] == sql:
+                        pending[-1][1].extend(rows)
+                    else:
+                        pending.append((sql, list(rows)))
+                    pending_rows += sum(len(row) for row in rows) if sql == SHAREHOLDING_FRAMES else len(rows)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_interval_seconds
+
+            # Commit when the batch is full, the flush interval has passed or a flush was requested
+            if flush_futures or pending_rows >= self.batch_rows or (deadline is not None and time.monotonic() >= deadline):
+                error = self._commit(pending)
+                for future in pending_futures + flush_futures:
+                    if error is None:
+                        future.set_result(None)
+                    else:
+                        future.set_exception(error)
+                pending, pending_rows, pending_futures, flush_futures, deadline = [], 0, [], [], None
+
+
+# Process-wide writer shared by the scrapers of the Dash app and prepopulate_db
+_shareholding_writer = None
+_shareholding_writer_lock = threading.Lock()
+
+
+def get_shareholding_writer() -> ShareholdingWriter:
+    """ Returns the process-wide ShareholdingWriter, creating it on first use.
+
+    Returns:
+        ShareholdingWriter: Shared database writer.
+
+    """
+    global _shareholding_writer
+    with _shareholding_writer_lock:
+        if _shareholding_writer is None:
+            _shareholding_writer = ShareholdingWriter()
+            # Commit whatever is still buffered when the process exits
+            atexit.register(_shareholding_writer.flush)
+        return _shareholding_writer
@@ -0,0 +1,171 @@
+import argparse
+import threading
+import time
+from utils import *
+from shareholding_writer import get_shareholding_writer
+from queries import *
+from config import *
+
+
+logger = logging.getLogger(__name__)
+
+
+class UnavailableStockCodes:
+    """ Registry of stock codes that the CCASS search site reported as unavailable.
+
+    Backed by the unavailable_stock_codes table, so it is shared by the Dash app, the scrape job workers and
+    prepopulate_db.py, and survives restarts. Lookups hit an in-memory set reloaded every refresh_seconds.
+    A code expires once it hasn't been checked for recheck_days, so that newly listed stock codes get probed again.
+
+    """
+
+    def __init__(self, recheck_days: float = UNAVAILABLE_STOCK_CODE_RECHECK_DAYS, refresh_seconds: float = UNAVAILABLE_STOCK_CODES_REFRESH_SECONDS) -> None:
+        self.recheck_seconds = recheck_days * 24 * 3600
+        self.refresh_seconds = refresh_seconds
+        self.stock_codes = set()
+        self.loaded_at = None
+        self.lock = threading.Lock()
+
+    def _refresh(self) -> None:
+        with self.lock:
+            if self.loaded_at is not None and time.monotonic() - self.loaded_at < self.refresh_seconds:
+                return
+            with connect_db() as con:
+                self.stock_codes = {stock_code for stock_code, in con.execute(
+                    PULL_UNAVAILABLE_STOCK_CODES_QUERY, (time.time() - self.recheck_seconds,))}
+            self.loaded_at = time.monotonic()
+
+    def __contains__(self, stock_code: int) -> bool:
+        self._refresh()
+        return int(stock_code) in self.stock_codes
+
+    def get_stock_codes(self) -> set:
+        """ Returns the stock codes currently considered unavailable.
+
+        Returns:
+            set: Unexpired unavailable stock codes.
+
+        """
+        self._refresh()
+        return set(self.stock_codes)
+
+    def add(self, stock_code: int, source: str = 'scrape') -> None:
+        """ Records stock_code as unavailable, keeping its first_seen time if already registered.
+
+        Args:
+            stock_code (int): HKEX stock code.
+            source (str, optional): What found the code unavailable. Defaults to 'scrape'.
+
+        """
+        now = time.time()
+        get_shareholding_writer().submit(UPSERT_UNAVAILABLE_STOCK_CODE_QUERY, [
+            (int(stock_code), now, now, source)])
+        with self.lock:
+            self.stock_codes.add(int(stock_code))
+
+    def discard(self, stock_code: int) -> None:
+        # Called when data was scraped for stock_code, e.g. after its re-check
+        self._refresh()
+        with self.lock:
+            if int(stock_code) not in self.stock_codes:
+                return
+            self.stock_codes.discard(int(stock_code))
+        get_shareholding_writer().submit(DELETE_UNAVAILABLE_STOCK_CODE_QUERY, [(int(stock_code),)])
+
+    def invalidate(self) -> None:
+        # Reload the registry on next use
+        with self.lock:
+            self.loaded_at = None
+
+
+def read_listed_stock_codes(path: str, column: str = LISTED_SECURITIES_STOCK_CODE_COLUMN) -> set:
+    """ Reads the stock codes of a listed securities file, e.g. HKEX's ListOfSecurities.xlsx.
+
+    The header row is located by column, so title rows above it (as in the HKEX file) are skipped.
+    Reading .xlsx files requires openpyxl.
+
+    Args:
+        path (str): CSV or Excel file.
+        column (str, optional): Header of the stock code column. Defaults to LISTED_SECURITIES_STOCK_CODE_COLUMN.
+
+    Returns:
+        set: Listed stock codes.
+
+    """
+    raw_df = pd.read_csv(path, header=None, dtype=str) if path.endswith('.csv') else pd.read_excel(
+        path, header=None, dtype=str)
+    header_rows = raw_df.index[(raw_df.apply(lambda row: row.str.strip()) == column).any(axis=1)]
+    if not len(header_rows):
+        raise ValueError(f'No "{column}" column found in {path}.')
+    header_row = header_rows[0]
+    stock_code_column = raw_df.loc[header_row][raw_df.loc[header_row].str.strip() == column].index[0]
+    stock_codes = pd.to_numeric(raw_df.loc[header_row + 1:, stock_code_column], errors='coerce').dropna()
+    return set(stock_codes.astype(int).tolist())
+
+
+def seed_unavailable_stock_codes(path: str, stock_code_range: list = PREPOPULATE_STOCK_CODE_RANGE) -> int:
+    """ Marks the stock codes of stock_code_range missing from a listed securities file as unavailable.
+
+    Listed codes are removed from the registry. Seeded codes expire like scraped ones, so seed again from a
+    recent file before each backfill.
+
+    Args:
+        path (str): CSV or Excel file, see read_listed_stock_codes().
+        stock_code_range (list, optional): Stock codes to seed. Defaults to PREPOPULATE_STOCK_CODE_RANGE.
+
+    Returns:
+        int: Number of stock codes marked as unavailable.
+
+    """
+    initialise_shareholding_db()
+    listed_stock_codes = read_listed_stock_codes(path)
+    now = time.time()
+    writer = get_shareholding_writer()
+    writer.submit(DELETE_UNAVAILABLE_STOCK_CODE_QUERY, [
+        (int(stock_code),) for stock_code in stock_code_range if stock_code in listed_stock_codes])
+    unavailable_rows = [(int(stock_code), now, now, 'listed_securities')
+                        for stock_code in stock_code_range if stock_code not in listed_stock_codes]
+    writer.submit(UPSERT_UNAVAILABLE_STOCK_CODE_QUERY, unavailable_rows)
+    writer.flush()
+    get_unavailable_stock_codes().invalidate()
+    logger.info(f'{len(listed_stock_codes)} listed stock codes read from {path}, '
+                f'{len(unavailable_rows)} stock codes marked as unavailable.')
+    return len(unavailable_rows)
+
+
+# Process-wide registry
+_unavailable_stock_codes = None
+_unavailable_stock_codes_lock = threading.Lock()
+
+
+def get_unavailable_stock_codes() -> UnavailableStockCodes:
+    """ Returns the process-wide UnavailableStockCodes registry, creating it on first use.
+
+    Returns:
+        UnavailableStockCodes: Shared registry.
+
+    """
+    global _unavailable_stock_codes
+    with _unavailable_stock_codes_lock:
+        if _unavailable_stock_codes is None:
+            _unavailable_stock_codes = UnavailableStockCodes()
+        return _unavailable_stock_codes
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Seed or inspect the registry of unavailable stock codes.')
+    parser.add_argument('--seed', metavar='PATH',
+                        help='Listed securities file (CSV or Excel, e.g. HKEX ListOfSecurities.xlsx). '
+                        'Codes of PREPOPULATE_STOCK_CODE_RANGE missing from it are marked as unavailable.')
+    args = parser.parse_args()
+
+    if args.seed:
+        seed_unavailable_stock_codes(args.seed)
+
+    initialise_shareholding_db()
+    with connect_db() as con:
+        summary_rows = con.execute(PULL_UNAVAILABLE_STOCK_CODES_SUMMARY_QUERY, (
+            time.time() - UNAVAILABLE_STOCK_CODE_RECHECK_DAYS * 24 * 3600,)).fetchall()
+    for source, n_stock_codes, n_unexpired in summary_rows:
+        logger.info(f'source={source}: {n_stock_codes} unavailable stock codes, {n_unexpired} not yet due for re-check.')
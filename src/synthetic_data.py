@@ -0,0 +1,134 @@
+import pandas as pd
+import numpy as np
+from config import *
+
+
+logger = logging.getLogger(__name__)
+
+
+def generate_synthetic_shareholding_data(n_participants: int, n_days: int, stock_code: int = 1, transfers_per_day: int = 20, seed: int = 0, start_date: pd.Timestamp = pd.Timestamp('2022-01-01'), freq: str = 'D', stock_name: str = 'SYNTHETIC') -> pd.DataFrame:
+    """ Generates shareholding data in the shape of ShareholdingDisplay.data.
+
+    Each day, transfers_per_day buyer/seller pairs exchange part of the seller's holding, and a few other
+    participants change their holding without a counterparty.
+
+    Args:
+        n_participants (int): Number of participants.
+        n_days (int): Number of dates.
+        stock_code (int, optional): Stock code of the rows. Defaults to 1.
+        transfers_per_day (int, optional): Matched transfers per day, at most half of the participants.
+            Defaults to 20.
+        seed (int, optional): Random seed. Defaults to 0.
+        start_date (pd.Timestamp, optional): First date. Defaults to 2022-01-01.
+        freq (str, optional): Frequency of the dates, e.g. 'B' for weekdays only. Defaults to 'D'.
+        stock_name (str, optional): Stock name of the rows. Defaults to 'SYNTHETIC'.
+
+    Returns:
+        pd.DataFrame: Shareholding data sorted by date and participant_id.
+
+    """
+    rng = np.random.default_rng(seed)
+    transfers_per_day = min(transfers_per_day, n_participants // 2)
+    shareholding = np.empty((n_days, n_participants), dtype=np.int64)
+    shareholding[0] = rng.lognormal(mean=13, sigma=2, size=n_participants).astype(np.int64) + 1000
+    for day in range(1, n_days):
+        holdings = shareholding[day - 1].copy()
+        parties = rng.choice(n_participants, size=(transfers_per_day, 2), replace=False)
+        sellers, buyers = parties[:, 0], parties[:, 1]
+        quantities = (holdings[sellers] * rng.uniform(0.05, 0.5, transfers_per_day)).astype(np.int64)
+        holdings[sellers] -= quantities
+        holdings[buyers] += quantities
+        # Unmatched changes
+        movers = rng.choice(n_participants, size=transfers_per_day, replace=False)
+        holdings[movers] += rng.integers(1, 1000, transfers_per_day)
+        shareholding[day] = holdings
+
+    dates = pd.date_range(start=start_date, periods=n_days, freq=freq).strftime(DATE_BASE_FORMAT)
+    participant_ids = np.array([f'C{i:05d}' for i in range(n_participants)])
+    data = pd.DataFrame({
+        'date': np.repeat(dates, n_participants),
+        'stock_code': stock_code,
+        'stock_name': stock_name,
+        'participant_id': np.tile(participant_ids, n_days),
+        'participant_name': np.tile(np.char.add('PARTICIPANT ', participant_ids), n_days),
+        'shareholding': shareholding.ravel(),
+    })
+    data['pct_total_issued'] = np.round(100 * data['shareholding'] / shareholding.sum(axis=1).max(), 2)
+    data['participant'] = data['participant_id'] + ': ' + data['participant_name']
+    return data
+
+
+class SyntheticCCASSDataset:
+    """ Synthetic CCASS shareholding of several stocks over a date range, as served by mock_ccass_site.py.
+
+    Weekdays are trading dates. Like the real search page, a request for any other date within the range gets the
+    data of the latest trading date before it.
+
+    """
+
+    def __init__(self, stock_codes: list, n_participants: int, n_days: int, start_date: pd.Timestamp = pd.Timestamp('2022-01-03'), seed: int = 0) -> None:
+        """ Generates the data of every stock.
+
+        Args:
+            stock_codes (list): Stock codes.
+            n_participants (int): Number of participants of each stock.
+            n_days (int): Number of calendar days of the date range.
+            start_date (pd.Timestamp, optional): First date of the range. Defaults to 2022-01-03 (a Monday).
+            seed (int, optional): Random seed, offset by the stock code for each stock. Defaults to 0.
+
+        Raises:
+            ValueError: When the date range has no trading date.
+
+        """
+        self.start_date = pd.Timestamp(start_date)
+        self.end_date = self.start_date + pd.Timedelta(days=n_days - 1)
+        self.trading_dates = pd.bdate_range(self.start_date, self.end_date)
+        if self.trading_dates.empty:
+            raise ValueError(f'No trading date between {self.start_date.date()} and {self.end_date.date()}.')
+
+        # stock_code -> (stock_name, date -> rows of the date sorted by shareholding as on the site)
+        self.stocks = {}
+        for stock_code in stock_codes:
+            stock_name = f'SYNTHETIC {stock_code}'
+            data = generate_synthetic_shareholding_data(
+                n_participants, len(self.trading_dates), stock_code, seed=seed + stock_code,
+                start_date=self.start_date, freq='B', stock_name=stock_name)
+            data = data[['date', 'participant_id', 'participant_name', 'shareholding', 'pct_total_issued']]
+            self.stocks[stock_code] = (stock_name, {
+                pd.Timestamp(date): date_df.drop(columns='date').sort_values(
+                    'shareholding', ascending=False, kind='mergesort').reset_index(drop=True)
+                for date, date_df in data.groupby('date')
+            })
+
+    def __contains__(self, stock_code: int) -> bool:
+        return stock_code in self.stocks
+
+    def get_trading_date(self, date: pd.Timestamp) -> pd.Timestamp:
+        """ Returns the date displayed when asked for date.
+
+        Args:
+            date (pd.Timestamp): Requested date.
+
+        Returns:
+            pd.Timestamp: Latest trading date on or before date, or None when date is outside the date range.
+
+        """
+        date = pd.Timestamp(date)
+        if not self.start_date <= date <= self.end_date:
+            return None
+        return self.trading_dates[self.trading_dates.searchsorted(date, side='right') - 1]
+
+    def get_shareholding(self, trading_date: pd.Timestamp, stock_code: int) -> tuple:
+        """ Returns the stock name and the rows of a trading date.
+
+        Args:
+            trading_date (pd.Timestamp): Trading date, see get_trading_date().
+            stock_code (int): Stock code.
+
+        Returns:
+            tuple: Stock name, and a DataFrame with the columns participant_id, participant_name, shareholding and
+                pct_total_issued.
+
+        """
+        stock_name, frames = self.stocks[stock_code]
+        return stock_name, frames[pd.Timestamp(trading_date)]
@@ -0,0 +1,21 @@
+import os
+import sys
+import pytest
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES_DIR = os.path.join(SRC_DIR, 'tests', 'fixtures')
+
+# Modules are imported from src and config.py paths are relative to it, as when the app is run
+sys.path.insert(0, SRC_DIR)
+os.chdir(SRC_DIR)
+
+
+@pytest.fixture
+def fixtures_dir() -> str:
+    # Saved CCASS search pages, named <stock_code>_<requested date YYYYMMDD>.html as served by mock_ccass_site.py
+    return FIXTURES_DIR
+
+
+def read_fixture(name: str) -> str:
+    with open(os.path.join(FIXTURES_DIR, name), encoding='utf-8') as f:
+        return f.read()
@@ -0,0 +1,46 @@
+import functools
+import os
+import pandas as pd
+import pytest
+import columnar_cache
+import utils
+from columnar_cache import ColumnarCache
+from shareholding_writer import ShareholdingWriter
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch) -> str:
+    # Scratch database in place of output/shareholding.db
+    db_path = str(tmp_path / 'shareholding.db')
+    scratch_connect_db = functools.partial(utils.connect_db, db_path=db_path)
+    monkeypatch.setattr(utils, 'connect_db', scratch_connect_db)
+    monkeypatch.setattr(columnar_cache, 'connect_db', scratch_connect_db)
+    utils.initialise_shareholding_db()
+    return db_path
+
+
+def scraped_page(date: str, shareholding: int) -> pd.DataFrame:
+    return pd.DataFrame({
+        'date_requested': [date], 'date': [date], 'stock_code': [1], 'stock_name': ['CKH HOLDINGS'],
+        'participant_id': ['C00019'], 'participant_name': ['HSBC'], 'shareholding': [shareholding],
+        'pct_total_issued': [1.0]
+    })
+
+
+def test_partitions_skip_empty_months_and_detect_rewritten_dates(db_path, tmp_path):
+    # The writer has no commit listener, as when another process writes
+    writer = ShareholdingWriter(db_path=db_path)
+    writer.submit_shareholding(scraped_page('2022-09-02', 100))
+    writer.flush()
+
+    cache = ColumnarCache(cache_dir=str(tmp_path / 'columnar'))
+    start_date, end_date = pd.Timestamp('2022-08-01'), pd.Timestamp('2022-09-30')
+    assert cache.read(start_date, end_date, 1)['shareholding'].tolist() == [100]
+    assert os.listdir(tmp_path / 'columnar' / '1') == ['2022-09.arrow']
+    assert cache.read(start_date, end_date, 2).empty
+    assert not os.path.exists(tmp_path / 'columnar' / '2')
+
+    # A re-scrape replaces the holdings of a stored date without adding a date
+    writer.submit_shareholding(scraped_page('2022-09-02', 200))
+    writer.flush()
+    assert cache.read(start_date, end_date, 1)['shareholding'].tolist() == [200]
@@ -0,0 +1,95 @@
+import io
+import threading
+from urllib.parse import parse_qs
+import pandas as pd
+import pytest
+from mock_ccass_site import run_mock_ccass_site
+from scrapers import HttpScraper, StockCodeUnavailableError, get_http_session, parse_search_result_page
+from conftest import FIXTURES_DIR
+from test_parse_search_result_page import RESULT_PAGES
+
+
+@pytest.fixture(scope='module')
+def mock_site():
+    # Mock CCASS site serving the saved pages on a free port, recording the client port and form of every POST
+    server = run_mock_ccass_site(FIXTURES_DIR, port=0)
+    posts = []
+
+    class RecordingHandler(server.RequestHandlerClass):
+        def do_POST(self) -> None:
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            posts.append((self.client_address[1], {key: values[0] for key, values in parse_qs(body.decode('utf-8')).items()}))
+            # The handler reads the form again, then the next request of the connection from the socket
+            rfile, self.rfile = self.rfile, io.BytesIO(body)
+            try:
+                super().do_POST()
+            finally:
+                self.rfile = rfile
+
+    server.RequestHandlerClass = RecordingHandler
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}/', posts
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize('date, stock_code, name', [
+    (pd.Timestamp('2022-09-02'), 1, '1_20220902.html'),
+    (pd.Timestamp('2022-09-04'), 5, '5_20220904.html'),
+    (pd.Timestamp('2022-09-02'), 8, '8_20220902.html'),
+])
+def test_search_returns_result_page(mock_site, date, stock_code, name):
+    search_url, _ = mock_site
+    with HttpScraper(search_url=search_url, fallback_to_selenium=False) as scraper:
+        date_hkex, stock_name, df = parse_search_result_page(scraper.search(date, stock_code))
+    expected_date_hkex, expected_stock_name, expected_df = RESULT_PAGES[name]
+    assert (date_hkex, stock_name) == (expected_date_hkex, expected_stock_name)
+    pd.testing.assert_frame_equal(df, expected_df)
+
+
+def test_search_carries_over_aspnet_state(mock_site):
+    search_url, posts = mock_site
+    del posts[:]
+    with HttpScraper(search_url=search_url, fallback_to_selenium=False) as scraper:
+        scraper.search(pd.Timestamp('2022-09-02'), 1)
+        scraper.search(pd.Timestamp('2022-09-04'), 5)
+
+    (_, first_form), (_, second_form) = posts
+    # The first search posts the state of the search form, the next one the state of the previous result page
+    assert first_form['__VIEWSTATE'] == 'fixture-viewstate-form'
+    assert first_form['__EVENTVALIDATION'] == 'fixture-eventvalidation-form'
+    assert second_form['__VIEWSTATE'] == 'fixture-viewstate-1-20220902'
+    assert second_form['__EVENTVALIDATION'] == 'fixture-eventvalidation-1-20220902'
+    assert second_form['__VIEWSTATEGENERATOR'] == '3B50BBBD'
+    assert second_form['__EVENTTARGET'] == 'btnSearch'
+    assert (second_form['txtShareholdingDate'], second_form['txtStockCode']) == ('2022/09/04', '00005')
+
+
+@pytest.mark.parametrize('stock_code', [
+    # Saved alert page, and a stock code without a saved page, for which the mock site returns the same alert
+    99999, 2
+])
+def test_search_raises_for_unavailable_stock_code(mock_site, stock_code):
+    search_url, posts = mock_site
+    with HttpScraper(search_url=search_url, fallback_to_selenium=False) as scraper:
+        with pytest.raises(StockCodeUnavailableError):
+            scraper.search(pd.Timestamp('2022-09-02'), stock_code)
+        # The alert page carries valid state, so the next search goes ahead without reloading the form
+        alert_viewstate = scraper.form_fields['__VIEWSTATE']
+        _, _, df = parse_search_result_page(scraper.search(pd.Timestamp('2022-09-02'), 1))
+    assert posts[-1][1]['__VIEWSTATE'] == alert_viewstate
+    assert len(df) == len(RESULT_PAGES['1_20220902.html'][2])
+
+
+def test_scrapers_reuse_thread_session(mock_site):
+    search_url, posts = mock_site
+    del posts[:]
+    with HttpScraper(search_url=search_url, fallback_to_selenium=False) as first_scraper, \
+            HttpScraper(search_url=search_url, fallback_to_selenium=False) as second_scraper:
+        first_scraper.search(pd.Timestamp('2022-09-02'), 1)
+        second_scraper.search(pd.Timestamp('2022-09-04'), 5)
+        first_scraper.search(pd.Timestamp('2022-09-02'), 8)
+    assert first_scraper.session is second_scraper.session is get_http_session()
+    # Every search went over the same kept-alive connection
+    assert len({client_port for client_port, _ in posts}) == 1
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import read_fixture
+from scrapers import ScrapeError, parse_search_result_page
+from benchmarks import legacy_parse_search_result_page
+
+
+def expected_frame(rows: list) -> pd.DataFrame:
+    return pd.DataFrame({
+        'participant_id': pd.Series([row[0] for row in rows], dtype=object),
+        'participant_name': pd.Series([row[1] for row in rows], dtype=object),
+        'shareholding': np.array([row[2] for row in rows], dtype=np.int64),
+        'pct_total_issued': np.array([row[3] for row in rows], dtype=np.float64)
+    })
+
+
+RESULT_PAGES = {
+    '1_20220902.html': ('2022/09/02', 'CK HUTCHISON HOLDINGS LIMITED', expected_frame([
+        ('C00019', 'THE HONGKONG AND SHANGHAI BANKING CORPORATION LIMITED', 1257043880, 32.82),
+        ('C00010', 'CITIBANK N.A.', 498371052, 13.01),
+        ('C00100', 'JPMORGAN CHASE BANK, NATIONAL ASSOCIATION', 141229573, 3.68),
+        ('B01451', 'GOLDMAN SACHS (ASIA) SECURITIES LTD', 5402118, 0.14),
+        (np.nan, 'CHAN TAI MAN*', 12000, 0.0),
+        ('B01955', 'BOCI SECURITIES LTD', 800, np.nan),
+    ])),
+    # Requested on a Sunday, the site displays the previous trading date
+    '5_20220904.html': ('2022/09/02', 'HSBC HOLDINGS PLC', expected_frame([
+        ('C00019', 'THE HONGKONG AND SHANGHAI BANKING CORPORATION LIMITED', 3018452204, 15.01),
+        ('A00003', 'CHINA SECURITIES DEPOSITORY AND CLEARING CORPORATION LIMITED', 1420006883, 7.06),
+        ('C00039', 'STANDARD CHARTERED BANK (HONG KONG) LTD', 402331900, 2.0),
+    ])),
+    # No participant holds the stock on the date
+    '8_20220902.html': ('2022/09/02', 'PCCW LIMITED', expected_frame([])),
+}
+
+
+@pytest.mark.parametrize('name', RESULT_PAGES)
+def test_parse_result_page(name):
+    date_hkex, stock_name, df = parse_search_result_page(read_fixture(name))
+    expected_date_hkex, expected_stock_name, expected_df = RESULT_PAGES[name]
+    assert date_hkex == expected_date_hkex
+    assert stock_name == expected_stock_name
+    pd.testing.assert_frame_equal(df, expected_df)
+
+
+def test_parse_result_page_skips_mobile_list_headings():
+    _, _, df = parse_search_result_page(read_fixture('1_20220902.html'))
+    values = df.astype(str).to_numpy().ravel()
+    assert not any(value.endswith(':') for value in values)
+    assert 'Participant ID' not in df['participant_id'].tolist()
+
+
+@pytest.mark.parametrize('name', ['search_form.html', '99999_20220902.html'])
+def test_parse_page_without_results_raises(name):
+    with pytest.raises(ScrapeError):
+        parse_search_result_page(read_fixture(name))
+
+
+@pytest.mark.parametrize('name', [name for name, (_, _, df) in RESULT_PAGES.items() if len(df)])
+def test_parse_result_page_matches_legacy_parser(name):
+    page_source = read_fixture(name)
+    output = parse_search_result_page(page_source)
+    legacy_output = legacy_parse_search_result_page(page_source)
+    assert output[:2] == legacy_output[:2]
+    pd.testing.assert_frame_equal(output[2], legacy_output[2], check_dtype=False)
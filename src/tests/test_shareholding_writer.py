@@ -0,0 +1,65 @@
+import sqlite3
+import pytest
+import shareholding_writer
+from shareholding_writer import ShareholdingWriter
+
+INSERT_ROW_QUERY = 'INSERT INTO t (x) VALUES (?);'
+
+
+@pytest.fixture
+def db_path(tmp_path) -> str:
+    db_path = str(tmp_path / 'writer.db')
+    with sqlite3.connect(db_path) as con:
+        con.execute('CREATE TABLE t (x INTEGER PRIMARY KEY);')
+    return db_path
+
+
+def stored_rows(db_path: str) -> list:
+    with sqlite3.connect(db_path) as con:
+        return [x for x, in con.execute('SELECT x FROM t ORDER BY x;')]
+
+
+def test_failed_batch_is_reported_to_its_submitters_only(db_path):
+    writer = ShareholdingWriter(db_path=db_path, flush_interval_seconds=60)
+    written = writer.submit(INSERT_ROW_QUERY, [(1,)])
+    failed = writer.submit('INSERT INTO missing_table (x) VALUES (?);', [(2,)])
+    with pytest.raises(RuntimeError):
+        writer.flush()
+    assert isinstance(written.exception(timeout=5), sqlite3.OperationalError)
+    assert isinstance(failed.exception(timeout=5), sqlite3.OperationalError)
+
+    # A later batch commits, and its flush doesn't report the earlier failure
+    later = writer.submit(INSERT_ROW_QUERY, [(3,)])
+    writer.flush()
+    assert later.result(timeout=5) is None
+    assert stored_rows(db_path) == [3]
+
+
+def test_submission_after_a_failed_one_is_not_written(db_path):
+    writer = ShareholdingWriter(db_path=db_path, flush_interval_seconds=60)
+    failed = writer.submit('INSERT INTO missing_table (x) VALUES (?);', [(1,)])
+    with pytest.raises(RuntimeError):
+        writer.flush()
+    recorded = writer.submit(INSERT_ROW_QUERY, [(2,)], after=[failed])
+    writer.flush()
+    assert recorded.exception(timeout=5) is failed.exception()
+    assert stored_rows(db_path) == []
+
+
+def test_locked_database_is_retried(db_path, monkeypatch):
+    connect_db = shareholding_writer.connect_db
+    attempts = []
+
+    def locked_connect_db(*args, **kwargs):
+        attempts.append(1)
+        if len(attempts) <= 2:
+            raise sqlite3.OperationalError('database is locked')
+        return connect_db(*args, **kwargs)
+
+    monkeypatch.setattr(shareholding_writer, 'connect_db', locked_connect_db)
+    writer = ShareholdingWriter(db_path=db_path, commit_retries=2, commit_retry_backoff_seconds=0.01)
+    written = writer.submit(INSERT_ROW_QUERY, [(1,)])
+    writer.flush()
+    assert written.result(timeout=5) is None
+    assert len(attempts) == 3
+    assert stored_rows(db_path) == [1]
@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+from transaction_matcher import FINDER_DATA_COLUMNS, match_transactions
+
+
+def finder_data(diffs: dict) -> pd.DataFrame:
+    # One day of finder data with the given shareholding_diff per participant ID, all detected
+    shareholding = np.full(len(diffs), 10 ** 8) + np.array(list(diffs.values()))
+    return pd.DataFrame({
+        'date': pd.Timestamp('2022-09-02'),
+        'stock_code': 1,
+        'participant_id': list(diffs),
+        'participant_name': [f'PARTICIPANT {participant_id}' for participant_id in diffs],
+        'shareholding': shareholding,
+        'shareholding_diff': list(diffs.values()),
+        'shareholding_pct_change': np.array(list(diffs.values())) / (shareholding - np.array(list(diffs.values()))),
+        'transaction_detected': True
+    }, columns=FINDER_DATA_COLUMNS)
+
+
+def test_split_matches_two_genuine_parts():
+    matches = match_transactions(
+        finder_data({'C00001': 1_000_000, 'C00002': -600_000, 'C00003': -399_000}), mode='split', tolerance=0.02)
+    splits = matches.loc[matches['match_type'].eq('split')]
+    assert splits['seller_id'].tolist() == ['C00002', 'C00003']
+    assert splits['buyer_id'].eq('C00001').all()
+    assert splits['match_group'].nunique() == 1
+
+
+def test_split_does_not_pad_near_equal_pair_with_small_parts():
+    # A near-equal pair plus small, unrelated changes on either side is a pair, not a split
+    matches = match_transactions(
+        finder_data({'C00014': 5_790_000, 'C00030': -5_785_000, 'C00041': -12_000, 'C00042': -39_000,
+                     'C00043': 25_000}),
+        mode='split', tolerance=0.02)
+    assert matches['match_type'].tolist() == ['pair']
+    assert matches[['buyer_id', 'seller_id']].values.tolist() == [['C00014', 'C00030']]
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+import pytest
+from synthetic_data import generate_synthetic_shareholding_data
+from trend_figure import build_trend_figure, lttb_indices
+
+
+@pytest.fixture(scope='module')
+def trend_data() -> pd.DataFrame:
+    # Two years of 10 participants, longer than the trend plot's point budget
+    return generate_synthetic_shareholding_data(10, 730, transfers_per_day=3)
+
+
+def test_lttb_reduces_long_series_keeping_endpoints_and_extremes():
+    n = 10000
+    x = np.arange(n)
+    y = np.sin(np.linspace(0, 20, n)) * 1000
+    y[1234], y[8765] = 5000, -5000
+    kept = lttb_indices(x, y, 200)
+    assert len(kept) == 200
+    assert np.all(np.diff(kept) > 0)
+    assert kept[0] == 0 and kept[-1] == n - 1
+    assert {1234, 8765} <= set(kept)
+
+
+def test_lttb_keeps_short_series():
+    np.testing.assert_array_equal(lttb_indices(np.arange(50), np.arange(50), 200), np.arange(50))
+
+
+def test_trend_figure_downsamples_to_point_budget(trend_data):
+    fig = build_trend_figure(trend_data, 'Trend', max_points=1000)
+    assert len(fig.data) == 10
+    for trace in fig.data:
+        participant_id = trace.name.split(':')[0]
+        participant_data = trend_data.loc[trend_data['participant_id'].eq(participant_id)]
+        shareholding = participant_data['shareholding'].to_numpy()
+        assert len(trace.x) <= 1000 // 10 + 1 < len(participant_data)
+        assert pd.Timestamp(trace.x[0]) == pd.Timestamp(participant_data['date'].min())
+        assert pd.Timestamp(trace.x[-1]) == pd.Timestamp(participant_data['date'].max())
+        assert max(trace.y) == shareholding.max() and min(trace.y) == shareholding.min()
+
+
+def test_trend_figure_zoom_window_keeps_detail(trend_data):
+    x_range = (pd.Timestamp('2022-06-01'), pd.Timestamp('2022-07-31'))
+    fig = build_trend_figure(trend_data, 'Trend', x_range=x_range, max_points=1000)
+    for trace in fig.data:
+        # Every date of the window, plus one either side
+        assert len(trace.x) == (x_range[1] - x_range[0]).days + 1 + 2
@@ -0,0 +1,104 @@
+import threading
+import time
+from utils import *
+from queries import *
+from config import *
+
+
+logger = logging.getLogger(__name__)
+
+
+class TradingCalendar:
+    """ Trading dates of the CCASS search site.
+
+    The site displays the previous trading date when asked for a non-trading date. Those mappings are learned
+    from scrape_dates as pages are written (the non_trading_dates table). Until a date has been learned, seeded
+    holidays and, optionally, Sundays are treated as non-trading. Any other date is assumed to be a trading date.
+
+    """
+
+    def __init__(self, holidays_path: str = TRADING_CALENDAR_HOLIDAYS_PATH, skip_sundays: bool = TRADING_CALENDAR_SKIP_SUNDAYS, refresh_seconds: float = TRADING_CALENDAR_REFRESH_SECONDS) -> None:
+        self.skip_sundays = skip_sundays
+        self.refresh_seconds = refresh_seconds
+        self.seeded_holiday_keys = set()
+        if holidays_path is not None:
+            holidays = pd.read_csv(holidays_path, usecols=['date'])
+            self.seeded_holiday_keys = set(dates_to_keys(holidays['date']).tolist())
+            logger.info(f'Seeded {len(self.seeded_holiday_keys)} holidays from {holidays_path}.')
+        # date_key -> trading_date_key of learned non-trading dates
+        self.learned_trading_date_keys = {}
+        self.loaded_at = None
+        self.lock = threading.Lock()
+
+    def _refresh(self) -> None:
+        with self.lock:
+            if self.loaded_at is not None and time.monotonic() - self.loaded_at < self.refresh_seconds:
+                return
+            with connect_db() as con:
+                self.learned_trading_date_keys = dict(con.execute(PULL_NON_TRADING_DATES_QUERY).fetchall())
+            self.loaded_at = time.monotonic()
+
+    def _is_seeded_non_trading_date_key(self, date_key: int) -> bool:
+        # 1970-01-01 (day key 0) was a Thursday, so day key 3 was a Sunday
+        return date_key in self.seeded_holiday_keys or (self.skip_sundays and date_key % 7 == 3)
+
+    def get_trading_date(self, date: pd.Timestamp) -> pd.Timestamp:
+        """ Returns the date displayed by the site when asked for date.
+
+        Args:
+            date (pd.Timestamp): Requested date.
+
+        Returns:
+            pd.Timestamp: Learned trading date, or the latest date on or before date that isn't a seeded
+                non-trading date.
+
+        """
+        self._refresh()
+        date_key = date_to_key(date)
+        while date_key not in self.learned_trading_date_keys and self._is_seeded_non_trading_date_key(date_key):
+            date_key -= 1
+        return key_to_date(self.learned_trading_date_keys.get(date_key, date_key))
+
+    def collapse(self, dates: pd.DatetimeIndex) -> dict:
+        """ Groups dates by the trading date displayed for them, so that each trading date is scraped once.
+
+        Args:
+            dates (pd.DatetimeIndex): Requested dates.
+
+        Returns:
+            dict: Date to scrape (the trading date itself when requested) -> (trading date, other dates of the group).
+
+        """
+        groups = {}
+        for date in dates:
+            groups.setdefault(self.get_trading_date(date), []).append(date)
+
+        collapsed_dates = {}
+        for trading_date, group_dates in groups.items():
+            scrape_date = trading_date if trading_date in group_dates else group_dates[0]
+            collapsed_dates[scrape_date] = (trading_date, [date for date in group_dates if date != scrape_date])
+        return collapsed_dates
+
+    def invalidate(self) -> None:
+        # Reload the learned dates on next use
+        with self.lock:
+            self.loaded_at = None
+
+
+# Process-wide calendar
+_trading_calendar = None
+_trading_calendar_lock = threading.Lock()
+
+
+def get_trading_calendar() -> TradingCalendar:
+    """ Returns the process-wide TradingCalendar, creating it on first use.
+
+    Returns:
+        TradingCalendar: Shared trading calendar.
+
+    """
+    global _trading_calendar
+    with _trading_calendar_lock:
+        if _trading_calendar is None:
+            _trading_calendar = TradingCalendar()
+        return _trading_calendar
@@ -0,0 +1,241 @@
+import pandas as pd
+import numpy as np
+from config import *
+
+
+logger = logging.getLogger(__name__)
+
+MATCH_MODES = ('exact', 'tolerance', 'split')
+
+# Columns of the finder data read by match_transactions()
+FINDER_DATA_COLUMNS = ['date', 'stock_code', 'participant_id', 'participant_name', 'shareholding',
+                       'shareholding_diff', 'shareholding_pct_change', 'transaction_detected']
+
+
+def _split_buyers_sellers(finder_data: pd.DataFrame) -> tuple:
+    # Keep the row position so matches can be returned in the order of the input frame
+    detected = finder_data.loc[finder_data['transaction_detected'], FINDER_DATA_COLUMNS[:-1]]
+    detected = detected.assign(order=np.arange(len(detected)))
+
+    buyers = detected.loc[detected['shareholding_diff'].gt(0)]
+    buyers = buyers.assign(quantity=buyers['shareholding_diff'])
+    sellers = detected.loc[detected['shareholding_diff'].lt(0)]
+    sellers = sellers.assign(quantity=-sellers['shareholding_diff'])
+    return buyers, sellers
+
+
+def _format_matches(matches: pd.DataFrame) -> pd.DataFrame:
+    # Map merged buyer/seller columns to the potential transactions table
+    return pd.DataFrame({
+        'date': matches['date'],
+        'stock_code': matches['stock_code'],
+        'buyer_id': matches['participant_id_buyer'],
+        'buyer_name': matches['participant_name_buyer'],
+        'seller_id': matches['participant_id_seller'],
+        'seller_name': matches['participant_name_seller'],
+        'quantity': matches['quantity'],
+        'buyer_pct_change': np.round(100 * matches['shareholding_pct_change_buyer'], 5),
+        'seller_pct_change': np.round(100 * matches['shareholding_pct_change_seller'], 5),
+        'buyer_shareholding': matches['shareholding_buyer'],
+        'seller_shareholding': matches['shareholding_seller']
+    }).reset_index(drop=True)
+
+
+def _match_exact(buyers: pd.DataFrame, sellers: pd.DataFrame) -> pd.DataFrame:
+    # Hash join of net buyers and net sellers on (date, stock_code, quantity)
+    matches = buyers.merge(
+        sellers, on=['date', 'stock_code', 'quantity'], suffixes=('_buyer', '_seller'))
+    return matches.sort_values(['order_buyer', 'order_seller'])
+
+
+def _day_codes(*frames: pd.DataFrame) -> list:
+    # Codes of the (date, stock_code) days of the rows of each frame, shared across the frames
+    days = pd.concat([frame[['date', 'stock_code']] for frame in frames])
+    codes = days.groupby(['date', 'stock_code'], sort=False).ngroup().to_numpy()
+    return np.split(codes, np.cumsum([len(frame) for frame in frames[:-1]]))
+
+
+def _expand_ranges(starts: np.ndarray, stops: np.ndarray) -> tuple:
+    # Range numbers and positions of every position of the ranges [starts, stops)
+    counts = np.maximum(stops - starts, 0)
+    range_numbers = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return range_numbers, starts[range_numbers] + offsets
+
+
+def _searchsorted_by_day(days: np.ndarray, quantities: np.ndarray, query_days: np.ndarray, query_quantities: np.ndarray, side: str) -> np.ndarray:
+    # np.searchsorted of each query quantity among the quantities of its day, with the rows sorted by (day,
+    # quantity) and the queries by day. Returns positions into the sorted rows, within the slice of the query's day
+    positions = np.empty(len(query_quantities), dtype=np.int64)
+    query_starts = np.flatnonzero(np.diff(query_days, prepend=-1))
+    query_stops = np.append(query_starts[1:], len(query_days))
+    row_starts = np.searchsorted(days, query_days[query_starts], side='left')
+    row_stops = np.searchsorted(days, query_days[query_starts], side='right')
+    for query_start, query_stop, row_start, row_stop in zip(query_starts, query_stops, row_starts, row_stops):
+        positions[query_start:query_stop] = row_start + np.searchsorted(
+            quantities[row_start:row_stop], query_quantities[query_start:query_stop], side=side)
+    return positions
+
+
+def _sort_by_day(frame: pd.DataFrame, days: np.ndarray) -> tuple:
+    # Positions of the rows of frame sorted by (day, quantity), with their days and quantities in that order
+    quantities = frame['quantity'].to_numpy(dtype=np.float64)
+    order = np.lexsort((quantities, days))
+    return order, days[order], quantities[order]
+
+
+def _join_rows(left: pd.DataFrame, left_positions: np.ndarray, right: pd.DataFrame, right_positions: np.ndarray, suffixes: tuple) -> pd.DataFrame:
+    # Rows of left and right at the given positions side by side, as merged on (date, stock_code)
+    left_rows = left.iloc[left_positions].reset_index(drop=True)
+    right_rows = right.iloc[right_positions].drop(columns=['date', 'stock_code']).reset_index(drop=True)
+    return pd.concat([
+        left_rows.rename(columns={column: column + suffixes[0] for column in right_rows.columns}),
+        right_rows.add_suffix(suffixes[1])
+    ], axis=1)
+
+
+def _match_tolerance(buyers: pd.DataFrame, sellers: pd.DataFrame, tolerance: float) -> pd.DataFrame:
+    # Pairs of buyers and sellers on the same day whose quantities differ by at most tolerance (relative).
+    # Sellers are sorted by quantity within each day, so the candidates of a buyer are a contiguous range found by
+    # binary search rather than every seller of the day
+    buyer_days, seller_days = _day_codes(buyers, sellers)
+    buyer_order, buyer_days, buyer_quantities = _sort_by_day(buyers, buyer_days)
+    seller_order, seller_days, seller_quantities = _sort_by_day(sellers, seller_days)
+
+    # |buyer - seller| <= tolerance * max(buyer, seller) bounds the seller to [buyer * (1 - tolerance),
+    # buyer / (1 - tolerance)], widened by a share against rounding and checked exactly below
+    lower = buyer_quantities * (1 - tolerance) - 1
+    upper = buyer_quantities / (1 - tolerance) + 1 if tolerance < 1 else np.full(len(buyers), np.inf)
+    buyer_positions, seller_positions = _expand_ranges(
+        _searchsorted_by_day(seller_days, seller_quantities, buyer_days, lower, 'left'),
+        _searchsorted_by_day(seller_days, seller_quantities, buyer_days, upper, 'right'))
+
+    matches = _join_rows(buyers, buyer_order[buyer_positions], sellers, seller_order[seller_positions], ('_buyer', '_seller'))
+    larger_quantity = np.maximum(
+        matches['quantity_buyer'], matches['quantity_seller'])
+    matches = matches.loc[(matches['quantity_buyer'] - matches['quantity_seller']
+                           ).abs().le(tolerance * larger_quantity)]
+    matches = matches.assign(quantity=np.minimum(
+        matches['quantity_buyer'], matches['quantity_seller']))
+    return matches.sort_values(['order_buyer', 'order_seller'])
+
+
+def _is_split_share(whole_quantities: np.ndarray, part_quantities: np.ndarray, tolerance: float) -> np.ndarray:
+    # Whether parts can be a leg of a split of the wholes: larger than the tolerance of the whole, which would
+    # otherwise let any small, unrelated change pad a near-equal pair, and not within tolerance of the whole alone,
+    # which is a pair match
+    return ((part_quantities > tolerance * whole_quantities)
+            & (np.abs(whole_quantities - part_quantities) > tolerance * whole_quantities))
+
+
+def _find_split_triples(whole: pd.DataFrame, parts: pd.DataFrame, tolerance: float) -> tuple:
+    # Positions (whole, first part, second part) of the wholes within tolerance of the sum of two parts of the
+    # same day. Parts are sorted by quantity within each day, so the second parts of a (whole, first part) are a
+    # contiguous range found by binary search, and the search costs wholes x parts rather than wholes x parts^2
+    whole_days, part_days = _day_codes(whole, parts)
+    whole_order, whole_days, whole_quantities = _sort_by_day(whole, whole_days)
+    part_order, part_days, part_quantities = _sort_by_day(parts, part_days)
+
+    # Every (whole, first part) of the same day, where the first part is a genuine share of the whole
+    pair_wholes, pair_firsts = _expand_ranges(
+        np.searchsorted(part_days, whole_days, side='left'), np.searchsorted(part_days, whole_days, side='right'))
+    is_share = _is_split_share(whole_quantities[pair_wholes], part_quantities[pair_firsts], tolerance)
+    pair_wholes, pair_firsts = pair_wholes[is_share], pair_firsts[is_share]
+
+    # Second parts within the tolerance of the remainder, widened by a share against rounding and checked exactly
+    # below. They come after the first part in the sorted order, so each pair of parts is found once
+    remainders = whole_quantities[pair_wholes] - part_quantities[pair_firsts]
+    allowance = tolerance * whole_quantities[pair_wholes] + 1
+    pair_days = whole_days[pair_wholes]
+    lower = np.maximum(
+        _searchsorted_by_day(part_days, part_quantities, pair_days, remainders - allowance, 'left'), pair_firsts + 1)
+    upper = _searchsorted_by_day(part_days, part_quantities, pair_days, remainders + allowance, 'right')
+    triple_pairs, triple_seconds = _expand_ranges(lower, upper)
+    triple_wholes, triple_firsts = pair_wholes[triple_pairs], pair_firsts[triple_pairs]
+
+    split_quantities = part_quantities[triple_firsts] + part_quantities[triple_seconds]
+    within_tolerance = ((np.abs(whole_quantities[triple_wholes] - split_quantities) <= tolerance * whole_quantities[triple_wholes])
+                        & _is_split_share(whole_quantities[triple_wholes], part_quantities[triple_seconds], tolerance))
+    return (whole_order[triple_wholes[within_tolerance]], part_order[triple_firsts[within_tolerance]],
+            part_order[triple_seconds[within_tolerance]])
+
+
+def _match_split(buyers: pd.DataFrame, sellers: pd.DataFrame, tolerance: float, max_parts: int = TRANSACTION_MATCH_SPLIT_MAX_PARTS) -> pd.DataFrame:
+    # One side's quantity matching the sum of two quantities among the max_parts largest on the other side of the
+    # same day
+    participant_columns = ['participant_id', 'participant_name', 'shareholding',
+                           'shareholding_pct_change', 'quantity', 'order']
+    split_legs = []
+    for whole, parts, whole_suffix, part_suffix in [(buyers, sellers, '_buyer', '_seller'), (sellers, buyers, '_seller', '_buyer')]:
+        part_ranks = parts.groupby(['date', 'stock_code'])['quantity'].rank(method='first', ascending=False)
+        parts = parts.loc[part_ranks.le(max_parts)]
+        triple_wholes, triple_firsts, triple_seconds = _find_split_triples(whole, parts, tolerance)
+
+        # The first leg of a split is the part earlier in the input frame, and splits are in the order of the
+        # input frame
+        part_orders = parts['order'].to_numpy()
+        swap = part_orders[triple_firsts] > part_orders[triple_seconds]
+        triple_firsts, triple_seconds = np.where(swap, triple_seconds, triple_firsts), np.where(swap, triple_firsts, triple_seconds)
+        triple_order = np.lexsort((part_orders[triple_seconds], part_orders[triple_firsts], triple_wholes))
+        triple_wholes, triple_firsts, triple_seconds = (
+            triple_wholes[triple_order], triple_firsts[triple_order], triple_seconds[triple_order])
+
+        # Each leg of a split becomes a (buyer, seller) row with the leg's quantity
+        for leg_positions in [triple_firsts, triple_seconds]:
+            leg = _join_rows(whole[['date', 'stock_code'] + participant_columns], triple_wholes,
+                             parts[['date', 'stock_code'] + participant_columns], leg_positions, (whole_suffix, part_suffix))
+            split_legs.append(leg.assign(
+                match_group=np.arange(len(leg)), quantity=leg['quantity' + part_suffix], split_side=whole_suffix))
+
+    split_legs = pd.concat(split_legs)
+    # Buyer splits and seller splits have separate match_group counters
+    split_legs['match_group'] = split_legs.groupby(
+        ['split_side', 'match_group'], sort=False).ngroup()
+    return split_legs.sort_values(['match_group', 'order_buyer', 'order_seller'])
+
+
+def match_transactions(finder_data: pd.DataFrame, mode: str = TRANSACTION_MATCH_MODE, tolerance: float = TRANSACTION_MATCH_TOLERANCE) -> pd.DataFrame:
+    """ Matches net buyers with net sellers of the same day to identify potential transactions.
+
+    Modes:
+        'exact': A buyer and a seller whose changes in shareholding are equal and opposite.
+        'tolerance': A buyer and a seller whose quantities differ by at most tolerance (relative to the larger one).
+        'split': As 'tolerance', plus one buyer matched to two sellers (or one seller to two buyers) whose
+            quantities sum to within tolerance. Each leg must be larger than tolerance of the whole and not
+            match it within tolerance alone. Only the TRANSACTION_MATCH_SPLIT_MAX_PARTS largest changes of
+            each side and day are split legs. Each leg of a split is a separate row sharing a match_group.
+
+    Args:
+        finder_data (pd.DataFrame): Shareholding data with the shareholding_diff, shareholding_pct_change and
+            transaction_detected columns.
+        mode (str, optional): One of MATCH_MODES. Defaults to TRANSACTION_MATCH_MODE.
+        tolerance (float, optional): Relative quantity tolerance for the 'tolerance' and 'split' modes.
+            Defaults to TRANSACTION_MATCH_TOLERANCE.
+
+    Returns:
+        pd.DataFrame: Table of potential transactions. The 'tolerance' and 'split' modes add match_type and
+            match_group columns.
+
+    """
+    if mode not in MATCH_MODES:
+        raise ValueError(f'Unknown match mode: {mode}')
+
+    buyers, sellers = _split_buyers_sellers(finder_data)
+
+    if mode == 'exact':
+        return _format_matches(_match_exact(buyers, sellers))
+
+    pair_matches = _match_tolerance(buyers, sellers, tolerance)
+    pair_matches = pair_matches.assign(
+        match_type='pair', match_group=np.arange(len(pair_matches)))
+    if mode == 'split':
+        split_matches = _match_split(buyers, sellers, tolerance)
+        split_matches = split_matches.assign(
+            match_type='split', match_group=split_matches['match_group'] + len(pair_matches))
+        pair_matches = pd.concat([pair_matches, split_matches]).sort_values(
+            ['date', 'match_group'], kind='stable')
+
+    potential_transactions = _format_matches(pair_matches)
+    potential_transactions['match_type'] = pair_matches['match_type'].to_numpy()
+    potential_transactions['match_group'] = pair_matches['match_group'].to_numpy()
+    return potential_transactions
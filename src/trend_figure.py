@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+import plotly.graph_objs as go
+from instrumentation import timed
+from config import *
+
+
+logger = logging.getLogger(__name__)
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """ Selects points of a series with the Largest-Triangle-Three-Buckets algorithm.
+
+    The first and last points are kept, and the others are split into n_out - 2 buckets. Each bucket keeps the point
+    forming the largest triangle with the point kept in the previous bucket and the mean of the next bucket, which
+    preserves peaks and troughs. The maximum and minimum are always kept, in place of the point of their bucket
+    (both are kept, n_out + 1 points, when they fall in the same bucket).
+
+    Args:
+        x (np.ndarray): Ascending x values.
+        y (np.ndarray): y values.
+        n_out (int): Number of points to keep.
+
+    Returns:
+        np.ndarray: Ascending indices of the kept points.
+
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = x.astype(float)
+    y = y.astype(float)
+    bucket_edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    indices = np.empty(n_out, dtype=int)
+    indices[0], indices[-1] = 0, n - 1
+    selected = 0
+    for i in range(n_out - 2):
+        start, end = bucket_edges[i], bucket_edges[i + 1]
+        next_end = bucket_edges[i + 2] if i + 2 < len(bucket_edges) else n
+        next_x, next_y = x[end:next_end].mean(), y[end:next_end].mean()
+        areas = np.abs((x[selected] - next_x) * (y[start:end] - y[selected]) -
+                       (x[selected] - x[start:end]) * (next_y - y[selected]))
+        selected = start + int(np.argmax(areas))
+        indices[i + 1] = selected
+
+    # The triangles can miss the extremes of step-like series, e.g. a holding kept flat at its peak
+    extremes = [int(np.argmax(y)), int(np.argmin(y))]
+    for extreme in extremes:
+        if 0 < extreme < n - 1:
+            indices[np.searchsorted(bucket_edges, extreme, side='right')] = extreme
+    return np.union1d(indices, extremes)
+
+
+@timed('render.trend_figure')
+def build_trend_figure(trend_data: pd.DataFrame, title: str, x_range: tuple = None, max_points: int = TREND_MAX_POINTS) -> go.Figure:
+    """ Builds the trend plot with WebGL (Scattergl) traces, downsampled to about max_points in total.
+
+    The points are shared equally by the participants. Only the points within x_range are downsampled, so zooming in
+    brings back the detail.
+
+    Args:
+        trend_data (pd.DataFrame): Shareholding of the plotted participants, with the columns date, participant_id,
+            participant_name and shareholding.
+        title (str): Figure title.
+        x_range (tuple, optional): (start, end) dates of the zoom window. Defaults to None (the whole range).
+        max_points (int, optional): Points of all participants. Defaults to TREND_MAX_POINTS.
+
+    Returns:
+        go.Figure: Trend plot.
+
+    """
+    fig = go.Figure()
+    dates = pd.to_datetime(trend_data['date'])
+    labels = trend_data['participant_id'].astype(str) + ': ' + trend_data['participant_name'].astype(str)
+    trace_positions = labels.groupby(labels, sort=False).indices
+    max_points_per_trace = max(max_points // max(len(trace_positions), 1), 3)
+    for label, positions in trace_positions.items():
+        trace_dates = dates.iloc[positions].to_numpy()
+        order = np.argsort(trace_dates, kind='stable')
+        trace_dates = trace_dates[order]
+        trace_shareholdings = trend_data['shareholding'].to_numpy()[positions][order]
+
+        if x_range is not None:
+            # Keep one point either side of the window so that lines run to its edges
+            start = max(np.searchsorted(trace_dates, np.datetime64(x_range[0]), side='left') - 1, 0)
+            end = np.searchsorted(trace_dates, np.datetime64(x_range[1]), side='right') + 1
+            trace_dates, trace_shareholdings = trace_dates[start:end], trace_shareholdings[start:end]
+
+        kept = lttb_indices(trace_dates.astype('datetime64[s]').astype(np.int64), trace_shareholdings, max_points_per_trace)
+        fig.add_trace(go.Scattergl(
+            x=trace_dates[kept],
+            y=trace_shareholdings[kept],
+            name=label,
+            mode='lines+markers',
+        ))
+
+    fig.update_layout(
+        title=title,
+        xaxis_title='Date',
+        yaxis_title='Shareholding',
+        legend_title='Participants',
+        # Keeps hidden traces hidden when the figure is rebuilt for a zoom window
+        uirevision=title,
+    )
+    if x_range is not None:
+        fig.update_xaxes(range=[pd.Timestamp(x_range[0]), pd.Timestamp(x_range[1])])
+    return fig
@@ -1,9 +1,13 @@
 import selenium
 from selenium import webdriver
 import sqlite3
+from contextlib import contextmanager
+from instrumentation import timed
+from db import get_connection_pool
 from queries import *
 from config import *
 
+@timed('driver.initialise')
 def initialise_driver() -> selenium.webdriver:
     # Initialises a remote Chrome webdriver session
     options = webdriver.ChromeOptions()
@@ -24,12 +28,166 @@ def initialise_driver() -> selenium.webdriver:
     return driver
 
 
+@contextmanager
+def connect_db(db_path: str = SHAREHOLDING_DATA_DB_PATH) -> sqlite3.Connection:
+    # Checks out a pooled connection of the calling thread, or opens one with the tuned pragmas and always closes
+    # it without pooling. Commits on success and rolls back on error
+    if USE_SQLITE_CONNECTION_POOL:
+        with get_connection_pool().connection(db_path) as con:
+            yield con
+        return
+    con = sqlite3.connect(db_path, timeout=SQLITE_BUSY_TIMEOUT_SECONDS)
+    try:
+        for pragma in SQLITE_CONNECTION_PRAGMAS:
+            con.execute(pragma)
+        with con:
+            yield con
+    finally:
+        con.close()
+
+
+def query_exists(sql: str, params=(), db_path: str = SHAREHOLDING_DATA_DB_PATH) -> bool:
+    """ Returns whether a query has a row, with a cursor rather than pandas.
+
+    Args:
+        sql (str): Query with bound parameters, e.g. a SELECT 1 ... LIMIT 1 probe.
+        params (tuple or dict, optional): Parameters of the query. Defaults to ().
+        db_path (str, optional): Path of the database. Defaults to SHAREHOLDING_DATA_DB_PATH.
+
+    Returns:
+        bool: True when the query returns at least one row.
+
+    """
+    with connect_db(db_path) as con:
+        return con.execute(sql, params).fetchone() is not None
+
+
+def query_column(sql: str, params=(), db_path: str = SHAREHOLDING_DATA_DB_PATH) -> list:
+    """ Returns the first column of the rows of a query, with a cursor rather than pandas.
+
+    Args:
+        sql (str): Query with bound parameters.
+        params (tuple or dict, optional): Parameters of the query. Defaults to ().
+        db_path (str, optional): Path of the database. Defaults to SHAREHOLDING_DATA_DB_PATH.
+
+    Returns:
+        list: Values of the first column.
+
+    """
+    with connect_db(db_path) as con:
+        return [row[0] for row in con.execute(sql, params)]
+
+
+def sql_placeholders(n_values: int) -> str:
+    # '?, ?, ...' placeholders binding the values of an IN list of variable length
+    return ', '.join(['?'] * n_values)
+
+
 def initialise_shareholding_db():
-    # 1. Initialise shareholding table
-    with sqlite3.connect(SHAREHOLDING_DATA_DB_PATH) as con:
+    with connect_db() as con:
         cur = con.cursor()
-        cur.execute(CREATE_SHAREHOLDING_TABLE_QUERY)
-        cur.execute(CREATE_SHAREHOLDING_INDEX_QUERY)
+        # 0. Write-ahead logging lets readers proceed while the writer commits (persistent setting)
+        cur.execute('PRAGMA journal_mode=WAL;')
+        # 1. Initialise shareholding tables
+        cur.execute(CREATE_STOCKS_TABLE_QUERY)
+        cur.execute(CREATE_PARTICIPANTS_TABLE_QUERY)
+        cur.execute(CREATE_SCRAPE_DATES_TABLE_QUERY)
+        cur.execute(CREATE_HOLDINGS_TABLE_QUERY)
+        cur.execute(CREATE_NON_TRADING_DATES_TABLE_QUERY)
+        cur.execute(CREATE_HOLDING_DELTAS_TABLE_QUERY)
+        cur.execute(CREATE_HOLDING_DELTAS_PCT_CHANGE_INDEX_QUERY)
+        cur.execute(CREATE_HOLDING_RANKINGS_TABLE_QUERY)
+        cur.execute(CREATE_STOCK_MONTH_GENERATIONS_TABLE_QUERY)
+
+        # 2. Initialise prepopulate_db checkpoint table
+        cur.execute(CREATE_SCRAPE_CHECKPOINT_TABLE_QUERY)
+
+        # 3. Initialise the background scrape job queue of the Dash app
+        cur.execute(CREATE_SCRAPE_JOBS_TABLE_QUERY)
+        cur.execute(CREATE_SCRAPE_JOBS_STATUS_INDEX_QUERY)
+        cur.execute(CREATE_UNAVAILABLE_STOCK_CODES_TABLE_QUERY)
+
+        # 4. Initialise market scan tables
+        cur.execute(CREATE_MARKET_SCANS_TABLE_QUERY)
+        cur.execute(CREATE_MARKET_SCAN_RESULTS_TABLE_QUERY)
+        cur.execute(CREATE_MARKET_SCAN_RESULTS_INDEX_QUERY)
+
+        if cur.execute(LEGACY_SHAREHOLDING_TABLE_EXISTS_QUERY).fetchone():
+            logging.getLogger(__name__).warning(
+                'Found the shareholding table of an earlier version. Run migrate_db.py to migrate its data.')
+        elif cur.execute(CHECK_HOLDING_DELTAS_MISSING_QUERY).fetchone() or cur.execute(CHECK_HOLDING_RANKINGS_MISSING_QUERY).fetchone():
+            logging.getLogger(__name__).warning(
+                'The holding_deltas or holding_rankings table is empty. Run migrate_db.py --rebuild-deltas to compute them.')
+
+
+def date_to_key(date: pd.Timestamp) -> int:
+    # Integer day key (days since 1970-01-01) used in place of dates in the database
+    return int(pd.Timestamp(date).to_datetime64().astype('datetime64[D]').astype(np.int64))
+
+
+def key_to_date(date_key: int) -> pd.Timestamp:
+    # Inverse of date_to_key()
+    return pd.Timestamp(np.datetime64(int(date_key), 'D'))
+
+
+def dates_to_keys(dates: pd.Series) -> np.ndarray:
+    # Vectorised date_to_key() for a column of dates or date strings
+    return pd.to_datetime(dates).to_numpy().astype('datetime64[D]').astype(np.int64)
+
+
+def iter_date_chunks(start_date: pd.Timestamp, end_date: pd.Timestamp, chunk_days: int):
+    # Consecutive (chunk_start_date, chunk_end_date) ranges of at most chunk_days days covering a date range
+    chunk_start_date = pd.Timestamp(start_date)
+    while chunk_start_date <= end_date:
+        chunk_end_date = min(chunk_start_date + pd.Timedelta(days=chunk_days - 1), pd.Timestamp(end_date))
+        yield chunk_start_date, chunk_end_date
+        chunk_start_date = chunk_end_date + pd.Timedelta(days=1)
+
+
+def compact_shareholding_data(data: pd.DataFrame) -> pd.DataFrame:
+    """ Converts shareholding data to its compact in-memory layout.
+
+    Stock and participant columns are categorical, dates datetime64, shareholding int64 and percentages float32.
+    The participant label is not stored, see participant_labels().
+
+    Args:
+        data (pd.DataFrame): Table of shareholding data, e.g. from pull_shareholding_data().
+
+    Returns:
+        pd.DataFrame: Table of shareholding data in the compact layout.
+
+    """
+    dtypes = {
+        'stock_code': 'int64',
+        'stock_name': 'category',
+        'participant_id': 'category',
+        'participant_name': 'category',
+        'shareholding': 'int64',
+        'pct_total_issued': 'float32'
+    }
+    data = data.astype({column: dtype for column, dtype in dtypes.items() if column in data}, copy=False)
+    if 'date' in data and not pd.api.types.is_datetime64_dtype(data['date']):
+        data['date'] = pd.to_datetime(data['date'], format=DATE_BASE_FORMAT)
+    return data
+
+
+def participant_labels(data: pd.DataFrame) -> pd.Series:
+    """ Returns the 'participant_id: participant_name' labels of the rows of shareholding data.
+
+    Labels are built once per participant and returned as a categorical, rather than a string per row.
+
+    Args:
+        data (pd.DataFrame): Table of shareholding data with the columns participant_id and participant_name.
+
+    Returns:
+        pd.Series: Categorical labels, indexed like data.
+
+    """
+    participants = data[['participant_id', 'participant_name']]
+    unique_participants = participants.drop_duplicates()
+    labels = unique_participants['participant_id'].astype(str) + ': ' + unique_participants['participant_name'].astype(str)
+    codes = pd.MultiIndex.from_frame(unique_participants).get_indexer(pd.MultiIndex.from_frame(participants))
+    return pd.Series(pd.Categorical.from_codes(codes, categories=labels), index=data.index, name='participant')
 
 
 def get_table_type(df_column: pd.Series) -> str:
@@ -50,3 +208,65 @@ def get_table_type(df_column: pd.Series) -> str:
         return 'numeric'
     else:
         return 'any'
+
+
+# Dash DataTable filter operators, in the order they are matched
+TABLE_FILTER_OPERATORS = [['ge ', '>='], ['le ', '<='], ['lt ', '<'], ['gt ', '>'], ['ne ', '!='], ['eq ', '='],
+                          ['contains '], ['datestartswith ']]
+
+
+def split_table_filter_part(filter_part: str) -> tuple:
+    # Splits a clause of a DataTable filter_query, e.g. '{shareholding} > 1000', into (column, operator, value)
+    for operator_type in TABLE_FILTER_OPERATORS:
+        for operator in operator_type:
+            if operator in filter_part:
+                name_part, value_part = filter_part.split(operator, 1)
+                name = name_part[name_part.find('{') + 1: name_part.rfind('}')]
+                value = value_part.strip()
+                if len(value) > 1 and value[0] == value[-1] and value[0] in ('\'', '"', '`'):
+                    value = value[1:-1].replace('\\' + value[0], value[0])
+                return name, operator_type[0].strip(), value
+    return None, None, None
+
+
+def query_table_frame(df: pd.DataFrame, page_current: int, page_size: int, sort_by: list, filter_query: str) -> tuple:
+    """ Filters, sorts and pages a frame for a DataTable with custom page, sort and filter actions.
+
+    Args:
+        df (pd.DataFrame): Full table, kept on the server.
+        page_current (int): Zero-based page number.
+        page_size (int): Rows per page.
+        sort_by (list): DataTable sort_by, a list of {'column_id', 'direction'}.
+        filter_query (str): DataTable filter_query.
+
+    Returns:
+        tuple: Records of the requested page and the number of pages.
+
+    """
+    for filter_part in (filter_query or '').split(' && '):
+        name, operator, value = split_table_filter_part(filter_part)
+        if name not in df.columns:
+            continue
+        column = df[name]
+        if operator in ('contains', 'datestartswith'):
+            column = column.astype(str)
+            mask = column.str.contains(value, regex=False) if operator == 'contains' else column.str.startswith(value)
+        else:
+            # Numbers are compared as numbers, anything else as text
+            numeric_value = pd.to_numeric(value, errors='coerce')
+            if pd.api.types.is_numeric_dtype(column) and pd.notna(numeric_value):
+                value = numeric_value
+            else:
+                column = column.astype(str)
+            mask = getattr(column, operator)(value)
+        df = df.loc[mask]
+
+    if sort_by:
+        df = df.sort_values(
+            by=[column_sort['column_id'] for column_sort in sort_by],
+            ascending=[column_sort['direction'] == 'asc' for column_sort in sort_by],
+            kind='mergesort'
+        )
+
+    page_count = max(-(-len(df) // page_size), 1)
+    return df.iloc[page_current * page_size:(page_current + 1) * page_size].to_dict('records'), page_count
@@ -0,0 +1,258 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+import selenium
+from selenium.common.exceptions import UnexpectedAlertPresentException, WebDriverException
+from utils import *
+from config import *
+
+
+logger = logging.getLogger(__name__)
+
+
+class PooledDriver:
+    """ A WebDriver session held by the pool, with its usage bookkeeping. """
+
+    def __init__(self, driver: selenium.webdriver) -> None:
+        self.driver = driver
+        self.uses = 0
+        self.last_used_at = time.monotonic()
+
+
+class WebDriverPool:
+    """ Bounded, thread-safe pool of warm WebDriver sessions on the CCASS search page.
+
+    Sessions are health checked on checkout, recycled after max_uses searches and closed after idling for
+    idle_timeout_seconds. Callers wait up to checkout_timeout_seconds when all sessions are in use.
+
+    """
+
+    def __init__(
+        self,
+        max_size: int = WEBDRIVER_POOL_MAX_SIZE,
+        max_uses: int = WEBDRIVER_POOL_MAX_USES,
+        idle_timeout_seconds: float = WEBDRIVER_POOL_IDLE_TIMEOUT_SECONDS,
+        checkout_timeout_seconds: float = WEBDRIVER_POOL_CHECKOUT_TIMEOUT_SECONDS,
+        driver_factory=initialise_driver
+    ) -> None:
+        self.max_size = max_size
+        self.max_uses = max_uses
+        self.idle_timeout_seconds = idle_timeout_seconds
+        self.checkout_timeout_seconds = checkout_timeout_seconds
+        self.driver_factory = driver_factory
+
+        self.condition = threading.Condition()
+        # Most recently returned sessions are on the right, so checkouts reuse the warmest one
+        self.idle = deque()
+        self.in_use = {}
+        self.n_open = 0
+        self.reaper = None
+        self.closed = False
+
+        self.metrics = {
+            'checkouts': 0,
+            'checkout_timeouts': 0,
+            'wait_seconds_total': 0.0,
+            'wait_seconds_max': 0.0,
+            'sessions_created': 0,
+            'sessions_recycled': 0,
+            'sessions_evicted_idle': 0,
+            'sessions_discarded_unhealthy': 0,
+        }
+
+    def _start_reaper(self) -> None:
+        # Background thread closing idle sessions, started with the first session
+        if self.reaper is None and self.idle_timeout_seconds:
+            self.reaper = threading.Thread(
+                target=self._reap_idle, daemon=True)
+            self.reaper.start()
+
+    def _reap_idle(self) -> None:
+        while not self.closed:
+            time.sleep(self.idle_timeout_seconds / 2)
+            self.evict_idle()
+
+    @staticmethod
+    def _quit(pooled_driver: PooledDriver) -> None:
+        try:
+            pooled_driver.driver.quit()
+        except WebDriverException as e:
+            logger.warning(f'Failed to quit WebDriver session: {e}')
+
+    def _is_healthy(self, pooled_driver: PooledDriver) -> bool:
+        # A session is healthy when it still responds, and is put back on the search page if it navigated away
+        driver = pooled_driver.driver
+        try:
+            try:
+                driver.switch_to.alert.dismiss()
+            except WebDriverException:
+                pass
+            if not driver.current_url.startswith(CCASS_SHAREHOLDING_SEARCH_URL):
+                driver.get(CCASS_SHAREHOLDING_SEARCH_URL)
+            return True
+        except WebDriverException as e:
+            logger.warning(f'Discarding unhealthy WebDriver session: {e}')
+            return False
+
+    def evict_idle(self) -> None:
+        """ Closes sessions that have been idle for longer than idle_timeout_seconds. """
+        expired = []
+        with self.condition:
+            now = time.monotonic()
+            while self.idle and now - self.idle[0].last_used_at > self.idle_timeout_seconds:
+                expired.append(self.idle.popleft())
+            self.n_open -= len(expired)
+            self.metrics['sessions_evicted_idle'] += len(expired)
+            if expired:
+                self.condition.notify(len(expired))
+        for pooled_driver in expired:
+            self._quit(pooled_driver)
+
+    def checkout(self) -> selenium.webdriver:
+        """ Takes a session from the pool, starting a new one if the pool isn't full.
+
+        Raises:
+            TimeoutError: When no session became available within checkout_timeout_seconds.
+
+        Returns:
+            selenium.webdriver: WebDriver session on the CCASS search page.
+
+        """
+        started_at = time.monotonic()
+        deadline = started_at + self.checkout_timeout_seconds
+        while True:
+            pooled_driver = None
+            create = False
+            with self.condition:
+                while not self.idle and self.n_open >= self.max_size:
+                    remaining_seconds = deadline - time.monotonic()
+                    if remaining_seconds <= 0:
+                        self.metrics['checkout_timeouts'] += 1
+                        raise TimeoutError(
+                            f'No WebDriver session available after {self.checkout_timeout_seconds}s')
+                    self.condition.wait(remaining_seconds)
+                if self.idle:
+                    pooled_driver = self.idle.pop()
+                else:
+                    self.n_open += 1
+                    create = True
+
+            if create:
+                try:
+                    pooled_driver = PooledDriver(self.driver_factory())
+                except BaseException:
+                    with self.condition:
+                        self.n_open -= 1
+                        self.condition.notify()
+                    raise
+                with self.condition:
+                    self.metrics['sessions_created'] += 1
+                    self._start_reaper()
+            elif not self._is_healthy(pooled_driver):
+                self._discard(pooled_driver, 'sessions_discarded_unhealthy')
+                continue
+
+            wait_seconds = time.monotonic() - started_at
+            with self.condition:
+                self.in_use[id(pooled_driver.driver)] = pooled_driver
+                self.metrics['checkouts'] += 1
+                self.metrics['wait_seconds_total'] += wait_seconds
+                self.metrics['wait_seconds_max'] = max(
+                    self.metrics['wait_seconds_max'], wait_seconds)
+            return pooled_driver.driver
+
+    def _discard(self, pooled_driver: PooledDriver, metric: str) -> None:
+        with self.condition:
+            self.n_open -= 1
+            self.metrics[metric] += 1
+            self.condition.notify()
+        self._quit(pooled_driver)
+
+    def checkin(self, driver: selenium.webdriver, healthy: bool = True) -> None:
+        """ Returns a session to the pool.
+
+        Args:
+            driver (selenium.webdriver): Session previously returned by checkout().
+            healthy (bool, optional): False to discard the session, e.g. after a WebDriver error. Defaults to True.
+
+        """
+        with self.condition:
+            pooled_driver = self.in_use.pop(id(driver))
+            pooled_driver.uses += 1
+            pooled_driver.last_used_at = time.monotonic()
+            if healthy and pooled_driver.uses < self.max_uses and not self.closed:
+                self.idle.append(pooled_driver)
+                self.condition.notify()
+                return
+
+        if not healthy:
+            self._discard(pooled_driver, 'sessions_discarded_unhealthy')
+        else:
+            self._discard(pooled_driver, 'sessions_recycled')
+
+    @contextmanager
+    def driver(self) -> selenium.webdriver:
+        """ Context manager checking out a session and returning it to the pool afterwards.
+
+        The session is discarded when a WebDriverException other than an unexpected alert escapes the block.
+
+        """
+        driver = self.checkout()
+        healthy = True
+        try:
+            yield driver
+        except UnexpectedAlertPresentException:
+            raise
+        except WebDriverException:
+            healthy = False
+            raise
+        finally:
+            self.checkin(driver, healthy=healthy)
+
+    def close(self) -> None:
+        """ Closes all idle sessions. Sessions in use are closed when they are checked in. """
+        with self.condition:
+            self.closed = True
+            idle = list(self.idle)
+            self.idle.clear()
+            self.n_open -= len(idle)
+        for pooled_driver in idle:
+            self._quit(pooled_driver)
+
+    def get_metrics(self) -> dict:
+        """ Returns the pool's counters and current occupancy.
+
+        Returns:
+            dict: Metrics for sizing the pool, e.g. against the Selenium Grid node's max sessions.
+
+        """
+        with self.condition:
+            metrics = dict(self.metrics)
+            metrics.update({
+                'max_size': self.max_size,
+                'sessions_open': self.n_open,
+                'sessions_idle': len(self.idle),
+                'sessions_in_use': len(self.in_use),
+                'wait_seconds_mean': metrics['wait_seconds_total'] / metrics['checkouts'] if metrics['checkouts'] else 0.0,
+            })
+        return metrics
+
+
+# Process-wide pool shared by the Dash app callbacks and prepopulate_db workers
+_webdriver_pool = None
+_webdriver_pool_lock = threading.Lock()
+
+
+def get_webdriver_pool() -> WebDriverPool:
+    """ Returns the process-wide WebDriverPool, creating it on first use.
+
+    Returns:
+        WebDriverPool: Shared pool of WebDriver sessions.
+
+    """
+    global _webdriver_pool
+    with _webdriver_pool_lock:
+        if _webdriver_pool is None:
+            _webdriver_pool = WebDriverPool()
+        return _webdriver_pool
@@ -0,0 +1,4 @@
+from app import app
+
+# WSGI entry point of the Dash app, e.g. gunicorn -c gunicorn.conf.py wsgi:application
+application = app.server